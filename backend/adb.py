@@ -0,0 +1,78 @@
+"""
+adb.py — Async facade over the configured storage backend for the FastAPI routes.
+
+Blocking backends (SQLite) run on a small dedicated executor instead of
+Starlette's shared threadpool, so SQLite I/O and waits on the writer locks
+never hold a request slot. Cache hits in get_user, and every call on a
+non-blocking backend (memory), are answered on the event loop directly.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import storage
+import tracing
+
+DB_WORKERS = int(os.environ.get("FRACTALAUTH_DB_WORKERS",
+                                os.environ.get("FRACTALAUTH_DB_POOL_SIZE", "8")))
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="fractalauth-db")
+
+
+async def run(fn, *args, **kwargs):
+    """Run any blocking storage-layer callable on the DB executor."""
+    loop = asyncio.get_running_loop()
+    call = functools.partial(fn, *args, **kwargs)
+    if tracing.ENABLED:      # carry the active trace over to the DB thread
+        call = functools.partial(contextvars.copy_context().run, call)
+    return await loop.run_in_executor(_executor, call)
+
+
+def _offload(name: str):
+    async def wrapper(*args, **kwargs):
+        store = storage.get_storage()
+        fn = getattr(store, name)
+        if not store.blocking:
+            return fn(*args, **kwargs)
+        return await run(fn, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = name
+    return tracing.traced(f"adb.{name}")(wrapper)
+
+
+user_exists      = _offload("user_exists")
+create_user      = _offload("create_user")
+update_field     = _offload("update_field")
+update_many      = _offload("update_many")
+increment_failed = _offload("increment_failed")
+reset_failed     = _offload("reset_failed")
+delete_user      = _offload("delete_user")
+record_attempt   = _offload("record_attempt")
+count_failures   = _offload("count_failures")
+_load_user       = _offload("load_user")
+_get_fields      = _offload("get_fields")
+
+
+@tracing.traced("adb.get_user")
+@metrics.timed(metrics.DB_SECONDS, "get_user")
+async def get_user(username: str):
+    cached = storage.get_storage().cached_user(username)
+    if cached is not None:
+        return cached
+    return await _load_user(username)
+
+
+@tracing.traced("adb.get_fields")
+@metrics.timed(metrics.DB_SECONDS, "get_fields")
+async def get_fields(username: str, *fields: str):
+    cached = storage.get_storage().cached_user(username)
+    if cached is not None:
+        return cached
+    return await _get_fields(username, fields)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
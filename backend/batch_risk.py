@@ -0,0 +1,340 @@
+"""
+batch_risk.py — Vectorized Level 3 + Level 4 risk scoring and a replay CLI.
+
+`score_batch` applies exactly the rules of main.behavioral_risk /
+main.contextual_risk (the compiled rule file, rules.py) to columnar NumPy batches (no per-row Python, no log
+strings), so historical attempts can be replayed by the million to tune
+weights and the puzzle/risk-level thresholds. `check_parity` runs the scalar
+functions on the same records and reports any disagreement.
+
+Attempt records are NDJSON, one per line:
+
+    {"username": "bob", "hour": 14, "recent_failures": 0,
+     "ip": "10.0.0.7", "ua": "Mozilla/5.0 ...",
+     "registered_ip": "10.0.0.5", "registered_ua": "Mozilla/5.0 ...",
+     "known_devices": ["3f2a…", ...],             # optional, hex devices.fingerprint
+     "behavior": {"mouse_speeds": [...], "pause_durations": [...],
+                  "click_count": 3, "fractal_time_ms": 6100.0},
+     "profile":  {"avg_mouse_speed": 0.3, "avg_pause_ms": 850,
+                  "fractal_time_ms": 6000.0, "click_count": 3},
+     "label": 0}                                  # optional, 1 = attack
+
+`profile` is the stored behavior_profile, snapshot or learned (profiles.py);
+`known_devices` lists the fingerprints in the user's known_devices column
+(devices.entries), which the ua_changed rule accepts without a penalty.
+
+Usage (from backend/):
+    python batch_risk.py attempts.ndjson --out scores.csv --curves curves.csv
+    python batch_risk.py attempts.ndjson --parity 5000 --hard-at 45
+    python batch_risk.py - --beh-weights 0.3,0.2,0.3,0.2 --beh-share 0.6 < attempts.ndjson
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+
+import devices
+import geoip
+import profiles
+import rules
+
+# Defaults come from the active rule file; check_parity fails if it changes under us.
+_RULES        = rules.current()
+BEH_WEIGHTS   = tuple(_RULES.weights.get(k, 0) for k in rules.INPUTS)   # speed, pause, time, clicks
+BEH_SHARE     = _RULES.behavioral_share    # composite = beh × share + ctx × (1 − share)
+HARD_AT       = _RULES.hard_puzzle_at
+HIGH_AT       = _RULES.high_risk_at
+MEDIUM_AT     = _RULES.medium_risk_at
+
+
+def _mean(values, default):
+    # statistics.mean (what main.py uses) sums with Fractions and dominates the
+    # replay time; fsum/len matches it exactly whenever the sum is representable
+    # and otherwise within 1 ulp, which check_parity would surface.
+    return math.fsum(values) / len(values) if values else default
+
+
+# column suffix → profile metric; n_/c_/s_ columns hold profiles.baseline()
+_LEARNED = (("speed", "avg_mouse_speed"), ("pause", "avg_pause_ms"),
+            ("time", "fractal_time_ms"), ("clicks", "click_count"))
+
+
+def columns_from_records(records: list) -> dict:
+    """Turn a list of attempt records into the column arrays score_batch expects."""
+    n = len(records)
+    num = {k: np.empty(n) for k in ("cur_speed", "cur_pause", "cur_time", "cur_clicks",
+                                     "ref_speed", "ref_pause", "ref_time", "ref_clicks",
+                                     "hour", "failures",
+                                     *(f"{p}_{name}" for name, _ in _LEARNED for p in "ncs"))}
+    text = {k: [] for k in ("ip", "ua", "reg_ip", "reg_ua")}
+    known = np.zeros(n, dtype=bool)
+    for i, r in enumerate(records):
+        beh  = r.get("behavior") or {}
+        prof = r.get("profile") or {}
+        num["cur_speed"][i]  = _mean(beh.get("mouse_speeds"), 0)
+        num["cur_pause"][i]  = _mean(beh.get("pause_durations"), 1000)
+        num["cur_time"][i]   = beh.get("fractal_time_ms", 5000.0)
+        num["cur_clicks"][i] = beh.get("click_count", 3)
+        num["ref_speed"][i]  = prof.get("avg_mouse_speed") or 0
+        num["ref_pause"][i]  = prof.get("avg_pause_ms") or 0
+        num["ref_time"][i]   = prof.get("fractal_time_ms") or 0
+        num["ref_clicks"][i] = prof.get("click_count") or 0
+        for name, key in _LEARNED:
+            num[f"n_{name}"][i], num[f"c_{name}"][i], num[f"s_{name}"][i] = \
+                profiles.baseline(prof, key)
+        num["hour"][i]       = r.get("hour", 12)
+        num["failures"][i]   = r.get("recent_failures", 0)
+        text["ip"].append(r.get("ip") or "")
+        text["ua"].append(r.get("ua") or "")
+        text["reg_ip"].append(r.get("registered_ip") or "")
+        text["reg_ua"].append(r.get("registered_ua") or "")
+        if r.get("known_devices") and r.get("ua"):
+            known[i] = devices.fingerprint(r["ua"]).hex() in r["known_devices"]
+    cols = {**num, **{k: np.array(v, dtype=str) for k, v in text.items()}, "device_known": known}
+    cols["label"] = np.array([bool(r.get("label")) for r in records])
+    cols["username"] = [r.get("username", "") for r in records]
+    return cols
+
+
+def _deviation(c, name, weight, no_baseline=_RULES.no_baseline_risk):
+    cur, ref = c[f"cur_{name}"], c[f"ref_{name}"]
+    n, centre, std = c[f"n_{name}"], c[f"c_{name}"], c[f"s_{name}"]
+    has  = ref > 0
+    safe = np.where(has, ref, 1.0)
+    risk = np.minimum(100, np.abs(cur - safe) / (safe + 1e-9) * 100)
+    learned = (n >= profiles.MIN_SAMPLES) & (std > 0)
+    zrisk = np.minimum(100, np.abs(cur - centre) / np.where(learned, std, 1.0)
+                       / profiles.Z_FULL * 100)
+    return np.where(learned, zrisk * weight, np.where(has, risk * weight, no_baseline * weight))
+
+
+def _subnet(ips):
+    head, sep, _ = (np.char.rpartition(ips, ".")[..., k] for k in range(3))
+    return np.where(sep == "", ips, head)
+
+
+def behavioral_batch(c: dict, weights=BEH_WEIGHTS) -> np.ndarray:
+    w_speed, w_pause, w_time, w_clicks = weights
+    total = (_deviation(c, "speed", w_speed)
+             + _deviation(c, "pause", w_pause)
+             + _deviation(c, "time", w_time)
+             + _deviation(c, "clicks", w_clicks))
+    return np.minimum(100, np.round(total)).astype(np.int64)
+
+
+def _ctx_hour(c, rule):
+    return np.where((c["hour"] < rule["from"]) | (c["hour"] >= rule["to"]), rule["score"], 0)
+
+
+def _ctx_failures(c, rule):
+    out = np.zeros(len(c["failures"]))
+    for tier in sorted(rule["tiers"], key=lambda t: t["at"]):     # highest tier written last wins
+        out = np.where(c["failures"] >= tier["at"], tier["score"], out)
+    return out
+
+
+def _ctx_ua(c, rule):
+    ua, reg_ua = c["ua"], c["reg_ua"]
+    return np.where(c["device_known"], 0,
+                    np.where((reg_ua != "") & (ua != "") & (reg_ua != ua), rule["score"],
+                             np.where(reg_ua == "", rule.get("unknown_score", 0), 0)))
+
+
+def _ctx_ip(c, rule):
+    ip, reg_ip = c["ip"], c["reg_ip"]
+    return np.where((reg_ip != "") & (ip != "") & (reg_ip != ip), rule["score"], 0)
+
+
+def _ctx_subnet(c, rule):
+    ip, reg_ip = c["ip"], c["reg_ip"]
+    return np.where((reg_ip != "") & (ip != "") & (_subnet(reg_ip) != _subnet(ip)), rule["score"], 0)
+
+
+def _ctx_geo(c, rule):
+    # Look every distinct address up once, then compare per row as rules._geo_changed does.
+    ip, reg_ip = c["ip"], c["reg_ip"]
+    uniq, inv = np.unique(np.concatenate((ip, reg_ip)), return_inverse=True)
+    found = [geoip.lookup(a) for a in uniq.tolist()]
+    known = np.array([g is not None for g in found])
+    label = np.array(["\x1f".join(g) if g else "" for g in found], dtype=str)
+    net   = np.array([geoip.network(a) for a in uniq.tolist()], dtype=str)
+    a, b  = inv[:len(ip)], inv[len(ip):]
+    differ = np.where(known[a] & known[b], label[a] != label[b], net[a] != net[b])
+    return np.where((reg_ip != "") & (ip != "") & differ, rule["score"], 0)
+
+
+# rules.CONTEXT_KINDS, column-wise
+_CTX_BATCH = {"hour_outside": _ctx_hour, "failures": _ctx_failures, "ua_changed": _ctx_ua,
+              "ip_changed": _ctx_ip, "geo_changed": _ctx_geo,
+              "subnet_changed": _ctx_subnet}
+
+
+def contextual_batch(c: dict, ruleset: rules.RuleSet = _RULES) -> np.ndarray:
+    total = np.zeros(len(c["hour"]))
+    for rule in ruleset.contextual_rules:
+        total += _CTX_BATCH[rule["kind"]](c, rule)
+    return np.minimum(100, np.round(total)).astype(np.int64)
+
+
+def score_batch(c: dict, weights=BEH_WEIGHTS, beh_share: float = BEH_SHARE) -> dict:
+    """Score a columnar batch; returns int arrays behavioral/contextual/composite."""
+    beh = behavioral_batch(c, weights)
+    ctx = contextual_batch(c)
+    composite = np.round(beh * beh_share + ctx * (1 - beh_share)).astype(np.int64)
+    return {"behavioral": beh, "contextual": ctx, "composite": composite}
+
+
+def stored_user(r: dict) -> dict:
+    """The user-row columns main.contextual_risk reads, rebuilt from an attempt record."""
+    known = r.get("known_devices") or []
+    blob = b""
+    for fp in known:
+        blob = devices.remember(blob, bytes.fromhex(fp), now=0, limit=max(len(known), 1))
+    return {"registered_ip": r.get("registered_ip") or "",
+            "registered_ua": r.get("registered_ua") or "", "known_devices": blob}
+
+
+def check_parity(records: list) -> list[str]:
+    """Score `records` with main.py's scalar functions and the batch path; list mismatches."""
+    import main
+
+    problems = []
+    live = rules.current()
+    if live.version != _RULES.version:
+        problems.append(f"rule file changed since import: batch {_RULES.version} != live {live.version}")
+    batch = score_batch(columns_from_records(records))
+    for i, r in enumerate(records):
+        beh  = r.get("behavior") or {}
+        cur  = main.BehaviorPayload(**{k: v for k, v in beh.items()
+                                       if k in main.BehaviorPayload.model_fields})
+        b = main.behavioral_risk(r.get("profile") or {}, cur)["risk"]
+        x = main.contextual_risk(r.get("username", ""), r.get("ip") or "", r.get("ua") or "",
+                                 r.get("hour", 12), stored_user(r), r.get("recent_failures", 0))["risk"]
+        comp = main.composite_risk(b, x)
+        got = (batch["behavioral"][i], batch["contextual"][i], batch["composite"][i])
+        if got != (b, x, comp):
+            problems.append(f"record {i} ({r.get('username', '')}): scalar {(b, x, comp)} "
+                            f"!= batch {tuple(int(v) for v in got)}")
+    return problems
+
+
+class Curves:
+    """Histogram of composite scores (per label) → flag counts at every threshold."""
+
+    def __init__(self):
+        self.all = np.zeros(101, dtype=np.int64)
+        self.pos = np.zeros(101, dtype=np.int64)
+        self.labelled = False
+
+    def add(self, composite: np.ndarray, label: np.ndarray):
+        self.all += np.bincount(composite, minlength=101)
+        self.pos += np.bincount(composite[label], minlength=101)
+        self.labelled |= bool(label.any())
+
+    def rows(self):
+        """(threshold, flagged, flagged_rate, tp, fp, tpr, fpr) for threshold 0..100."""
+        flagged = self.all[::-1].cumsum()[::-1]          # attempts with composite ≥ t
+        tp = self.pos[::-1].cumsum()[::-1]
+        fp = flagged - tp
+        n, n_pos = int(self.all.sum()), int(self.pos.sum())
+        for t in range(101):
+            tpr = tp[t] / n_pos if self.labelled and n_pos else ""
+            fpr = fp[t] / (n - n_pos) if self.labelled and n > n_pos else ""
+            yield t, int(flagged[t]), flagged[t] / n if n else 0, int(tp[t]), int(fp[t]), tpr, fpr
+
+
+def _read_records(fh):
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def replay(path: str, out: str | None, curves_path: str | None, batch_size: int = 65536,
+           weights=BEH_WEIGHTS, beh_share: float = BEH_SHARE, hard_at: int = HARD_AT,
+           high_at: int = HIGH_AT, medium_at: int = MEDIUM_AT, parity: int = 0) -> dict:
+    fh  = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    dst = None if out is None else sys.stdout if out == "-" else open(out, "w", newline="")
+    writer = csv.writer(dst) if dst else None
+    if writer:
+        writer.writerow(("username", "behavioral", "contextual", "composite",
+                         "difficulty", "risk_level", "label"))
+    curves, n, mismatches = Curves(), 0, []
+    t0 = time.perf_counter()
+    try:
+        records = _read_records(fh)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            if parity > n:
+                mismatches += check_parity(batch[:parity - n])
+            cols = columns_from_records(batch)
+            s = score_batch(cols, weights, beh_share)
+            comp = s["composite"]
+            curves.add(comp, cols["label"])
+            if writer:
+                difficulty = np.where(comp >= hard_at, "hard", "easy")
+                level = np.where(comp >= high_at, "HIGH", np.where(comp >= medium_at, "MEDIUM", "LOW"))
+                writer.writerows(zip(cols["username"], s["behavioral"].tolist(),
+                                     s["contextual"].tolist(), comp.tolist(),
+                                     difficulty.tolist(), level.tolist(),
+                                     cols["label"].astype(int).tolist()))
+            n += len(batch)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+        if dst not in (None, sys.stdout):
+            dst.close()
+    elapsed = time.perf_counter() - t0
+    if curves_path:
+        with open(curves_path, "w", newline="") as cf:
+            cw = csv.writer(cf)
+            cw.writerow(("threshold", "flagged", "flagged_rate", "tp", "fp", "tpr", "fpr"))
+            cw.writerows(curves.rows())
+    return {"rows": n, "seconds": elapsed, "mismatches": mismatches, "curves": curves}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Replay login attempts through the risk scorer")
+    ap.add_argument("path", help="NDJSON attempt records ('-' for stdin)")
+    ap.add_argument("--out", help="per-attempt scores CSV ('-' for stdout)")
+    ap.add_argument("--curves", help="threshold curve CSV (flag rate, TPR/FPR per threshold)")
+    ap.add_argument("--batch-size", type=int, default=65536)
+    ap.add_argument("--beh-weights", default=",".join(map(str, BEH_WEIGHTS)),
+                    help="mouse speed,pause,fractal time,clicks")
+    ap.add_argument("--beh-share", type=float, default=BEH_SHARE)
+    ap.add_argument("--hard-at", type=int, default=HARD_AT)
+    ap.add_argument("--high-at", type=int, default=HIGH_AT)
+    ap.add_argument("--medium-at", type=int, default=MEDIUM_AT)
+    ap.add_argument("--parity", type=int, default=0, metavar="N",
+                    help="cross-check the first N records against main.py's scalar scorer")
+    args = ap.parse_args()
+
+    weights = tuple(float(w) for w in args.beh_weights.split(","))
+    if len(weights) != 4:
+        ap.error("--beh-weights needs four comma-separated values")
+    res = replay(args.path, args.out, args.curves, args.batch_size, weights, args.beh_share,
+                 args.hard_at, args.high_at, args.medium_at, args.parity)
+    print(f"replayed {res['rows']:,} attempts in {res['seconds']:.2f}s "
+          f"({res['rows'] / res['seconds'] if res['seconds'] else 0:,.0f}/s)", file=sys.stderr)
+    for t, flagged, rate, *_ in res["curves"].rows():
+        if t in (args.medium_at, args.hard_at, args.high_at):
+            print(f"  composite ≥ {t:>3}: {flagged:,} ({rate:.1%})", file=sys.stderr)
+    if args.parity:
+        for m in res["mismatches"][:20]:
+            print(f"  PARITY {m}", file=sys.stderr)
+        print(f"parity: {len(res['mismatches'])} mismatches in "
+              f"{min(args.parity, res['rows']):,} records", file=sys.stderr)
+        if res["mismatches"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+bench_batch_risk.py — scalar vs vectorized risk scoring on synthetic attempts.
+
+Generates random attempt records (a mix of genuine users — some logging in
+from a second, already known device — and attackers with shifted behaviour,
+new devices/IPs and odd hours), checks that batch_risk
+agrees with main.py on every one of them, then times both scorers. Run from
+backend/:
+    python benchmarks/bench_batch_risk.py --records 200000
+    python benchmarks/bench_batch_risk.py --records 1000000 --write attempts.ndjson
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "bench_batch_risk.db"))
+
+import batch_risk  # noqa: E402
+import devices  # noqa: E402
+import profiles  # noqa: E402
+
+PHONE = "Mozilla/5.0 (iPhone)"
+
+
+def synthesize(n: int, seed: int = 7, attack_rate: float = 0.1):
+    rng = random.Random(seed)
+    for i in range(n):
+        attack = rng.random() < attack_rate
+        base = {"avg_mouse_speed": rng.uniform(0.1, 0.6), "avg_pause_ms": rng.uniform(300, 1500),
+                "fractal_time_ms": rng.uniform(3000, 12000), "click_count": rng.randint(3, 6)}
+        if rng.random() < 0.05:
+            base = {}                                    # no baseline recorded
+        elif rng.random() < 0.5:                         # profile learned over past logins
+            snapshot = dict(base, zoom_count=1)
+            for _ in range(rng.randint(1, 12)):
+                base = profiles.update(base, {k: v * rng.uniform(0.85, 1.15) if v else v
+                                              for k, v in snapshot.items()})
+        drift = rng.uniform(0.5, 2.5) if attack else rng.uniform(0.8, 1.25)
+        speed = base.get("avg_mouse_speed", 0.3) * drift
+        pause = base.get("avg_pause_ms", 800) / drift
+        reg_ip = f"10.{i % 200}.{i % 7}.{i % 250 + 1}"
+        known = [devices.fingerprint(PHONE).hex()] if rng.random() < 0.3 else []
+        yield {
+            "username": f"user{i}",
+            "hour": rng.choice(range(24)) if attack else rng.randint(7, 22),
+            "recent_failures": rng.randint(0, 6) if attack else rng.choice((0, 0, 0, 1)),
+            "ip": f"172.16.{rng.randint(0, 255)}.{rng.randint(1, 254)}" if attack and rng.random() < 0.7
+                  else reg_ip.rsplit(".", 1)[0] + f".{rng.randint(1, 254)}",
+            "ua": "curl/8.0" if attack and rng.random() < 0.5 else rng.choice(("Mozilla/5.0", PHONE)),
+            "registered_ip": reg_ip if rng.random() > 0.02 else "",
+            "registered_ua": "Mozilla/5.0" if rng.random() > 0.02 else "",
+            "known_devices": known,
+            "behavior": {
+                "mouse_speeds": [speed * rng.uniform(0.9, 1.1) for _ in range(rng.randint(0, 5))],
+                "pause_durations": [pause * rng.uniform(0.9, 1.1) for _ in range(rng.randint(0, 5))],
+                "click_count": max(0, round(base.get("click_count", 3) * drift)),
+                "fractal_time_ms": base.get("fractal_time_ms", 6000) * drift,
+            },
+            "profile": base,
+            "label": int(attack),
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--records", type=int, default=200000)
+    ap.add_argument("--scalar", type=int, default=20000, help="records timed on the scalar path")
+    ap.add_argument("--parity", type=int, default=20000, help="records cross-checked")
+    ap.add_argument("--write", help="also dump the synthetic records as NDJSON for batch_risk.py")
+    args = ap.parse_args()
+
+    records = list(synthesize(args.records))
+    if args.write:
+        with open(args.write, "w") as fh:
+            for r in records:
+                fh.write(json.dumps(r, separators=(",", ":")) + "\n")
+
+    t0 = time.perf_counter()
+    problems = batch_risk.check_parity(records[:args.parity])
+    # Offline scoring passes every record in; it must never open (or create) a database.
+    if "db" in sys.modules or os.path.exists(os.environ["FRACTALAUTH_DB"]):
+        problems.append(f"parity run opened the database ({os.environ['FRACTALAUTH_DB']})")
+    print(f"parity: {len(problems)} mismatches in {min(args.parity, len(records)):,} records "
+          f"({time.perf_counter() - t0:.1f}s)")
+    for p in problems[:10]:
+        print(f"  {p}")
+
+    import main as api
+    sample = records[:args.scalar]
+    payloads = [(r["profile"], api.BehaviorPayload(**r["behavior"]), batch_risk.stored_user(r))
+                for r in sample]
+    t0 = time.perf_counter()
+    for r, (prof, beh, user) in zip(sample, payloads):
+        b = api.behavioral_risk(prof, beh)["risk"]
+        x = api.contextual_risk(r["username"], r["ip"], r["ua"], r["hour"], user,
+                                r["recent_failures"])["risk"]
+        api.composite_risk(b, x)
+    scalar = len(sample) / (time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    cols = batch_risk.columns_from_records(records)
+    t1 = time.perf_counter()
+    batch_risk.score_batch(cols)
+    t2 = time.perf_counter()
+
+    print(f"{'path':<26}{'records/s':>14}{'speedup':>9}")
+    print(f"{'scalar (main.py)':<26}{scalar:>14,.0f}{1:>8.1f}x")
+    for label, rate in (("vectorized score only", len(records) / (t2 - t1)),
+                        ("vectorized + columnize", len(records) / (t2 - t0))):
+        print(f"{label:<26}{rate:>14,.0f}{rate / scalar:>8.1f}x")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+bench_db_pool.py — per-call connect vs pooled connections for the db helpers.
+
+Run from backend/:
+    python benchmarks/bench_db_pool.py --users 2000 --ops 20000 --threads 4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "bench_pool.db"))
+
+import db  # noqa: E402
+
+
+def _seed(n: int):
+    pw_hash = db.hash_password("x")
+    with db._lock, db._pool.connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (username,email,password_hash) VALUES (?,?,?)",
+            ((f"user{i}", f"user{i}@example.com", pw_hash) for i in range(n)),
+        )
+        conn.commit()
+
+
+def _per_call_read(username):
+    conn = db.get_conn()
+    conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+    conn.close()
+
+
+def _per_call_write(username):
+    with db._lock:
+        conn = db.get_conn()
+        conn.execute("UPDATE users SET failed_attempts=failed_attempts+1 WHERE username=?", (username,))
+        conn.commit()
+        conn.close()
+
+
+def _pooled_read(username):
+    with db._pool.connection() as conn:
+        conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+
+
+def _pooled_write(username):
+    with db._lock, db._pool.connection() as conn:
+        conn.execute("UPDATE users SET failed_attempts=failed_attempts+1 WHERE username=?", (username,))
+        conn.commit()
+
+
+def _run(fn, users: int, ops: int, threads: int) -> float:
+    per_thread = ops // threads
+
+    def worker(tid):
+        for i in range(per_thread):
+            fn(f"user{(tid * 7919 + i) % users}")
+
+    ts = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return per_thread * threads / (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--users",   type=int, default=2000)
+    ap.add_argument("--ops",     type=int, default=20000)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--write-ratio", type=float, default=0.1,
+                    help="fraction of ops that are counter UPDATEs")
+    args = ap.parse_args()
+
+    _seed(args.users)
+    n_writes = int(args.ops * args.write_ratio)
+    n_reads  = args.ops - n_writes
+    print(f"db={db.DB_PATH}  journal={db.JOURNAL_MODE}  synchronous={db.SYNCHRONOUS}  "
+          f"pool={db.POOL_SIZE}  threads={args.threads}")
+    print(f"{'mode':<10}{'op':<8}{'ops/s':>12}")
+    for label, read, write in (("per-call", _per_call_read, _per_call_write),
+                               ("pooled",   _pooled_read,   _pooled_write)):
+        if n_reads:
+            print(f"{label:<10}{'read':<8}{_run(read, args.users, n_reads, args.threads):>12,.0f}")
+        if n_writes:
+            print(f"{label:<10}{'write':<8}{_run(write, args.users, n_writes, args.threads):>12,.0f}")
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
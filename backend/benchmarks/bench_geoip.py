@@ -0,0 +1,87 @@
+"""
+bench_geoip.py — CIDR table build time, memory and lookup latency.
+
+Builds a random table of nested IPv4 and IPv6 networks, checks that every
+sampled lookup agrees with a brute-force longest-prefix match over the
+ipaddress objects, then times lookups. Run from backend/:
+    python benchmarks/bench_geoip.py --networks 200000 --lookups 200000
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geoip  # noqa: E402
+
+
+def random_rows(n: int, rng: random.Random):
+    for i in range(n):
+        if rng.random() < 0.7:
+            prefix = rng.choice((8, 12, 16, 20, 24, 24, 24, 28))
+            net = ipaddress.IPv4Network((rng.getrandbits(32), prefix), strict=False)
+        else:
+            prefix = rng.choice((24, 32, 40, 48, 48, 56))
+            net = ipaddress.IPv6Network((0x2000 << 112 | rng.getrandbits(116), prefix), strict=False)
+        yield str(net), f"R{rng.randrange(250)}", f"AS{rng.randrange(60000)}"
+
+
+def random_ips(n: int, rng: random.Random, nets: list):
+    for _ in range(n):
+        if rng.random() < 0.8:                              # mostly addresses inside some network
+            net = rng.choice(nets)
+            yield str(net.network_address + rng.randrange(min(net.num_addresses, 1 << 30)))
+        elif rng.random() < 0.5:
+            yield str(ipaddress.IPv4Address(rng.getrandbits(32)))
+        else:
+            yield str(ipaddress.IPv6Address(0x2000 << 112 | rng.getrandbits(116)))
+
+
+def brute_force(ip: str, nets: list, labels: list):
+    addr, best = ipaddress.ip_address(ip), None
+    for net, label in zip(nets, labels):
+        if addr.version == net.version and addr in net and (best is None or net.prefixlen >= best[0].prefixlen):
+            best = (net, label)
+    return best[1] if best else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--networks", type=int, default=200000)
+    ap.add_argument("--lookups", type=int, default=200000)
+    ap.add_argument("--check", type=int, default=300, help="lookups cross-checked by brute force")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    rows = list(random_rows(args.networks, rng))
+    t0 = time.perf_counter()
+    table = geoip.GeoTable.from_rows(rows)
+    build = time.perf_counter() - t0
+    print(f"{args.networks:,} networks → {len(table):,} intervals, {len(table.labels):,} labels, "
+          f"~{table.nbytes() / 2**20:.1f} MiB, built in {build:.2f}s")
+
+    nets = [ipaddress.ip_network(c) for c, _, _ in rows]
+    labels = [geoip.Geo(r, a) for _, r, a in rows]
+    ips = list(random_ips(args.lookups, rng, nets))
+    bad = 0
+    for ip in ips[:args.check]:
+        bad += table.lookup(ip) != brute_force(ip, nets, labels)
+    print(f"brute-force check: {bad} mismatches in {min(args.check, len(ips))} lookups")
+
+    for version in (4, 6):
+        sample = [ip for ip in ips if (":" in ip) == (version == 6)]
+        t0 = time.perf_counter()
+        hits = sum(table.lookup(ip) is not None for ip in sample)
+        per = (time.perf_counter() - t0) / max(1, len(sample))
+        print(f"IPv{version}: {len(sample):,} lookups, {hits / max(1, len(sample)):.0%} hit, "
+              f"{per * 1e6:.2f} µs/lookup")
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+bench_hashing.py — password hashing throughput/latency at several scrypt costs.
+
+For each cost N it reports the single-call latency inline, then drives
+`--concurrency` concurrent hash_password_async calls through the process
+pool and reports throughput, p50/p99 latency, how many calls were shed by
+the bounded queue, and the worst event-loop stall seen meanwhile (what the
+API would feel). Run from backend/:
+    python benchmarks/bench_hashing.py --costs 4096 16384 32768 --requests 64
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashing  # noqa: E402
+
+
+def _inline(n: int, rounds: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        hashing.hash_password("correct horse", n=n)
+    return (time.perf_counter() - t0) / rounds
+
+
+async def _loop_stall(stop: asyncio.Event, tick: float = 0.001) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(tick)
+        worst = max(worst, time.perf_counter() - t0 - tick)
+    return worst
+
+
+async def _pooled(requests: int, concurrency: int):
+    lat, shed = [], 0
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal shed
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await hashing.hash_password_async("correct horse")
+            except hashing.HashQueueFull:
+                shed += 1
+                return
+            lat.append(time.perf_counter() - t0)
+
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(_loop_stall(stop))
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    return lat, shed, elapsed, await watcher
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--costs", type=int, nargs="+", default=[2 ** 12, 2 ** 14, 2 ** 15])
+    ap.add_argument("--requests", type=int, default=64)
+    ap.add_argument("--concurrency", type=int, default=16)
+    args = ap.parse_args()
+
+    hashing.warmup()
+    print(f"workers={hashing.HASH_WORKERS} queue={hashing.HASH_QUEUE} "
+          f"r={hashing.SCRYPT_R} p={hashing.SCRYPT_P}")
+    print(f"{'N':>7} {'inline ms':>10} {'hashes/s':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'shed':>5} {'loop stall ms':>14}")
+    try:
+        for n in args.costs:
+            hashing.SCRYPT_N = n
+            single = _inline(n, 3)
+            lat, shed, elapsed, stall = asyncio.run(_pooled(args.requests, args.concurrency))
+            lat.sort()
+            p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))] if lat else 0
+            print(f"{n:>7} {single * 1e3:>10.1f} {len(lat) / elapsed:>9.1f} "
+                  f"{statistics.median(lat) * 1e3 if lat else 0:>8.1f} {p99 * 1e3:>8.1f} "
+                  f"{shed:>5} {stall * 1e3:>14.1f}")
+    finally:
+        hashing.shutdown()
+
+
+if __name__ == "__main__":
+    main()
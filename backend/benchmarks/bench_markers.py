@@ -0,0 +1,91 @@
+"""
+bench_markers.py — Hashed fractal keys vs the plain distance check.
+
+Enrolls random 3-marker keys, then replays genuine attempts (each marker
+jittered by Gaussian noise), near misses (markers 1–2 tolerances away) and
+random guesses through main.markers_match on plain coordinates and on
+markerkey hashes at several grid divisions. It prints false-reject and
+false-accept rates, verify/enroll latency and the stored size per key.
+Run from backend/:
+    python benchmarks/bench_markers.py --keys 2000 --divs 1 2 4
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "bench_markers.db"))
+
+import codec  # noqa: E402
+import main  # noqa: E402
+import markerkey  # noqa: E402
+import rules  # noqa: E402
+
+
+def _marker(rng):
+    return {"fx": rng.uniform(-2.0, 1.0), "fy": rng.uniform(-1.5, 1.5)}
+
+
+def _jitter(markers, rng, sigma):
+    return [main.FractalMarker(fx=m["fx"] + rng.gauss(0, sigma), fy=m["fy"] + rng.gauss(0, sigma))
+            for m in markers]
+
+
+def _near_miss(markers, rng, tol):
+    """One marker moved 1–2 tolerances away, the others exact: should be rejected."""
+    out = [main.FractalMarker(**m) for m in markers]
+    i, angle, dist = rng.randrange(len(out)), rng.uniform(0, 2 * math.pi), rng.uniform(1.0, 2.0) * tol
+    out[i] = main.FractalMarker(fx=markers[i]["fx"] + dist * math.cos(angle),
+                                fy=markers[i]["fy"] + dist * math.sin(angle))
+    return out
+
+
+def main_():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--keys", type=int, default=2000)
+    ap.add_argument("--attempts", type=int, default=5, help="attempts of each kind per key")
+    ap.add_argument("--divs", type=int, nargs="+", default=[1, 2, 4])
+    ap.add_argument("--sigma", type=float, default=0.5, help="genuine jitter, in tolerances")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    tol = rules.current().fractal_threshold
+    rng = random.Random(args.seed)
+    keys = [[_marker(rng) for _ in range(3)] for _ in range(args.keys)]
+    attempts = []
+    for k in keys:
+        for _ in range(args.attempts):
+            attempts.append((k, "genuine", _jitter(k, rng, args.sigma * tol)))
+            attempts.append((k, "near", _near_miss(k, rng, tol)))
+            attempts.append((k, "random", [main.FractalMarker(**_marker(rng)) for _ in range(3)]))
+
+    print(f"tolerance={tol}  keys={args.keys:,}  attempts={len(attempts):,}  "
+          f"genuine jitter σ={args.sigma}·tol")
+    print(f"{'store':<12}{'FRR genuine':>12}{'FAR near':>10}{'FAR random':>11}"
+          f"{'verify µs':>11}{'enroll µs':>11}{'bytes':>7}")
+    for div in [None, *args.divs]:
+        t0 = time.perf_counter()
+        stored = {id(k): k if div is None else markerkey.enroll(k, tol, div) for k in keys}
+        enroll_us = (time.perf_counter() - t0) / len(keys) * 1e6
+        size = sum(len(codec.encode("fractal_markers", v)) for v in stored.values()) / len(keys)
+        counts = {"genuine": [0, 0], "near": [0, 0], "random": [0, 0]}
+        t0 = time.perf_counter()
+        for k, kind, attempt in attempts:
+            c = counts[kind]
+            c[0] += main.markers_match(stored[id(k)], attempt)
+            c[1] += 1
+        verify_us = (time.perf_counter() - t0) / len(attempts) * 1e6
+        frr = 1 - counts["genuine"][0] / counts["genuine"][1]
+        label = "plain" if div is None else f"hashed/{div}"
+        print(f"{label:<12}{frr:>12.2%}{counts['near'][0] / counts['near'][1]:>10.2%}"
+              f"{counts['random'][0] / counts['random'][1]:>11.4%}{verify_us:>11.1f}"
+              f"{'' if div is None else f'{enroll_us:.1f}':>11}{size:>7.0f}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,77 @@
+"""
+bench_ratelimit.py — Cost of the login rate limiter on the request path.
+
+Times ratelimit.check (IP bucket + username bucket) for a hot key and for a
+stream of distinct keys, then throughput with several threads hammering a
+limiter with 1 shard vs FRACTALAUTH_RATE_SHARDS, and finally how many buckets
+stay resident after a flood of one-off keys. Run from backend/:
+    python benchmarks/bench_ratelimit.py --calls 200000 --threads 8 --flood 1000000
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit  # noqa: E402
+
+
+def _per_call_us(fn, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - t0) / n * 1e6
+
+
+def _threaded(limiter, threads, calls):
+    def work(t):
+        hit = limiter.hit
+        for i in range(calls):
+            hit(("level1", f"u{t}-{i % 500}"))
+    ts = [threading.Thread(target=work, args=(t,)) for t in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return threads * calls / (time.perf_counter() - t0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--calls", type=int, default=200_000)
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--flood", type=int, default=1_000_000, help="distinct keys in the flood test")
+    args = ap.parse_args()
+
+    print(f"user {ratelimit.USER_BURST} burst / {ratelimit.USER_PER_MIN:g} per min, "
+          f"ip {ratelimit.IP_BURST} burst / {ratelimit.IP_PER_MIN:g} per min, "
+          f"{ratelimit.SHARDS} shards, max {ratelimit.MAX_KEYS:,} keys")
+    big = 10 ** 9     # generous limits: measure the bookkeeping, not rejections
+    ratelimit.users = ratelimit.TokenBucketLimiter(big, big)
+    ratelimit.ips   = ratelimit.TokenBucketLimiter(big, big)
+    hot  = _per_call_us(lambda i: ratelimit.check("level1", "alice", "203.0.113.7"), args.calls)
+    cold = _per_call_us(lambda i: ratelimit.check("level1", f"user{i}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"),
+                        args.calls)
+    print(f"check(), same user + IP      {hot:6.2f} µs/call")
+    print(f"check(), distinct user + IP  {cold:6.2f} µs/call")
+
+    for shards in (1, ratelimit.SHARDS):
+        lim = ratelimit.TokenBucketLimiter(big, big, shards=shards)
+        rate = _threaded(lim, args.threads, args.calls // args.threads)
+        print(f"{args.threads} threads, {shards:>2} shard(s)      {rate:>10,.0f} hits/s")
+
+    lim = ratelimit.TokenBucketLimiter(ratelimit.IP_PER_MIN, ratelimit.IP_BURST)
+    t0 = time.perf_counter()
+    for i in range(args.flood):
+        lim.hit(("level1", i))
+    took = time.perf_counter() - t0
+    print(f"flood of {args.flood:,} one-off keys: {len(lim):,} buckets resident, "
+          f"{lim.evictions:,} evicted, {took / args.flood * 1e6:.2f} µs/hit")
+
+
+if __name__ == "__main__":
+    main()
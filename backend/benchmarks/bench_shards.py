@@ -0,0 +1,61 @@
+"""
+bench_shards.py — concurrent write throughput vs shard count.
+
+Each thread registers fresh users (create_user + update_many, i.e. two
+commits per user) against the real db helpers, re-configured for every
+shard count. Run from backend/:
+    python benchmarks/bench_shards.py --shards 1 2 4 8 --threads 8 --users 4000
+    python benchmarks/bench_shards.py --synchronous FULL     # fsync-bound commits
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--shards",  type=int, nargs="+", default=[1, 2, 4, 8])
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--users",   type=int, default=4000, help="users registered per run")
+    ap.add_argument("--synchronous", default=None, help="override PRAGMA synchronous")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["FRACTALAUTH_DB"] = os.path.join(tmp, "bench_shards.db")
+    if args.synchronous:
+        os.environ["FRACTALAUTH_DB_SYNCHRONOUS"] = args.synchronous
+    import db
+
+    print(f"threads={args.threads}  users/run={args.users}  synchronous={db.SYNCHRONOUS}")
+    print(f"{'shards':>6}{'writes/s':>12}{'speedup':>9}")
+    base = None
+    for n in args.shards:
+        db.configure(path=os.path.join(tmp, f"run{n}.db"), shards=n)
+        per_thread = args.users // args.threads
+
+        def worker(tid):
+            for i in range(per_thread):
+                name = f"t{tid}-u{i}"
+                db.create_user(name, f"{name}@example.com", "pw")
+                db.update_many(name, {"fractal_type": "julia", "is_complete": 1})
+
+        ts = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+        t0 = time.perf_counter()
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        rate = 2 * per_thread * args.threads / (time.perf_counter() - t0)
+        base = base or rate
+        print(f"{n:>6}{rate:>12,.0f}{rate / base:>8.2f}x")
+    db.shutdown()
+
+
+if __name__ == "__main__":
+    main()
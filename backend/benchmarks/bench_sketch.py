@@ -0,0 +1,117 @@
+"""
+bench_sketch.py — QuantileSketch update cost and accuracy vs exact percentiles.
+
+For several synthetic behaviour series (mouse speeds, the pause poller's runs
+of growing gaps, click intervals) it reports the sketch's update rate next to
+appending to a list, the bins kept, and the worst relative error of
+p10/p50/p90 against exact percentiles — for one sketch and for a baseline
+merged from many per-login sketches. It first checks that non-finite and
+extreme inputs are ignored or clamped rather than raising. Run from backend/:
+    python benchmarks/bench_sketch.py --values 200000 --logins 500
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sketch  # noqa: E402
+
+
+def _speeds(rng):
+    return lambda: rng.lognormvariate(-1.3, 0.5)
+
+
+def _pauses(rng):
+    # the page polls every 500 ms, so one idle stretch is reported as 500, 1000, 1500, …
+    def draw():
+        if rng.random() < 0.3:
+            return 500 * rng.randint(1, 20) + rng.uniform(0, 40)
+        return rng.uniform(300, 1500)
+    return draw
+
+
+def _intervals(rng):
+    return lambda: rng.expovariate(1 / 900) + 80
+
+
+SERIES = (("mouse_speeds", _speeds), ("pause_durations", _pauses), ("action_intervals", _intervals))
+
+
+def _exact(sorted_xs, q):
+    return sorted_xs[round(q * (len(sorted_xs) - 1))]
+
+
+def _worst_error(sk, xs) -> float:
+    s = sorted(xs)
+    return max(abs(sk.quantile(q) - _exact(s, q)) / _exact(s, q) for q in sketch.QUANTILES)
+
+
+def check_edge_cases() -> list[str]:
+    """NaN / ±inf are ignored and quantiles stay finite however large the input."""
+    problems = []
+    sk = sketch.QuantileSketch().extend([float("nan"), float("inf"), -float("inf")])
+    if sk.count or sk.quantile(0.5) is not None:
+        problems.append(f"non-finite values were counted: {sk!r}")
+    sk = sketch.QuantileSketch().extend([1.0, 1e308, 1e308, sys.float_info.max, float("nan")])
+    qs = [sk.quantile(q) for q in (0.0, 0.5, 1.0)]
+    if sk.count != 4 or not all(math.isfinite(q) for q in qs):
+        problems.append(f"huge values: count {sk.count}, quantiles {qs}")
+    merged = sketch.QuantileSketch.from_list(sk.to_list()).merge(sk)
+    if not all(math.isfinite(v) for v in merged.features().values()):
+        problems.append(f"merged huge values: {merged.features()}")
+    return problems
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--values", type=int, default=200000, help="samples per series")
+    ap.add_argument("--logins", type=int, default=500, help="per-login sketches merged into a baseline")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    problems = check_edge_cases()
+    for p in problems:
+        print(f"FAIL {p}")
+    if problems:
+        sys.exit(1)
+    print(f"alpha={sketch.ALPHA} max_bins={sketch.MAX_BINS}")
+    print(f"{'series':<18}{'adds/s':>12}{'list/s':>12}{'bins':>6}{'max err':>9}"
+          f"{'merged err':>12}{'merge µs':>10}")
+    for name, make in SERIES:
+        rng = random.Random(args.seed)
+        draw = make(rng)
+        xs = [draw() for _ in range(args.values)]
+
+        t0 = time.perf_counter()
+        sk = sketch.QuantileSketch()
+        for x in xs:
+            sk.add(x)
+        adds = len(xs) / (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        kept = []
+        for x in xs:
+            kept.append(x)
+        kept.sort()
+        listed = len(xs) / (time.perf_counter() - t0)
+
+        per_login = max(1, len(xs) // args.logins)
+        parts = [sketch.QuantileSketch().extend(xs[i:i + per_login]).to_list()
+                 for i in range(0, len(xs), per_login)]
+        t0 = time.perf_counter()
+        merged = sketch.QuantileSketch()
+        for part in parts:
+            merged.merge(sketch.QuantileSketch.from_list(part))
+        merge_us = (time.perf_counter() - t0) / len(parts) * 1e6
+
+        print(f"{name:<18}{adds:>12,.0f}{listed:>12,.0f}{len(sk.counts):>6}"
+              f"{_worst_error(sk, xs):>8.2%}{_worst_error(merged, xs):>11.2%}{merge_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+bench_storage.py — full register + login flow against each storage backend.
+
+Drives the FastAPI app in-process (TestClient) so route, validation and
+storage costs are all included. Every backend must pass the conformance
+checks before it is timed. The login rate limiter is switched off: every
+TestClient request comes from the same client address. Run from backend/:
+    python benchmarks/bench_storage.py --users 300 --logins 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "bench_storage.db"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main as api  # noqa: E402
+import ratelimit  # noqa: E402
+import storage  # noqa: E402
+from storage_conformance import MARKERS, PUZZLE, fresh_store, run_conformance  # noqa: E402
+
+BEHAVIOR = {"mouse_speeds": [0.3, 0.25, 0.28], "pause_durations": [800, 1000, 600],
+            "click_count": 3, "zoom_count": 1, "fractal_time_ms": 6000.0}
+
+
+def _register(c, u):
+    c.post("/register/level1", json={"username": u, "email": f"{u}@example.com",
+                                     "password": "Passw0rd!"}).raise_for_status()
+    c.post("/register/level2", json={"username": u, "fractal_type": "mandelbrot",
+                                     "markers": MARKERS}).raise_for_status()
+    c.post("/register/behavior", json={"username": u, **BEHAVIOR}).raise_for_status()
+    c.post("/register/puzzles", json={"username": u, "easy_puzzle": PUZZLE,
+                                      "hard_puzzle": PUZZLE}).raise_for_status()
+
+
+def _step(c, path, body):
+    r = c.post(path, json=body)
+    r.raise_for_status()
+    return r.json().get("token")
+
+
+def _login(c, u):
+    tok = _step(c, "/login/level1", {"username": u, "password": "Passw0rd!"})
+    tok = _step(c, "/login/level2", {"token": tok, "markers": MARKERS})
+    tok = _step(c, "/login/risk-assessment", {"token": tok, "behavior": BEHAVIOR,
+                                              "login_hour": 12})
+    _step(c, "/login/verify-puzzle", {"token": tok, "answer": PUZZLE["answer"]})
+
+
+def _timed(fn, c, users) -> list[float]:
+    out = []
+    for u in users:
+        t0 = time.perf_counter()
+        fn(c, u)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+def _row(label, samples):
+    qs = statistics.quantiles(samples, n=100)
+    print(f"  {label:<9}{len(samples) / (sum(samples) / 1000):>10,.0f}/s"
+          f"{statistics.median(samples):>9.2f}ms{qs[94]:>9.2f}ms{qs[98]:>9.2f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--backend", choices=sorted(storage.BACKENDS), action="append")
+    ap.add_argument("--users",  type=int, default=300)
+    ap.add_argument("--logins", type=int, default=3, help="logins per registered user")
+    args = ap.parse_args()
+
+    ratelimit.users = ratelimit.TokenBucketLimiter(0, 0)
+    ratelimit.ips   = ratelimit.TokenBucketLimiter(0, 0)
+    for backend in args.backend or sorted(storage.BACKENDS):
+        failures = run_conformance(backend)
+        if failures:
+            print(f"{backend}: skipped, {len(failures)} conformance failure(s)")
+            continue
+        storage.set_storage(fresh_store(backend))
+        users = [f"bench{i}" for i in range(args.users)]
+        c = TestClient(api.app)
+        reg = _timed(_register, c, users)
+        log = _timed(_login, c, users * args.logins)
+        print(f"{backend}  (flows/s, p50, p95, p99)")
+        _row("register", reg)
+        _row("login", log)
+
+
+if __name__ == "__main__":
+    main()
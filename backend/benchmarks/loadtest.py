@@ -0,0 +1,264 @@
+"""
+loadtest.py — Concurrent register + login load against the API, latency per step.
+
+Registers --users synthetic accounts (level1 → level2 → behavior → puzzles),
+then runs --concurrency virtual clients for --duration seconds (or --flows
+flows), each picking a scenario from --mix:
+
+    good      level1 → level2 → risk-assessment → verify-puzzle
+    markers   right password, wrong fractal markers (stops at level2)
+    brute     wrong password for a random account, from a small pool of IPs
+
+Each account has its own marker positions, User-Agent, client IP and
+behaviour baseline (mouse speed, pauses, traversal time); every login
+jitters those around the baseline, so the risk rules see realistic inputs.
+Prints throughput and p50/p95/p99 per step plus status counts — 429 is the
+login rate limiter, expected for brute traffic.
+
+Client IPs travel in X-Forwarded-For, which the app believes only from a
+FRACTALAUTH_TRUSTED_PROXIES address. In-process (default) the app runs on
+this event loop through httpx's ASGI transport, against a temporary SQLite
+file, and trusts the transport's 127.0.0.1; with --url it drives a running
+server instead, which must list this machine as a trusted proxy or every
+flow counts as one IP. Run from backend/:
+    python benchmarks/loadtest.py --users 200 --concurrency 32 --duration 30
+    python benchmarks/loadtest.py --url http://127.0.0.1:8000 --mix good=70,markers=20,brute=10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSWORD = "Passw0rd!"
+FRACTALS = ("mandelbrot", "julia", "burning_ship")
+
+
+class Account:
+    def __init__(self, name: str, rng: random.Random, n: int):
+        self.name    = name
+        self.markers = [{"fx": round(rng.uniform(-2.0, 0.5), 4), "fy": round(rng.uniform(-1.2, 1.2), 4)}
+                        for _ in range(3)]
+        self.ip      = f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+        self.ua      = f"Mozilla/5.0 (X11; Linux x86_64) LoadTest/{n % 7}"
+        self.speed   = rng.uniform(0.15, 0.45)
+        self.pause   = rng.uniform(500, 1300)
+        self.time_ms = rng.uniform(4000, 9000)
+        self.zooms   = rng.randint(0, 3)
+        self.answers = {}
+
+    def behavior(self, rng: random.Random) -> dict:
+        """One session's payload, jittered ~10% around this account's baseline."""
+        j = lambda v: max(v * rng.gauss(1.0, 0.1), 1e-3)  # noqa: E731
+        return {"mouse_speeds":    [round(j(self.speed), 4) for _ in range(rng.randint(20, 60))],
+                "pause_durations": [round(j(self.pause), 1) for _ in range(rng.randint(3, 6))],
+                "click_count":     3,
+                "zoom_count":      self.zooms,
+                "fractal_time_ms": round(j(self.time_ms), 1)}
+
+    def puzzle(self, kind: str, rng: random.Random) -> dict:
+        options = [f"Re: {rng.uniform(-2, 1):.3f}" for _ in range(4)]
+        self.answers[kind] = options[rng.randrange(4)]
+        return {"question": f"Which coordinate is closest to your {kind} marker?",
+                "options": options, "answer": self.answers[kind], "fractal_hint": "load test"}
+
+
+class Stats:
+    def __init__(self):
+        self.ms     = defaultdict(list)
+        self.status = defaultdict(Counter)
+        self.flows  = Counter()
+
+    async def post(self, client, step: str, body: dict, ip: str, ua: str):
+        t0 = time.perf_counter()
+        r = await client.post(step, json=body, headers={"x-forwarded-for": ip, "user-agent": ua})
+        self.ms[step].append((time.perf_counter() - t0) * 1000)
+        self.status[step][r.status_code] += 1
+        return r
+
+    def report(self, elapsed: float):
+        print(f"{'step':<26}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  status")
+        for step, ms in self.ms.items():
+            qs = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+            codes = " ".join(f"{k}:{v}" for k, v in sorted(self.status[step].items()))
+            print(f"{step:<26}{len(ms):>8}{len(ms) / elapsed:>9.1f}{statistics.median(ms):>9.2f}"
+                  f"{qs[94]:>9.2f}{qs[98]:>9.2f}  {codes}")
+
+    def as_dict(self, elapsed: float) -> dict:
+        out = {}
+        for step, ms in self.ms.items():
+            qs = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+            out[step] = {"count": len(ms), "rps": len(ms) / elapsed, "p50": statistics.median(ms),
+                         "p95": qs[94], "p99": qs[98], "status": dict(self.status[step])}
+        return out
+
+
+async def register(client, stats: Stats, acct: Account, rng: random.Random):
+    h = (acct.ip, acct.ua)
+    await stats.post(client, "/register/level1", {"username": acct.name, "email": f"{acct.name}@example.com",
+                                                  "password": PASSWORD}, *h)
+    await stats.post(client, "/register/level2", {"username": acct.name, "fractal_type": rng.choice(FRACTALS),
+                                                  "markers": acct.markers}, *h)
+    await stats.post(client, "/register/behavior", {"username": acct.name, **acct.behavior(rng)}, *h)
+    r = await stats.post(client, "/register/puzzles", {"username": acct.name,
+                                                       "easy_puzzle": acct.puzzle("easy", rng),
+                                                       "hard_puzzle": acct.puzzle("hard", rng)}, *h)
+    return r.status_code == 200
+
+
+async def good(client, stats: Stats, acct: Account, rng: random.Random, _accounts) -> bool:
+    h = (acct.ip, acct.ua)
+    r = await stats.post(client, "/login/level1", {"username": acct.name, "password": PASSWORD}, *h)
+    if r.status_code != 200:
+        return False
+    r = await stats.post(client, "/login/level2", {"token": r.json()["token"], "markers": acct.markers}, *h)
+    if r.status_code != 200:
+        return False
+    r = await stats.post(client, "/login/risk-assessment", {"token": r.json()["token"],
+                                                            "behavior": acct.behavior(rng),
+                                                            "login_hour": rng.randint(8, 21)}, *h)
+    if r.status_code != 200:
+        return False
+    risk = r.json()
+    r = await stats.post(client, "/login/verify-puzzle", {"token": risk["token"],
+                                                          "answer": acct.answers[risk["difficulty"]]}, *h)
+    return r.status_code == 200
+
+
+async def markers(client, stats: Stats, acct: Account, rng: random.Random, _accounts) -> bool:
+    h = (acct.ip, acct.ua)
+    r = await stats.post(client, "/login/level1", {"username": acct.name, "password": PASSWORD}, *h)
+    if r.status_code != 200:
+        return False
+    wrong = [{"fx": m["fx"] + rng.choice((-1, 1)) * rng.uniform(0.2, 0.5), "fy": m["fy"]}
+             for m in acct.markers]
+    r = await stats.post(client, "/login/level2", {"token": r.json()["token"], "markers": wrong}, *h)
+    return r.status_code == 401
+
+
+async def brute(client, stats: Stats, _acct, rng: random.Random, accounts) -> bool:
+    victim = rng.choice(accounts)
+    ip = f"198.51.100.{rng.randrange(4)}"
+    r = await stats.post(client, "/login/level1", {"username": victim.name,
+                                                   "password": f"guess{rng.randrange(10 ** 6)}"},
+                         ip, "python-requests/2.31")
+    return r.status_code in (401, 429)
+
+
+SCENARIOS = {"good": good, "markers": markers, "brute": brute}
+
+
+def _parse_mix(s: str) -> dict:
+    mix = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r} (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(w or 1)
+    return mix
+
+
+async def _client(args):
+    if args.url:
+        return httpx.AsyncClient(base_url=args.url, timeout=60), None
+    os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "loadtest.db"))
+    os.environ.setdefault("FRACTALAUTH_TRUSTED_PROXIES", "127.0.0.1")
+    import main
+    import ratelimit
+    if args.no_rate_limit:
+        ratelimit.users = ratelimit.TokenBucketLimiter(0, 0)
+        ratelimit.ips   = ratelimit.TokenBucketLimiter(0, 0)
+    lifespan = main.lifespan(main.app)
+    await lifespan.__aenter__()
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app),
+                             base_url="http://loadtest", timeout=60), lifespan
+
+
+async def run(args):
+    rng  = random.Random(args.seed)
+    mix  = _parse_mix(args.mix)
+    run_id = os.urandom(3).hex()
+    accounts = [Account(f"lt{run_id}-{i}", rng, i) for i in range(args.users)]
+    client, lifespan = await _client(args)
+    try:
+        reg = Stats()
+        sem = asyncio.Semaphore(args.concurrency)
+
+        async def one(acct):
+            async with sem:
+                return await register(client, reg, acct, random.Random(rng.random()))
+        t0 = time.perf_counter()
+        ok = await asyncio.gather(*(one(a) for a in accounts))
+        elapsed = time.perf_counter() - t0
+        accounts = [a for a, good_ in zip(accounts, ok) if good_]
+        print(f"registration: {len(accounts)}/{args.users} accounts in {elapsed:.1f}s "
+              f"({len(accounts) / elapsed:.1f}/s)")
+        reg.report(elapsed)
+        if not accounts:
+            raise SystemExit("no account registered; is the server up?")
+
+        login = Stats()
+        names, weights = list(mix), list(mix.values())
+        deadline = time.perf_counter() + args.duration
+        budget = [args.flows or 0]
+
+        async def worker(wrng):
+            while time.perf_counter() < deadline:
+                if args.flows:
+                    if budget[0] <= 0:
+                        return
+                    budget[0] -= 1
+                name = wrng.choices(names, weights)[0]
+                passed = await SCENARIOS[name](client, login, wrng.choice(accounts), wrng, accounts)
+                login.flows[(name, passed)] += 1
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(random.Random(rng.random())) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - t0
+        total = sum(login.flows.values())
+        print(f"\nlogin mix: {total} flows in {elapsed:.1f}s ({total / elapsed:.1f} flows/s), "
+              f"concurrency {args.concurrency}")
+        for name in names:
+            n_ok, n_bad = login.flows[(name, True)], login.flows[(name, False)]
+            print(f"  {name:<8} {n_ok + n_bad:>7} flows  {n_ok / max(n_ok + n_bad, 1):>7.1%} as expected")
+        login.report(elapsed)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump({"target": args.url or "in-process", "concurrency": args.concurrency,
+                           "mix": mix, "elapsed_s": elapsed, "flows_per_s": total / elapsed,
+                           "register": reg.as_dict(elapsed), "login": login.as_dict(elapsed)}, f, indent=2)
+    finally:
+        await client.aclose()
+        if lifespan is not None:
+            await lifespan.__aexit__(None, None, None)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--url", help="drive a running server (default: the app in-process)")
+    ap.add_argument("--users", type=int, default=200, help="accounts registered before the login phase")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=30.0, help="seconds of login traffic")
+    ap.add_argument("--flows", type=int, default=0, help="stop after this many login flows instead")
+    ap.add_argument("--mix", default="good=80,markers=10,brute=10")
+    ap.add_argument("--no-rate-limit", action="store_true",
+                    help="in-process only: disable the login rate limiter")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="also write the report as JSON")
+    args = ap.parse_args()
+    if args.flows:
+        args.duration = float("inf")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
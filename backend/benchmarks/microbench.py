@@ -0,0 +1,248 @@
+"""
+microbench.py — Per-call cost of the login hot path, saved as comparable JSON baselines.
+
+CPU-only: markers_match (plain / hashed key), behavioral_risk (registration
+baseline / learned profile), contextual_risk (record and failure count
+given), puzzle_gen.generate_puzzles. Storage, at every --sizes table size:
+db.get_user (cache hit / miss), db.update_many (behaviour profile + device
+set, as after a login) and db.increment_failed (as configured, then with
+write-behind off).
+
+Each benchmark runs --rounds rounds of N calls and records the median and
+the best µs/call; baselines are compared on the best round, which is far
+less sensitive to a noisy machine than the median. Size-N tables are synthetic users
+written straight into SQLite under --data-dir and reused by later runs
+(1M users is roughly 1 GB on disk). Run from backend/:
+    python benchmarks/microbench.py run --sizes 1000 100000 --out baseline.json
+    python benchmarks/microbench.py run --sizes 1000 100000 --baseline baseline.json --threshold 10
+    python benchmarks/microbench.py compare baseline.json current.json --threshold 10
+`run --baseline` and `compare` exit with status 1 if anything regressed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(HERE)), "frontend"))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "microbench.db"))
+
+VARIANTS = 1000     # distinct inputs cycled through by the CPU benchmarks
+
+
+def _measure(fn, calls: int, rounds: int) -> dict:
+    per_call = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for i in range(calls):
+            fn(i)
+        per_call.append((time.perf_counter() - t0) / calls * 1e6)
+    return {"us": statistics.median(per_call), "min": min(per_call), "calls": calls, "rounds": rounds}
+
+
+def _profile(rng, learned: bool) -> dict:
+    import profiles
+    base = {"avg_mouse_speed": rng.uniform(0.15, 0.45), "avg_pause_ms": rng.uniform(500, 1300),
+            "fractal_time_ms": rng.uniform(4000, 9000), "click_count": 3, "zoom_count": 1}
+    if not learned:
+        return base
+    for _ in range(12):
+        base = profiles.update(base, {k: v * rng.gauss(1, 0.1) for k, v in base.items()
+                                      if k in profiles.METRICS})
+    return base
+
+
+def cpu_benchmarks(calls: int, rounds: int) -> dict:
+    import main
+    import markerkey
+    import rules
+    from utils.puzzle_gen import generate_puzzles
+
+    rng = random.Random(1)
+    tol = rules.current().fractal_threshold
+    keys = [[{"fx": rng.uniform(-2, 0.5), "fy": rng.uniform(-1.2, 1.2)} for _ in range(3)]
+            for _ in range(VARIANTS)]
+    hashed = [markerkey.enroll(k, tol) for k in keys]
+    attempts = [[main.FractalMarker(fx=m["fx"] + rng.gauss(0, tol / 3), fy=m["fy"]) for m in k]
+                for k in keys]
+    plain_profiles   = [_profile(rng, False) for _ in range(VARIANTS)]
+    learned_profiles = [_profile(rng, True) for _ in range(VARIANTS)]
+    sessions = [(rng.uniform(0.1, 0.5), rng.uniform(400, 1400), rng.uniform(3000, 10000), 3)
+                for _ in range(VARIANTS)]
+    users = [{"registered_ip": f"10.0.{i >> 8}.{i & 255}", "registered_ua": f"UA/{i % 5}",
+              "known_devices": b""} for i in range(VARIANTS)]
+    v = VARIANTS
+    cases = {
+        "markers_match/plain":      lambda i: main.markers_match(keys[i % v], attempts[i % v]),
+        "markers_match/hashed":     lambda i: main.markers_match(hashed[i % v], attempts[i % v]),
+        "behavioral_risk/baseline": lambda i: main.behavioral_risk_from(plain_profiles[i % v], *sessions[i % v]),
+        "behavioral_risk/learned":  lambda i: main.behavioral_risk_from(learned_profiles[i % v], *sessions[i % v]),
+        "contextual_risk":          lambda i: main.contextual_risk("u", f"10.1.0.{i & 255}", f"UA/{i % 7}",
+                                                                   i % 24, users[i % v], i % 4),
+        "generate_puzzles":         lambda i: generate_puzzles(keys[i % v]),
+    }
+    return {name: _measure(fn, calls, rounds) for name, fn in cases.items()}
+
+
+def _count(db) -> int:
+    total = 0
+    for sh in db.shards():
+        with sh.pool.connection() as conn:
+            total += conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    return total
+
+
+def populate(db, n: int, batch: int = 50_000):
+    """Make sure users user0 … user{n-1} exist (synthetic, complete registrations)."""
+    import bulk
+    import hashing
+    from utils.puzzle_gen import generate_puzzles
+
+    have = _count(db)
+    if have >= n:
+        return
+    rng = random.Random(n)
+    pw = hashing.hash_password("Passw0rd!")
+    templates = []
+    for _ in range(256):
+        markers = [{"fx": rng.uniform(-2, 0.5), "fy": rng.uniform(-1.2, 1.2)} for _ in range(3)]
+        easy, hard = generate_puzzles(markers)
+        templates.append(bulk._to_row({
+            "username": "-", "email": "-", "password_hash": pw, "registered_ip": "10.0.0.1",
+            "registered_ua": "Mozilla/5.0", "registered_at": time.time(), "fractal_type": "mandelbrot",
+            "fractal_markers": markers, "behavior_profile": _profile(rng, True),
+            "easy_puzzle": easy, "hard_puzzle": hard, "is_complete": 1})[2:])
+    sql = (f"INSERT OR IGNORE INTO users ({','.join(bulk.COLUMNS)}) "
+           f"VALUES ({','.join('?' * len(bulk.COLUMNS))})")
+    shards, t0 = db.shards(), time.perf_counter()
+    for start in range(have, n, batch):
+        groups = {}
+        for i in range(start, min(n, start + batch)):
+            u = f"user{i}"
+            groups.setdefault(db.shard_index(u, len(shards)), []).append(
+                (u, f"{u}@example.com", *templates[i & 255]))
+        for idx, rows in groups.items():
+            with shards[idx].lock, shards[idx].pool.connection() as conn:
+                conn.executemany(sql, rows)
+                conn.commit()
+        print(f"  populating: {min(n, start + batch):,}/{n:,} users", end="\r", file=sys.stderr)
+    print(f"  populated {n - have:,} users in {time.perf_counter() - t0:.1f}s" + " " * 20, file=sys.stderr)
+
+
+def db_benchmarks(size: int, data_dir: str, calls: int, rounds: int) -> dict:
+    import db
+    import devices
+
+    os.makedirs(data_dir, exist_ok=True)
+    db.configure(path=os.path.join(data_dir, f"users_{size}.db"))
+    populate(db, size)
+    rng = random.Random(size)
+    names = [f"user{rng.randrange(size)}" for _ in range(VARIANTS)]
+    hot = names[:min(64, db.USER_CACHE_SIZE or 1)]
+    profile = _profile(rng, True)
+    device = devices.remember(b"", devices.fingerprint("Mozilla/5.0"))
+    for u in hot:
+        db.get_user(u)
+
+    def miss(i):
+        db._user_cache.clear()
+        db.get_user(names[i % VARIANTS])
+
+    cases = {
+        "db.get_user/hit":   lambda i: db.get_user(hot[i % len(hot)]),
+        "db.get_user/miss":  miss,
+        "db.update_many":    lambda i: db.update_many(names[i % VARIANTS], {"behavior_profile": profile,
+                                                                          "known_devices": device}),
+        "db.increment_failed": lambda i: db.increment_failed(names[i % VARIANTS]),
+    }
+    out = {f"{name}@{size}": _measure(fn, calls, rounds) for name, fn in cases.items()}
+    db.flush_writes()
+    writer, db._writer = db._writer, None       # synchronous UPDATE path
+    try:
+        out[f"db.increment_failed/sync@{size}"] = _measure(
+            lambda i: db.increment_failed(names[i % VARIANTS]), calls, rounds)
+    finally:
+        db._writer = writer
+    return out
+
+
+def run(args) -> dict:
+    results = {}
+    print(f"{'benchmark':<34}{'µs/call':>10}{'min':>10}")
+    groups = [("cpu", lambda: cpu_benchmarks(args.calls * 10, args.rounds))]
+    groups += [(f"db@{n}", lambda n=n: db_benchmarks(n, args.data_dir, args.calls, args.rounds))
+               for n in args.sizes]
+    for _, bench in groups:
+        for name, r in bench().items():
+            results[name] = r
+            print(f"{name:<34}{r['us']:>10.2f}{r['min']:>10.2f}")
+    return {"meta": {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                     "platform": platform.platform(), "sqlite": sqlite3.sqlite_version,
+                     "sizes": args.sizes,
+                     "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("FRACTALAUTH_")
+                             and k != "FRACTALAUTH_DB"}},
+            "results": results}
+
+
+def compare(base: dict, cur: dict, threshold: float) -> bool:
+    """Print both runs side by side; True if any shared benchmark got slower than `threshold` %."""
+    if base["meta"].get("env") != cur["meta"].get("env"):
+        print("note: FRACTALAUTH_* settings differ between the runs")
+    regressed = False
+    print(f"\n{'benchmark (best µs/call)':<34}{'base':>10}{'now':>10}{'change':>9}")
+    for name in sorted(set(base["results"]) | set(cur["results"])):
+        b, c = base["results"].get(name), cur["results"].get(name)
+        if b is None or c is None:
+            cell = lambda r: "—" if r is None else f"{r['min']:.2f}"  # noqa: E731
+            print(f"{name:<34}{cell(b):>10}{cell(c):>10}")
+            continue
+        change = (c["min"] - b["min"]) / b["min"] * 100
+        flag = ""
+        if change > threshold:
+            flag, regressed = "  REGRESSION", True
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<34}{b['min']:>10.2f}{c['min']:>10.2f}{change:>+8.1f}%{flag}")
+    print(f"\n{'regressions beyond' if regressed else 'nothing slower than'} {threshold:g}%")
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    r = sub.add_parser("run", help="run the suite")
+    r.add_argument("--sizes", type=int, nargs="+", default=[1000, 100_000], help="users in the table")
+    r.add_argument("--calls", type=int, default=2000, help="calls per round (CPU benchmarks: 10×)")
+    r.add_argument("--rounds", type=int, default=5)
+    r.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "fractalauth-microbench"))
+    r.add_argument("--out", help="write results as JSON (a baseline)")
+    r.add_argument("--baseline", help="compare against this JSON baseline")
+    r.add_argument("--threshold", type=float, default=10.0, help="%% slowdown counted as a regression")
+    c = sub.add_parser("compare", help="compare two saved runs")
+    c.add_argument("base")
+    c.add_argument("current")
+    c.add_argument("--threshold", type=float, default=10.0)
+    args = ap.parse_args()
+
+    if args.cmd == "compare":
+        with open(args.base) as fb, open(args.current) as fc:
+            sys.exit(1 if compare(json.load(fb), json.load(fc), args.threshold) else 0)
+    report = run(args)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            sys.exit(1 if compare(json.load(f), report, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
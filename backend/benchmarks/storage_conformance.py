@@ -0,0 +1,321 @@
+"""
+storage_conformance.py — behavioural checks every storage backend must pass.
+
+Each check gets a fresh, empty store. Run against all backends (from backend/):
+    python benchmarks/storage_conformance.py
+    python benchmarks/storage_conformance.py --backend memory
+
+bench_storage.py runs the same checks before timing a backend.
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FRACTALAUTH_DB", os.path.join(tempfile.mkdtemp(), "conformance.db"))
+
+import storage  # noqa: E402
+from hashing import verify_password  # noqa: E402
+
+MARKERS = [{"fx": -0.5, "fy": 0.1}, {"fx": 0.25, "fy": -0.75}, {"fx": -1.125, "fy": 0.0625}]
+PROFILE = {"avg_mouse_speed": 0.3, "avg_pause_ms": 900.0, "fractal_time_ms": 6000.0,
+           "click_count": 3, "zoom_count": 1}
+PUZZLE  = {"question": "q?", "options": ["a", "b"], "answer": "a", "fractal_hint": "h"}
+
+
+def fresh_store(backend: str):
+    if backend == "memory":
+        return storage.MemoryStorage()
+    import db
+    db.configure(path=os.path.join(tempfile.mkdtemp(), "conformance.db"))
+    return storage.SQLiteStorage()
+
+
+def check_protocol(s):
+    assert isinstance(s, storage.Storage)
+
+
+def check_create_and_get(s):
+    assert not s.user_exists("alice")
+    assert s.get_user("alice") is None
+    s.create_user("alice", "a@example.com", "Secret#123", "10.0.0.1", "UA/1")
+    assert s.user_exists("alice")
+    u = s.get_user("alice")
+    assert u["username"] == "alice" and u["email"] == "a@example.com"
+    assert verify_password("Secret#123", u["password_hash"])
+    assert not verify_password("secret#123", u["password_hash"])
+    assert (u["registered_ip"], u["registered_ua"]) == ("10.0.0.1", "UA/1")
+    assert u["registered_at"] > 0
+
+
+def check_defaults(s):
+    s.create_user("bob", "b@example.com", "pw")
+    u = s.get_user("bob")
+    assert u["failed_attempts"] == 0 and u["is_complete"] == 0
+    assert u["fractal_type"] == "mandelbrot"
+    assert u["fractal_markers"] == [] and u.get("behavior_profile", {}) == {}
+    assert u["easy_puzzle"] == {} and u["hard_puzzle"] == {}
+
+
+def check_duplicate_rejected(s):
+    s.create_user("carol", "c@example.com", "pw")
+    try:
+        s.create_user("carol", "c2@example.com", "pw")
+    except Exception:
+        pass
+    else:
+        raise AssertionError("duplicate username accepted")
+    assert s.get_user("carol")["email"] == "c@example.com"
+
+
+def check_updates_roundtrip(s):
+    s.create_user("dave", "d@example.com", "pw")
+    s.update_many("dave", {"fractal_type": "julia", "fractal_markers": MARKERS})
+    s.update_field("dave", "behavior_profile", PROFILE)
+    s.update_many("dave", {"easy_puzzle": PUZZLE, "hard_puzzle": PUZZLE, "is_complete": 1})
+    s.update_many("dave", {})
+    for u in (s.get_user("dave"), s.load_user("dave")):
+        assert u["fractal_type"] == "julia" and u["is_complete"] == 1
+        assert u["fractal_markers"] == MARKERS
+        assert u["behavior_profile"] == PROFILE
+        assert u["easy_puzzle"] == PUZZLE and u["hard_puzzle"]["answer"] == "a"
+
+
+def check_oversized_profile(s):
+    s.create_user("olga", "o@example.com", "pw")
+    huge = {**PROFILE, "click_count": 2 ** 31, "zoom_count": -2 ** 40,
+            "sketches": {"mouse_speeds": [0, -16, 2 ** 33]}}
+    s.update_field("olga", "behavior_profile", huge)
+    for u in (s.get_user("olga"), s.load_user("olga")):
+        assert u["behavior_profile"] == huge
+
+
+def check_get_fields(s):
+    assert s.get_fields("nobody", ("easy_puzzle",)) is None
+    s.create_user("dora", "do@example.com", "pw")
+    s.update_many("dora", {"fractal_markers": MARKERS, "hard_puzzle": PUZZLE})
+    for _ in range(2):      # cold, then after a full read may have cached the record
+        u = s.get_fields("dora", ("fractal_markers", "hard_puzzle"))
+        assert u["fractal_markers"] == MARKERS and u["hard_puzzle"] == PUZZLE
+        s.get_user("dora")
+
+
+def check_hashed_markers(s):
+    import markerkey
+    for div in (markerkey.GRID_DIV, 12):     # 12: over 255 cells per marker
+        name = f"hana{div}"
+        key = markerkey.enroll(MARKERS, 0.08, div)
+        s.create_user(name, "h@example.com", "pw")
+        s.update_field(name, "fractal_markers", key)
+        for u in (s.get_user(name), s.load_user(name), s.get_fields(name, ("fractal_markers",))):
+            assert u["fractal_markers"] == key
+        assert markerkey.verify(key, [(m["fx"] + 0.05, m["fy"]) for m in MARKERS])
+        assert not markerkey.verify(key, [(m["fx"] + 0.5, m["fy"]) for m in MARKERS])
+
+
+def check_learned_profile(s):
+    import profiles
+    s.create_user("lena", "l@example.com", "pw")
+    learned = PROFILE
+    for speed in (0.31, 0.29, 0.33):
+        learned = profiles.update(learned, {**PROFILE, "avg_mouse_speed": speed},
+                                  {"pause_durations": [0, 130, 2, 0, 1]})
+    for bad in (float("nan"), float("inf"), 1e308):     # skipped, not learned
+        assert profiles.update(learned, {**PROFILE, "avg_mouse_speed": bad})["stats"]["avg_mouse_speed"] \
+            == learned["stats"]["avg_mouse_speed"]
+    s.update_field("lena", "behavior_profile", learned)
+    assert s.load_user("lena")["behavior_profile"] == learned
+    assert profiles.baseline(learned, "avg_mouse_speed")[0] == 4
+    assert profiles.sketch(learned, "pause_durations").count == 9
+
+
+def check_known_devices(s):
+    import devices
+    s.create_user("kim", "k@example.com", "pw", ua="Laptop")
+    assert not devices.known(s.get_user("kim")["known_devices"], "Phone")
+    blob = b""
+    for i, ua in enumerate(("Phone", "Tablet", "Phone", "TV")):
+        blob = devices.remember(blob, devices.fingerprint(ua), now=1000 + i, limit=2)
+    s.update_many("kim", {"known_devices": blob})
+    for u in (s.get_user("kim"), s.get_fields("kim", ("known_devices",))):
+        assert devices.known(u["known_devices"], "Phone") and devices.known(u["known_devices"], "TV")
+        assert not devices.known(u["known_devices"], "Tablet")      # least recently seen, evicted
+
+
+def check_bulk_roundtrip(s):
+    # Export → delete → import restores every column, known devices included (SQLite only).
+    import bulk
+    import devices
+    if not isinstance(s, storage.SQLiteStorage):
+        return
+    s.create_user("nina", "n@example.com", "pw", "10.0.0.9", "Laptop")
+    blob = devices.remember(devices.remember(b"", devices.fingerprint("Phone"), now=1),
+                            devices.fingerprint("Laptop"), now=2)
+    s.update_many("nina", {"fractal_markers": MARKERS, "behavior_profile": PROFILE,
+                           "easy_puzzle": PUZZLE, "hard_puzzle": PUZZLE, "is_complete": 1,
+                           "known_devices": blob})
+    before = dict(s.load_user("nina"))
+    for fmt in ("ndjson", "csv"):
+        path = os.path.join(tempfile.mkdtemp(), f"users.{fmt}")
+        with contextlib.redirect_stderr(io.StringIO()):      # progress lines
+            assert bulk.export_users(path) == 1
+            s.delete_user("nina")
+            assert bulk.import_users(path) == 1
+        assert dict(s.load_user("nina")) == before, fmt
+
+
+def check_records_are_snapshots(s):
+    s.create_user("erin", "e@example.com", "pw")
+    before = s.get_user("erin")
+    s.update_field("erin", "fractal_type", "julia")
+    assert before["fractal_type"] == "mandelbrot"
+    assert s.get_user("erin")["fractal_type"] == "julia"
+
+
+def check_failed_counter(s):
+    s.create_user("frank", "f@example.com", "pw")
+    for _ in range(3):
+        s.increment_failed("frank")
+    assert s.get_user("frank")["failed_attempts"] == 3
+    assert s.load_user("frank")["failed_attempts"] == 3
+    s.reset_failed("frank")
+    s.increment_failed("frank")
+    assert s.get_user("frank")["failed_attempts"] == 1
+    assert s.flush()
+    assert s.load_user("frank")["failed_attempts"] == 1
+
+
+def check_unknown_user_is_noop(s):
+    s.update_field("ghost", "fractal_type", "julia")
+    s.update_many("ghost", {"is_complete": 1})
+    s.increment_failed("ghost")
+    s.reset_failed("ghost")
+    s.delete_user("ghost")
+    assert s.flush()
+    assert s.get_user("ghost") is None
+
+
+def check_delete(s):
+    s.create_user("heidi", "h@example.com", "pw")
+    s.get_user("heidi")
+    s.delete_user("heidi")
+    assert not s.user_exists("heidi")
+    assert s.get_user("heidi") is None and s.cached_user("heidi") is None
+
+
+def check_attempt_windows(s):
+    s.create_user("ivan", "i@example.com", "pw")
+    now = 1_000_000.0
+    s.record_attempt("ivan", "bad_password", "10.0.0.1", "UA", ts=now - 7200)
+    s.record_attempt("ivan", "bad_markers", "10.0.0.1", "UA", ts=now - 30)
+    s.record_attempt("ivan", "bad_puzzle", "10.0.0.2", "UA", ts=now - 10)
+    assert s.count_failures("ivan", 60, now=now) == 2
+    assert s.count_failures("ivan", 3 * 3600, now=now) == 3
+    s.record_attempt("ivan", "success", ts=now - 5)
+    s.record_attempt("ivan", "bad_password", ts=now - 1)
+    assert s.count_failures("ivan", 3 * 3600, now=now) == 1
+    assert s.count_failures("nobody", 60, now=now) == 0
+    assert s.flush()
+    assert s.count_failures("ivan", 3 * 3600, now=now) == 1
+
+
+def check_attempt_pruning(s):
+    s.create_user("judy", "j@example.com", "pw")
+    s.record_attempt("judy", "bad_password", ts=1.0)
+    s.record_attempt("judy", "bad_password")
+    assert s.flush()
+    assert s.prune_attempts(older_than_s=3600) >= 1
+    assert s.count_failures("judy", 10 ** 10) == 1
+
+
+def check_cache_fill_races(s):
+    # A cache fill is dropped only if its own user was written while it loaded.
+    import db
+    if not isinstance(s, storage.SQLiteStorage):
+        return
+    for u in ("lou", "max"):
+        s.create_user(u, f"{u}@example.com", "pw")
+    rec = s.load_user("lou")
+    db._user_cache.invalidate("lou")
+    token = db._user_cache.token()
+    s.update_field("max", "fractal_type", "julia")
+    db._user_cache.put("lou", rec, token)
+    assert s.cached_user("lou") is rec
+    token = db._user_cache.token()
+    s.update_field("lou", "fractal_type", "julia")
+    db._user_cache.put("lou", rec, token)                # stale: must not replace the patched copy
+    assert s.cached_user("lou")["fractal_type"] == "julia"
+
+
+def check_reads_during_flush(s):
+    # A read between a write-behind batch's commit and its removal from the
+    # overlay must not count the batch twice (SQLite with write-behind only).
+    import db
+    w = db._writer if isinstance(s, storage.SQLiteStorage) else None
+    if w is None:
+        return
+    s.create_user("kurt", "k@example.com", "pw")
+    apply, seen, readers = w._apply, [], []
+
+    def read():
+        seen.append((s.count_failures("kurt", 3600),
+                     s.get_fields("kurt", ("failed_attempts",))["failed_attempts"],
+                     s.load_user("kurt")["failed_attempts"]))
+
+    def apply_then_read(ops, rows):
+        apply(ops, rows)
+        if "kurt" in ops:
+            readers.append(threading.Thread(target=read))
+            readers[-1].start()
+            readers[-1].join(0.2)               # give it the whole gap before the seq bump
+    w._apply = apply_then_read
+    try:
+        with w._cond:                           # one batch: keep the writer thread out meanwhile
+            for _ in range(3):
+                s.increment_failed("kurt")
+                s.record_attempt("kurt", "bad_password")
+        assert s.flush()
+        for t in readers:
+            t.join()
+    finally:
+        w._apply = apply
+    assert seen and all(v == (3, 3, 3) for v in seen), seen
+    assert s.get_user("kurt")["failed_attempts"] == 3
+
+
+CHECKS = [v for k, v in list(globals().items()) if k.startswith("check_")]
+
+
+def run_conformance(backend: str) -> list[str]:
+    """Run every check against `backend`; returns failure descriptions."""
+    failures = []
+    for check in CHECKS:
+        try:
+            check(fresh_store(backend))
+        except Exception as e:
+            failures.append(f"{check.__name__}: {type(e).__name__}: {e}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    ap.add_argument("--backend", choices=sorted(storage.BACKENDS), action="append")
+    args = ap.parse_args()
+
+    failed = False
+    for backend in args.backend or sorted(storage.BACKENDS):
+        failures = run_conformance(backend)
+        print(f"{backend:<8}{len(CHECKS) - len(failures)}/{len(CHECKS)} checks passed")
+        for f in failures:
+            print(f"  FAIL {f}")
+        failed |= bool(failures)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+bulk.py — Streaming bulk import/export of user accounts.
+
+Rows are streamed one at a time from/to NDJSON or CSV and written with
+executemany in large transactions, so memory stays flat whatever the file
+size. Markers, behavior profiles and puzzles may be included; in CSV they are
+JSON-encoded cells. known_devices (devices.py) travels as a hex string. Plain `password` values are hashed on import (one batch at
+a time across the hashing process pool); rows that already carry
+`password_hash` are stored as-is.
+
+Usage (from backend/):
+    python bulk.py import users.ndjson
+    python bulk.py import users.csv --on-conflict replace --batch-size 20000
+    python bulk.py export all_users.ndjson
+    python bulk.py export - --format csv > users.csv
+
+Running servers keep cached records for up to FRACTALAUTH_USER_CACHE_TTL
+seconds, so replaced rows become visible to them after that.
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from itertools import islice
+
+import codec
+import db
+import hashing
+from codec import BLOB_FIELDS
+
+COLUMNS = (
+    "username", "email", "password_hash", "registered_ip", "registered_ua",
+    "registered_at", "failed_attempts", "fractal_type", "fractal_markers",
+    "behavior_profile", "easy_puzzle", "hard_puzzle", "is_complete", "known_devices",
+)
+_DEFAULTS = {
+    "registered_ip": "", "registered_ua": "", "registered_at": 0.0,
+    "failed_attempts": 0, "fractal_type": "mandelbrot", "is_complete": 0,
+}
+_NUMERIC = {"registered_at": float, "failed_attempts": int, "is_complete": int}
+_CONFLICT = {"skip": "INSERT OR IGNORE", "replace": "INSERT OR REPLACE", "fail": "INSERT"}
+
+
+class Progress:
+    """Prints running row counts and rows/s to stderr."""
+
+    def __init__(self, label: str, every: int = 10000):
+        self.label = label
+        self.every = every
+        self.rows  = 0
+        self.t0    = time.perf_counter()
+
+    def add(self, n: int):
+        before = self.rows // self.every
+        self.rows += n
+        if self.rows // self.every != before:
+            self._print()
+
+    def _print(self, final: bool = False):
+        dt = time.perf_counter() - self.t0
+        print(f"{self.label}: {self.rows:,} rows  {self.rows / dt if dt else 0:,.0f} rows/s"
+              f"{'  done in %.1fs' % dt if final else ''}", file=sys.stderr)
+
+    def done(self):
+        self._print(final=True)
+
+
+def _format_of(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "ndjson"
+
+
+def _read_records(fh, fmt: str):
+    if fmt == "csv":
+        yield from csv.DictReader(fh)
+        return
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _to_row(rec: dict) -> tuple:
+    row = {**_DEFAULTS, **{k: v for k, v in rec.items() if v not in (None, "")}}
+    if not row.get("username") or not row.get("email"):
+        raise ValueError(f"username and email are required: {rec!r:.80}")
+    if "password_hash" not in row:
+        raise ValueError(f"{row['username']}: password or password_hash required")
+    for col, cast in _NUMERIC.items():
+        row[col] = cast(row[col])
+    for f in BLOB_FIELDS:
+        value = row.get(f)
+        if isinstance(value, str):
+            value = json.loads(value)
+        row[f] = codec.encode(f, value if value is not None else codec.decode(f, b""))
+    row["known_devices"] = bytes.fromhex(row["known_devices"]) if row.get("known_devices") else None
+    return tuple(row[c] for c in COLUMNS)
+
+
+def _hash_passwords(batch: list):
+    """Fill in password_hash for records that only carry a plain password."""
+    todo = [r for r in batch if not r.get("password_hash") and r.get("password")]
+    for rec, h in zip(todo, hashing.hash_many([r["password"] for r in todo])):
+        rec["password_hash"] = h
+
+
+def import_users(path: str, fmt: str | None = None, batch_size: int = 5000,
+                 on_conflict: str = "skip") -> int:
+    fmt = _format_of(path, fmt)
+    sql = (f"{_CONFLICT[on_conflict]} INTO users ({','.join(COLUMNS)}) "
+           f"VALUES ({','.join('?' * len(COLUMNS))})")
+    progress = Progress("import")
+    shards   = db.shards()
+    fh = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8")
+    try:
+        records = _read_records(fh, fmt)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            _hash_passwords(batch)
+            batch = [_to_row(r) for r in batch]
+            groups = {}
+            for row in batch:
+                groups.setdefault(db.shard_index(row[0], len(shards)), []).append(row)
+            for idx, shard_rows in groups.items():
+                sh = shards[idx]
+                with sh.lock, sh.pool.connection() as conn:
+                    conn.executemany(sql, shard_rows)
+                    conn.commit()
+            if on_conflict == "replace":
+                for row in batch:
+                    db._user_cache.invalidate(row[0])
+            progress.add(len(batch))
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+    progress.done()
+    return progress.rows
+
+
+def export_users(path: str, fmt: str | None = None, batch_size: int = 5000) -> int:
+    fmt = _format_of(path, fmt)
+    progress = Progress("export")
+    fh = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(fh, fieldnames=COLUMNS)
+        writer.writeheader()
+    try:
+        for sh in db.shards():
+            with sh.pool.connection() as conn:
+                cur = conn.execute(f"SELECT {','.join(COLUMNS)} FROM users ORDER BY rowid")
+                while True:
+                    chunk = cur.fetchmany(batch_size)
+                    if not chunk:
+                        break
+                    for row in chunk:
+                        rec = dict(row)
+                        for f in BLOB_FIELDS:
+                            rec[f] = codec.decode(f, rec[f])
+                        rec["known_devices"] = bytes(rec["known_devices"] or b"").hex()
+                        if writer:
+                            writer.writerow({k: json.dumps(v) if k in BLOB_FIELDS else v
+                                             for k, v in rec.items()})
+                        else:
+                            fh.write(json.dumps(rec, separators=(",", ":")) + "\n")
+                    progress.add(len(chunk))
+    finally:
+        if fh is not sys.stdout:
+            fh.close()
+    progress.done()
+    return progress.rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk import/export FractalAuth users")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    imp = sub.add_parser("import", help="load users from NDJSON/CSV ('-' for stdin)")
+    imp.add_argument("path")
+    imp.add_argument("--on-conflict", choices=sorted(_CONFLICT), default="skip")
+    exp = sub.add_parser("export", help="dump users to NDJSON/CSV ('-' for stdout)")
+    exp.add_argument("path")
+    for p in (imp, exp):
+        p.add_argument("--format", choices=("ndjson", "csv"))
+        p.add_argument("--batch-size", type=int, default=5000)
+    args = ap.parse_args()
+
+    if args.cmd == "import":
+        try:
+            import_users(args.path, args.format, args.batch_size, args.on_conflict)
+        finally:
+            hashing.shutdown()
+    else:
+        export_users(args.path, args.format, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+cache.py — Bounded in-process LRU cache with per-entry TTL.
+Used by db.py to keep decoded user records hot between requests.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU + TTL cache with hit/miss/eviction counters.
+
+    Readers that fill the cache after a slow load should grab `token()` before
+    loading and pass it to `put(..., token=...)`: if that key was written or
+    invalidated in between, the (possibly stale) value is dropped. Writes to
+    other keys don't matter. The last write time of the most recently written
+    keys is kept in a bounded log; a fill older than the log's horizon is
+    dropped as well, since it can't be checked.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = max(0, maxsize)
+        self.ttl     = ttl
+        self._data   = OrderedDict()     # key -> (expires_at, value)
+        self._lock   = threading.Lock()
+        self._clock  = 0                 # bumped by every write / invalidation
+        self._written = OrderedDict()    # key -> clock of its last write, newest last
+        self._horizon = 0                # clock of the newest write dropped from _written
+        self._log_size = max(1024, self.maxsize)
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def token(self) -> int:
+        return self._clock
+
+    def _wrote(self, key):
+        self._clock += 1
+        self._written[key] = self._clock
+        self._written.move_to_end(key)
+        if len(self._written) > self._log_size:
+            self._horizon = self._written.popitem(last=False)[1]
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, token: int | None = None):
+        if not self.maxsize:
+            return
+        with self._lock:
+            if token is not None and self._written.get(key, self._horizon) > token:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, key, fn):
+        """Write-through: replace a cached value with fn(value), if present."""
+        with self._lock:
+            self._wrote(key)
+            item = self._data.get(key)
+            if item is not None:
+                self._data[key] = (item[0], fn(item[1]))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._wrote(key)
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._clock += 1
+            self._horizon = self._clock
+            self._written.clear()
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size":        len(self._data),
+                "maxsize":     self.maxsize,
+                "hits":        self.hits,
+                "misses":      self.misses,
+                "evictions":   self.evictions,
+                "expirations": self.expirations,
+            }
@@ -0,0 +1,205 @@
+"""
+codec.py — Compact on-disk encoding for the user blob columns.
+
+Each encoded value is a BLOB whose first byte is a format tag:
+
+    0x01  fractal markers   packed little-endian float64 (fx, fy) pairs
+    0x02  behavior profile  fixed struct of the registration snapshot
+    0x03  anything else     compact UTF-8 JSON
+    0x04  behavior profile  learned per-metric statistics (profiles.py)
+    0x05  fractal markers   salted cell hashes (markerkey.py): cell size,
+                            salt, then per marker a count and 8-byte digests
+                            (keys with over 255 markers or cells per marker,
+                            i.e. a grid div of 8+, are stored as JSON)
+
+Both profile structs may be followed by the profile's quantile sketches: per
+series in profiles.SERIES a uint8 length and that many int32 (0 = none).
+Profiles whose counts or sketches don't fit int32 are stored as JSON.
+
+Legacy rows store the same columns as JSON TEXT; `decode` accepts both, so
+old databases keep working before (and during) `migrate.py`.
+"""
+
+import json
+import struct
+from collections.abc import Mapping
+
+BLOB_FIELDS = ("fractal_markers", "behavior_profile", "easy_puzzle", "hard_puzzle")
+
+TAG_MARKERS = 0x01
+TAG_PROFILE = 0x02
+TAG_JSON    = 0x03
+TAG_STATS   = 0x04
+TAG_CELLS   = 0x05
+
+_POINT   = struct.Struct("<2d")
+_PROFILE = struct.Struct("<3d2i")
+_PROFILE_KEYS = ("avg_mouse_speed", "avg_pause_ms", "fractal_time_ms", "click_count", "zoom_count")
+_STATS   = struct.Struct("<" + "I3d" * len(_PROFILE_KEYS))     # per key: n, mean, m2, ewma
+_SERIES  = ("mouse_speeds", "pause_durations", "action_intervals")
+_CELLS   = struct.Struct("<d16sB")                            # cell size, salt, marker count
+
+
+def _int32(v) -> bool:
+    return isinstance(v, int) and -2 ** 31 <= v < 2 ** 31
+
+
+def _default(field: str):
+    return [] if field == "fractal_markers" else {}
+
+
+def _encode_json(value) -> bytes:
+    return bytes([TAG_JSON]) + json.dumps(value, separators=(",", ":")).encode()
+
+
+def encode_markers(markers) -> bytes:
+    if isinstance(markers, dict):
+        if len(markers["cells"]) > 255 or any(len(d) > 255 for d in markers["cells"]):
+            return _encode_json(markers)
+        out = bytearray([TAG_CELLS]) + _CELLS.pack(markers["cell"], bytes.fromhex(markers["salt"]),
+                                                   len(markers["cells"]))
+        for digests in markers["cells"]:
+            out.append(len(digests))
+            out += b"".join(bytes.fromhex(d) for d in digests)
+        return bytes(out)
+    flat = []
+    for m in markers:
+        flat.extend((float(m["fx"]), float(m["fy"])))
+    return bytes([TAG_MARKERS]) + struct.pack(f"<{len(flat)}d", *flat)
+
+
+def _encode_sketches(sketches: dict) -> bytes | None:
+    if not set(sketches) <= set(_SERIES):
+        return None
+    out = bytearray()
+    for name in _SERIES:
+        data = sketches.get(name) or []
+        if len(data) > 255 or not all(_int32(v) for v in data):
+            return None
+        out += struct.pack(f"<B{len(data)}i", len(data), *data)
+    return bytes(out)
+
+
+def _decode_sketches(body) -> dict:
+    sketches, pos = {}, 0
+    for name in _SERIES:
+        if pos >= len(body):
+            break
+        n = body[pos]
+        if n:
+            sketches[name] = list(struct.unpack_from(f"<{n}i", body, pos + 1))
+        pos += 1 + 4 * n
+    return sketches
+
+
+def encode_profile(profile: dict) -> bytes:
+    tail, keys = b"", set(profile)
+    if isinstance(profile.get("sketches"), dict):
+        tail = _encode_sketches(profile["sketches"])
+        if tail is None:
+            return _encode_json(profile)
+        keys.discard("sketches")
+    stats = profile.get("stats")
+    if (isinstance(stats, dict) and keys == {*_PROFILE_KEYS, "stats"}
+            and set(stats) == set(_PROFILE_KEYS)):
+        flat = []
+        for k in _PROFILE_KEYS:
+            n, m2, ewma = stats[k]
+            flat.extend((int(n), float(profile[k]), float(m2), float(ewma)))
+        return bytes([TAG_STATS]) + _STATS.pack(*flat) + tail
+    if keys == set(_PROFILE_KEYS) and all(
+        _int32(profile[k]) for k in _PROFILE_KEYS[3:]
+    ):
+        return bytes([TAG_PROFILE]) + _PROFILE.pack(*(profile[k] for k in _PROFILE_KEYS)) + tail
+    return _encode_json(profile)
+
+
+def encode(field: str, value) -> bytes:
+    if field == "fractal_markers":
+        return encode_markers(value)
+    if field == "behavior_profile":
+        return encode_profile(value)
+    return _encode_json(value)
+
+
+def decode(field: str, raw):
+    """Decode a stored column value (compact BLOB or legacy JSON TEXT)."""
+    try:
+        if isinstance(raw, str):
+            return json.loads(raw)
+        if not raw:
+            return _default(field)
+        tag, body = raw[0], memoryview(raw)[1:]
+        if tag == TAG_MARKERS:
+            return [{"fx": fx, "fy": fy} for fx, fy in _POINT.iter_unpack(body)]
+        if tag == TAG_CELLS:
+            size, salt, n = _CELLS.unpack_from(body)
+            pos, cells = _CELLS.size, []
+            for _ in range(n):
+                m = body[pos]
+                cells.append([bytes(body[pos + 1 + 8 * j:pos + 9 + 8 * j]).hex() for j in range(m)])
+                pos += 1 + 8 * m
+            return {"cell": size, "salt": salt.hex(), "cells": cells}
+        if tag == TAG_PROFILE:
+            profile = dict(zip(_PROFILE_KEYS, _PROFILE.unpack_from(body)))
+            if len(body) > _PROFILE.size:
+                profile["sketches"] = _decode_sketches(body[_PROFILE.size:])
+            return profile
+        if tag == TAG_STATS:
+            flat, profile, stats = _STATS.unpack_from(body), {}, {}
+            for i, k in enumerate(_PROFILE_KEYS):
+                n, mean, m2, ewma = flat[4 * i:4 * i + 4]
+                profile[k], stats[k] = mean, [n, m2, ewma]
+            profile["stats"] = stats
+            if len(body) > _STATS.size:
+                profile["sketches"] = _decode_sketches(body[_STATS.size:])
+            return profile
+        if tag == TAG_JSON:
+            return json.loads(bytes(body))
+    except Exception:
+        pass
+    return _default(field)
+
+
+class UserRecord(Mapping):
+    """Read-only user row that decodes blob columns on first access.
+
+    `/login/level1` only needs the password hash, so it never pays for
+    unpacking markers, profiles or puzzles.
+    """
+
+    __slots__ = ("_raw", "_decoded")
+
+    def __init__(self, raw: dict, decoded: dict | None = None):
+        self._raw     = raw
+        self._decoded = decoded or {}
+
+    def __getitem__(self, key):
+        if key in BLOB_FIELDS:
+            try:
+                return self._decoded[key]
+            except KeyError:
+                value = self._decoded[key] = decode(key, self._raw[key])
+                return value
+        return self._raw[key]
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __repr__(self):
+        return f"UserRecord({self._raw.get('username')!r})"
+
+    def replace(self, fields: dict) -> "UserRecord":
+        """Return a new record with `fields` (decoded values) applied."""
+        raw     = {**self._raw}
+        decoded = {**self._decoded}
+        for k, v in fields.items():
+            if k in BLOB_FIELDS:
+                decoded[k] = v
+                raw.setdefault(k, None)
+            else:
+                raw[k] = v
+        return UserRecord(raw, decoded)
@@ -3,25 +3,246 @@ db.py — SQLite database for FractalAuth
 Stores all user data including fractal markers, behavior profiles, puzzles.
 """
 
+import atexit
 import sqlite3
 import json
 import os
-import hashlib
+import queue
 import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import codec
+import metrics
+import tracing
+from cache import LRUCache
+from codec import BLOB_FIELDS, UserRecord
+from hashing import hash_password
+from writebehind import WriteBehind, apply_op
 
 DB_PATH = os.environ.get("FRACTALAUTH_DB", "fractalauth.db")
-_lock = threading.Lock()
+# >1 spreads users over N files (see shard_paths); each shard has its own lock + pool.
+SHARDS  = int(os.environ.get("FRACTALAUTH_DB_SHARDS", "1"))
+
+# Connection tuning — every pooled connection is opened with these settings.
+POOL_SIZE    = int(os.environ.get("FRACTALAUTH_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.environ.get("FRACTALAUTH_DB_POOL_TIMEOUT", "5"))
+JOURNAL_MODE = os.environ.get("FRACTALAUTH_DB_JOURNAL", "WAL")
+SYNCHRONOUS  = os.environ.get("FRACTALAUTH_DB_SYNCHRONOUS", "NORMAL")
+CACHE_KB     = int(os.environ.get("FRACTALAUTH_DB_CACHE_KB", "8192"))
+STMT_CACHE   = int(os.environ.get("FRACTALAUTH_DB_STMT_CACHE", "128"))
+
+# Decoded user records, kept write-through by the update helpers below.
+USER_CACHE_SIZE = int(os.environ.get("FRACTALAUTH_USER_CACHE_SIZE", "4096"))
+USER_CACHE_TTL  = float(os.environ.get("FRACTALAUTH_USER_CACHE_TTL", "30"))
+
+# Failed-attempt counters and attempt-log rows are group-committed by a single writer thread.
+WRITE_BEHIND     = os.environ.get("FRACTALAUTH_WRITE_BEHIND", "1") != "0"
+WRITE_BEHIND_MS  = float(os.environ.get("FRACTALAUTH_WRITE_BEHIND_MS", "5"))
+WRITE_BEHIND_MAX = int(os.environ.get("FRACTALAUTH_WRITE_BEHIND_MAX", "10000"))
+
+# login_attempts is pruned by age and capped per shard; pruning runs in small batches.
+ATTEMPT_RETENTION_S = float(os.environ.get("FRACTALAUTH_ATTEMPT_RETENTION_S", str(7 * 86400)))
+ATTEMPT_MAX_ROWS    = int(os.environ.get("FRACTALAUTH_ATTEMPT_MAX_ROWS", "1000000"))
+ATTEMPT_PRUNE_BATCH = int(os.environ.get("FRACTALAUTH_ATTEMPT_PRUNE_BATCH", "1000"))
+# Appended rows per shard between automatic prune steps; half a batch, so pruning outpaces inserts.
+ATTEMPT_PRUNE_EVERY = max(1, ATTEMPT_PRUNE_BATCH // 2)
 
 
 def get_conn():
+    """Open a fresh, untuned connection (one-off scripts and benchmarks)."""
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
 
+def _open_tuned(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=STMT_CACHE)
+    conn.row_factory = sqlite3.Row
+    conn.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived SQLite connections.
+
+    Connections are created lazily up to `size`; callers beyond that block for
+    up to `timeout` seconds waiting for one to be returned.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path    = path
+        self.size    = max(1, size)
+        self.timeout = timeout
+        self._idle   = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._mutex  = threading.Lock()
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._mutex:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return _open_tuned(self.path)
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError(f"DB pool exhausted ({self.size} connections busy)")
+
+    def release(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        with self._mutex:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
+
+class Shard:
+    """One SQLite file with its own writer lock and connection pool."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = metrics.TimedLock(metrics.DB_LOCK_WAIT.labels(os.path.basename(path)))
+        self.pool = ConnectionPool(path)
+        self.appended = 0    # attempt rows since the last automatic prune step
+
+
+def shard_paths(n: int, base: str | None = None) -> list[str]:
+    """File layout for `n` shards: the plain DB path when n == 1."""
+    base = base or DB_PATH
+    if n <= 1:
+        return [base]
+    root, ext = os.path.splitext(base)
+    return [f"{root}.shard{i}of{n}{ext or '.db'}" for i in range(n)]
+
+
+def shard_index(username: str, n: int) -> int:
+    """Stable across processes and restarts (unlike hash())."""
+    return zlib.crc32(username.encode()) % n if n > 1 else 0
+
+
+def _shard(username: str) -> Shard:
+    return _shards[shard_index(username, len(_shards))]
+
+
+def shards() -> list[Shard]:
+    return list(_shards)
+
+
+def _group_by_shard(usernames) -> dict:
+    groups = {}
+    for u in usernames:
+        groups.setdefault(shard_index(u, len(_shards)), []).append(u)
+    return groups
+
+
+_shards = [Shard(p) for p in shard_paths(SHARDS)]
+# Unsharded aliases, used by maintenance scripts and benchmarks.
+_pool, _lock = _shards[0].pool, _shards[0].lock
+_user_cache = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+
+def close_pool():
+    """Close all idle pooled connections (shutdown / tests)."""
+    for sh in _shards:
+        sh.pool.close()
+
+
+def configure(path: str | None = None, shards: int | None = None):
+    """Re-point the module at another database/shard layout (tools, benchmarks)."""
+    global DB_PATH, SHARDS, _shards, _pool, _lock
+    flush_writes()
+    close_pool()
+    DB_PATH = path or DB_PATH
+    SHARDS  = shards or SHARDS
+    _shards = [Shard(p) for p in shard_paths(SHARDS)]
+    _pool, _lock = _shards[0].pool, _shards[0].lock
+    _user_cache.clear()
+    init_db()
+
+
+def _apply_batch(ops: dict, rows: list):
+    groups = _group_by_shard(ops)
+    row_groups = {}
+    for r in rows:
+        row_groups.setdefault(shard_index(r[0], len(_shards)), []).append(r)
+    for idx in set(groups) | set(row_groups):
+        sh = _shards[idx]
+        users = groups.get(idx, [])
+        resets = [(ops[u][1], u) for u in users if ops[u][0]]
+        deltas = [(ops[u][1], u) for u in users if not ops[u][0]]
+        with sh.lock, sh.pool.connection() as conn:
+            if resets:
+                conn.executemany("UPDATE users SET failed_attempts=? WHERE username=?", resets)
+            if deltas:
+                conn.executemany("UPDATE users SET failed_attempts=failed_attempts+? WHERE username=?", deltas)
+            if idx in row_groups:
+                _insert_attempts(conn, sh, row_groups[idx])
+            conn.commit()
+
+
+_writer = (WriteBehind(_apply_batch, WRITE_BEHIND_MS / 1000, WRITE_BEHIND_MAX)
+           if WRITE_BEHIND else None)
+
+
+@metrics.register
+def _collect():
+    c = _user_cache.stats()
+    out = [("fractalauth_user_cache_events_total", "counter", "User record cache lookups and removals.",
+            [({"event": k}, c[k]) for k in ("hits", "misses", "evictions", "expirations")]),
+           ("fractalauth_user_cache_size", "gauge", "Decoded user records cached.", [({}, c["size"])])]
+    if _writer:
+        w = _writer.stats()
+        out.append(("fractalauth_write_behind_pending", "gauge", "Buffered counter ops and attempt rows.",
+                    [({"kind": "users"}, w["pending"]), ({"kind": "rows"}, w["pending_rows"])]))
+    return out
+
+
+def flush_writes() -> bool:
+    """Commit any buffered counter updates and attempt rows now."""
+    return _writer.flush() if _writer else True
+
+
+def shutdown():
+    """Flush write-behind buffers and close pooled connections."""
+    if _writer:
+        _writer.close()
+    close_pool()
+
+
 def init_db():
-    with _lock:
-        conn = get_conn()
+    for sh in _shards:
+        _init_shard(sh)
+
+
+def _init_shard(sh: Shard):
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute("""
             CREATE TABLE IF NOT EXISTS users (
                 username        TEXT PRIMARY KEY,
@@ -36,63 +257,157 @@ def init_db():
                 behavior_profile TEXT DEFAULT '{}',
                 easy_puzzle     TEXT DEFAULT '{}',
                 hard_puzzle     TEXT DEFAULT '{}',
-                is_complete     INTEGER DEFAULT 0
+                is_complete     INTEGER DEFAULT 0,
+                known_devices   BLOB DEFAULT NULL
+            )
+        """)
+        cols = {r["name"] for r in conn.execute("PRAGMA table_info(users)")}
+        if "known_devices" not in cols:          # databases created before devices.py
+            conn.execute("ALTER TABLE users ADD COLUMN known_devices BLOB DEFAULT NULL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS login_attempts (
+                id       INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                ts       REAL NOT NULL,
+                outcome  TEXT NOT NULL,
+                ip       TEXT DEFAULT '',
+                ua       TEXT DEFAULT ''
             )
         """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_attempts_user_ts ON login_attempts(username, ts)")
         conn.commit()
-        conn.close()
-
-
-def hash_password(pw: str) -> str:
-    return hashlib.sha256(pw.encode()).hexdigest()
 
 
 def user_exists(username: str) -> bool:
-    conn = get_conn()
-    row = conn.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone()
-    conn.close()
+    with _shard(username).pool.connection() as conn:
+        row = conn.execute("SELECT 1 FROM users WHERE username=?", (username,)).fetchone()
     return row is not None
 
 
-def create_user(username: str, email: str, password: str, ip: str = "", ua: str = ""):
-    import time
-    with _lock:
-        conn = get_conn()
+@metrics.timed(metrics.DB_SECONDS, "create_user")
+@tracing.traced("db.create_user")
+def create_user(username: str, email: str, password: str, ip: str = "", ua: str = "",
+                password_hash: str | None = None):
+    """Insert a new user. Pass `password_hash` when it was computed off-thread."""
+    if password_hash is None:
+        password_hash = hash_password(password)
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute(
             "INSERT INTO users (username,email,password_hash,registered_ip,registered_ua,registered_at) VALUES (?,?,?,?,?,?)",
-            (username, email, hash_password(password), ip, ua, time.time())
+            (username, email, password_hash, ip, ua, time.time())
         )
         conn.commit()
-        conn.close()
-
-
-def get_user(username: str) -> dict | None:
-    conn = get_conn()
-    row = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
-    conn.close()
-    if not row:
-        return None
-    d = dict(row)
-    # Deserialize JSON fields
-    for field in ("fractal_markers", "behavior_profile", "easy_puzzle", "hard_puzzle"):
-        try:
-            d[field] = json.loads(d[field])
-        except Exception:
-            d[field] = [] if field == "fractal_markers" else {}
-    return d
 
 
+@tracing.traced("db.get_user")
+def get_user(username: str) -> UserRecord | None:
+    """Return the user record; blob columns are decoded lazily on access.
+
+    Records may come from the shared cache, so they are read-only — go
+    through update_field/update_many to change anything.
+    """
+    cached = _user_cache.get(username)
+    if cached is not None:
+        return cached
+    return load_user(username)
+
+
+def cached_user(username: str) -> UserRecord | None:
+    """Cache-only lookup; never touches SQLite."""
+    return _user_cache.get(username)
+
+
+@metrics.timed(metrics.DB_SECONDS, "load_user")
+@tracing.traced("db.load_user")
+def load_user(username: str) -> UserRecord | None:
+    """Read the row from SQLite (bypassing the cache check) and cache it."""
+    token = _user_cache.token()
+    while True:
+        seq = _writer.read_seq() if _writer else 0
+        with _shard(username).pool.connection() as conn:
+            row = conn.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
+        if not row:
+            return None
+        raw = dict(row)
+        if not _writer:
+            break
+        # Overlay buffered counter ops; retry if a flush started or committed in between.
+        raw["failed_attempts"] = apply_op(raw["failed_attempts"], _writer.pending(username))
+        if _writer.unchanged(seq):
+            break
+    rec = UserRecord(raw)
+    _user_cache.put(username, rec, token)
+    return rec
+
+
+USER_COLUMNS = frozenset((
+    "username", "email", "password_hash", "registered_ip", "registered_ua", "registered_at",
+    "failed_attempts", "fractal_type", "fractal_markers", "behavior_profile",
+    "easy_puzzle", "hard_puzzle", "is_complete", "known_devices",
+))
+
+
+@tracing.traced("db.get_fields")
+def get_fields(username: str, fields) -> UserRecord | None:
+    """Like get_user, but a cache miss reads only `fields` (and isn't cached).
+
+    For login steps that already know who the user is and need one or two
+    columns — e.g. only the chosen puzzle instead of the whole row.
+    """
+    cached = _user_cache.get(username)
+    if cached is not None:
+        return cached
+    fields = tuple(fields)
+    unknown = set(fields) - USER_COLUMNS
+    if unknown:
+        raise ValueError(f"unknown user columns: {', '.join(sorted(unknown))}")
+    while True:
+        seq = _writer.read_seq() if _writer else 0
+        with _shard(username).pool.connection() as conn:
+            row = conn.execute(f"SELECT {','.join(fields)} FROM users WHERE username=?",
+                               (username,)).fetchone()
+        if not row:
+            return None
+        raw = dict(row)
+        if not _writer or "failed_attempts" not in raw:
+            break
+        raw["failed_attempts"] = apply_op(raw["failed_attempts"], _writer.pending(username))
+        if _writer.unchanged(seq):
+            break
+    return UserRecord(raw)
+
+
+def cache_stats() -> dict:
+    return _user_cache.stats()
+
+
+def _patched(fields: dict):
+    """Copy-on-write patch for a cached record, so earlier readers keep their snapshot."""
+    return lambda rec: rec.replace(fields)
+
+
+def _encode(field: str, value):
+    if field in BLOB_FIELDS:
+        return codec.encode(field, value)
+    return json.dumps(value) if isinstance(value, (dict, list)) else value
+
+
+@metrics.timed(metrics.DB_SECONDS, "update_field")
+@tracing.traced("db.update_field")
 def update_field(username: str, field: str, value):
-    """Update a single field. JSON-encodes dicts/lists."""
-    if isinstance(value, (dict, list)):
-        value = json.dumps(value)
-    with _lock:
-        conn = get_conn()
+    """Update a single field. Blob columns use the compact codec, other dicts/lists JSON."""
+    decoded = value
+    value = _encode(field, value)
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute(f"UPDATE users SET {field}=? WHERE username=?", (value, username))
         conn.commit()
-        conn.close()
+        _user_cache.update(username, _patched({field: decoded}))
 
 
+@metrics.timed(metrics.DB_SECONDS, "update_many")
+@tracing.traced("db.update_many")
 def update_many(username: str, fields: dict):
     """Update multiple fields at once."""
     if not fields:
@@ -101,41 +416,149 @@ def update_many(username: str, fields: dict):
     vals = []
     for k, v in fields.items():
         sets.append(f"{k}=?")
-        vals.append(json.dumps(v) if isinstance(v, (dict, list)) else v)
+        vals.append(_encode(k, v))
     vals.append(username)
-    with _lock:
-        conn = get_conn()
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute(f"UPDATE users SET {','.join(sets)} WHERE username=?", vals)
         conn.commit()
-        conn.close()
+        _user_cache.update(username, _patched(dict(fields)))
 
 
+@metrics.timed(metrics.DB_SECONDS, "increment_failed")
+@tracing.traced("db.increment_failed")
 def increment_failed(username: str):
-    with _lock:
-        conn = get_conn()
+    if _writer:
+        _writer.increment(username)
+        _user_cache.update(username, lambda rec: rec.replace({"failed_attempts": rec["failed_attempts"] + 1}))
+        return
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute(
             "UPDATE users SET failed_attempts=failed_attempts+1 WHERE username=?",
             (username,)
         )
         conn.commit()
-        conn.close()
+        _user_cache.update(username, lambda rec: rec.replace({"failed_attempts": rec["failed_attempts"] + 1}))
 
 
+@metrics.timed(metrics.DB_SECONDS, "reset_failed")
+@tracing.traced("db.reset_failed")
 def reset_failed(username: str):
-    with _lock:
-        conn = get_conn()
+    if _writer:
+        _writer.reset(username)
+        _user_cache.update(username, _patched({"failed_attempts": 0}))
+        return
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute("UPDATE users SET failed_attempts=0 WHERE username=?", (username,))
         conn.commit()
-        conn.close()
+        _user_cache.update(username, _patched({"failed_attempts": 0}))
 
 
+@metrics.timed(metrics.DB_SECONDS, "delete_user")
+@tracing.traced("db.delete_user")
 def delete_user(username: str):
-    with _lock:
-        conn = get_conn()
+    if _writer:
+        _writer.discard(username)
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
         conn.execute("DELETE FROM users WHERE username=?", (username,))
+        conn.execute("DELETE FROM login_attempts WHERE username=?", (username,))
         conn.commit()
-        conn.close()
+        _user_cache.invalidate(username)
+
+
+
+# ── Login attempt log ────────────────────────────────────────────────────────
+# Append-only; outcome is "success" or a failure reason ("bad_password", ...).
+
+@metrics.timed(metrics.DB_SECONDS, "record_attempt")
+@tracing.traced("db.record_attempt")
+def record_attempt(username: str, outcome: str, ip: str = "", ua: str = "", ts: float | None = None):
+    row = (username, ts or time.time(), outcome, ip or "", ua or "")
+    if _writer:
+        _writer.append(row)
+        return
+    sh = _shard(username)
+    with sh.lock, sh.pool.connection() as conn:
+        _insert_attempts(conn, sh, [row])
+        conn.commit()
+
+
+def _insert_attempts(conn, sh: Shard, rows: list):
+    conn.executemany("INSERT INTO login_attempts (username,ts,outcome,ip,ua) VALUES (?,?,?,?,?)", rows)
+    sh.appended += len(rows)
+    while sh.appended >= ATTEMPT_PRUNE_EVERY:
+        sh.appended -= ATTEMPT_PRUNE_EVERY
+        if not _prune_step(conn, time.time() - ATTEMPT_RETENTION_S, ATTEMPT_PRUNE_BATCH):
+            sh.appended = 0
+            break
+
+
+def _prune_step(conn, cutoff: float, batch: int) -> int:
+    """Delete at most `batch` expired rows plus `batch` rows beyond the size cap.
+
+    Only the `batch` oldest ids are looked at (a rowid range, no index on ts):
+    rows are appended in time order, so once the oldest aren't expired,
+    nothing newer is either — and the step costs O(batch), not a table scan.
+    """
+    n = conn.execute(
+        "DELETE FROM login_attempts WHERE ts<? AND id IN "
+        "(SELECT id FROM login_attempts ORDER BY id LIMIT ?)", (cutoff, batch)
+    ).rowcount
+    if ATTEMPT_MAX_ROWS:
+        max_id = conn.execute("SELECT MAX(id) FROM login_attempts").fetchone()[0] or 0
+        n += conn.execute(
+            "DELETE FROM login_attempts WHERE id IN "
+            "(SELECT id FROM login_attempts WHERE id<=? ORDER BY id LIMIT ?)",
+            (max_id - ATTEMPT_MAX_ROWS, batch),
+        ).rowcount
+    return n
+
+
+def prune_attempts(older_than_s: float | None = None, batch: int = ATTEMPT_PRUNE_BATCH) -> int:
+    """Prune every shard down to retention/cap, one short transaction per batch."""
+    cutoff = time.time() - (ATTEMPT_RETENTION_S if older_than_s is None else older_than_s)
+    total = 0
+    for sh in _shards:
+        while True:
+            with sh.lock, sh.pool.connection() as conn:
+                n = _prune_step(conn, cutoff, batch)
+                conn.commit()
+            total += n
+            if n == 0:
+                break
+    return total
+
+
+@metrics.timed(metrics.DB_SECONDS, "count_failures")
+@tracing.traced("db.count_failures")
+def count_failures(username: str, window_s: float, now: float | None = None) -> int:
+    """Failed attempts in the last `window_s` seconds since the latest success.
+
+    Two index range scans on (username, ts); buffered attempts are overlaid.
+    """
+    since = (now or time.time()) - window_s
+    while True:
+        seq = _writer.read_seq() if _writer else 0
+        with _shard(username).pool.connection() as conn:
+            n = conn.execute(
+                "SELECT COUNT(*) FROM login_attempts"
+                " WHERE username=? AND ts>=? AND outcome!='success' AND ts>COALESCE("
+                "  (SELECT MAX(ts) FROM login_attempts"
+                "   WHERE username=? AND ts>=? AND outcome='success'), 0)",
+                (username, since, username, since),
+            ).fetchone()[0]
+        if not _writer:
+            return n
+        for _, ts, outcome, _, _ in _writer.pending_rows(username):
+            if ts >= since:
+                n = 0 if outcome == "success" else n + 1
+        if _writer.unchanged(seq):
+            return n
 
 
 # Auto-initialise on import
 init_db()
+atexit.register(flush_writes)
@@ -0,0 +1,73 @@
+"""
+devices.py — Per-user set of known device fingerprints, packed in one BLOB.
+
+Users log in from more than one browser, so instead of a single
+registered_ua the users.known_devices column keeps up to
+FRACTALAUTH_MAX_DEVICES fingerprints, each a fixed 12-byte record:
+
+    8 bytes   BLAKE2b digest of the User-Agent (the UA itself isn't stored)
+    uint32    last successful login from it (unix seconds)
+
+`known` answers membership with a C-level bytes.find over the raw column —
+nothing is unpacked per request. The fingerprint assessed at risk time
+travels in the level-3 step token, and `remember` runs after the puzzle passes:
+it refreshes the entry's last-seen time or adds it, evicting the least
+recently seen device once the set is full.
+"""
+
+import hashlib
+import os
+import struct
+import time
+
+MAX_DEVICES = int(os.environ.get("FRACTALAUTH_MAX_DEVICES", "5"))
+
+_RECORD = struct.Struct("<8sI")
+_DIGEST = 8
+
+
+def fingerprint(ua: str) -> bytes:
+    return hashlib.blake2b(ua.encode("utf-8", "replace"), digest_size=_DIGEST,
+                           person=b"fractal-device").digest()
+
+
+def _find(blob: bytes, fp: bytes) -> int:
+    """Byte offset of the record holding `fp`, or -1."""
+    i = blob.find(fp)
+    while i != -1:
+        if i % _RECORD.size == 0:
+            return i
+        i = blob.find(fp, i + 1)
+    return -1
+
+
+def known(blob: bytes | None, ua: str) -> bool:
+    return bool(blob) and bool(ua) and _find(blob, fingerprint(ua)) != -1
+
+
+def count(blob: bytes | None) -> int:
+    return len(blob or b"") // _RECORD.size
+
+
+def entries(blob: bytes | None) -> list[tuple[str, int]]:
+    """[(fingerprint hex, last seen)] most recent first."""
+    rows = [(fp.hex(), seen) for fp, seen in _RECORD.iter_unpack(blob or b"")]
+    return sorted(rows, key=lambda r: r[1], reverse=True)
+
+
+def remember(blob: bytes | None, fp: bytes, now: float | None = None,
+             limit: int = MAX_DEVICES) -> bytes:
+    """Return the column value with fingerprint `fp` marked as seen now (LRU-evicting past `limit`)."""
+    blob = bytes(blob or b"")
+    if len(fp) != _DIGEST:
+        raise ValueError("not a device fingerprint")
+    seen = int(now if now is not None else time.time())
+    i = _find(blob, fp)
+    if i != -1:
+        return blob[:i] + _RECORD.pack(fp, seen) + blob[i + _RECORD.size:]
+    rows = list(_RECORD.iter_unpack(blob))
+    rows.append((fp, seen))
+    if len(rows) > limit:
+        rows.sort(key=lambda r: r[1])
+        rows = rows[len(rows) - limit:]
+    return b"".join(_RECORD.pack(*r) for r in rows)
@@ -0,0 +1,235 @@
+"""
+geoip.py — Longest-prefix-match CIDR → (region, ASN) lookups, IPv4 and IPv6.
+
+The table is a local CSV (FRACTALAUTH_GEOIP), one network per line:
+
+    # cidr,region,asn
+    81.2.69.0/24,GB-London,AS20712
+    2a02:c7f::/32,GB,AS5607
+
+At load time nested networks are flattened into disjoint, sorted address
+intervals (the longest prefix wins where they overlap), so a lookup is one
+bisect over a packed array: interval starts/ends as uint32 for IPv4, Python
+ints for IPv6, and a uint32 index into the de-duplicated (region, ASN)
+labels. IPv4-mapped IPv6 addresses are looked up as IPv4.
+
+Like the rule file, the table is re-read when its mtime changes (checked at
+most every FRACTALAUTH_GEOIP_RELOAD_S) and swapped in whole; a file that
+fails to parse keeps the previous table. With no file configured every
+lookup returns None and callers fall back to comparing network prefixes.
+"""
+
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+GEOIP_PATH = os.environ.get("FRACTALAUTH_GEOIP", "")
+RELOAD_S   = float(os.environ.get("FRACTALAUTH_GEOIP_RELOAD_S", "30"))   # 0 = never reload
+
+FALLBACK_PREFIX = {4: 24, 6: 48}     # network compared when an address isn't in the table
+
+
+class GeoError(ValueError):
+    """The CIDR file is unreadable or malformed."""
+
+
+class Geo(NamedTuple):
+    region: str
+    asn: str
+
+
+def parse_ip(ip: str) -> tuple[int, int] | None:
+    """(version, integer value) of `ip`, IPv4-mapped IPv6 folded to 4; None if invalid."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), "big")
+    except (OSError, TypeError):
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, ip.split("%", 1)[0]), "big")
+    except (OSError, TypeError, AttributeError):
+        return None
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+def _flatten(nets: list) -> list:
+    """Nested/overlapping CIDR ranges → disjoint (start, end, label) intervals, longest prefix wins."""
+    nets.sort(key=lambda n: (n[0], -n[1]))          # containing networks before their children
+    out, stack, cursor = [], [], 0
+
+    def emit(lo, hi, label):
+        if lo > hi:
+            return
+        if out and out[-1][2] == label and out[-1][1] + 1 == lo:
+            out[-1] = (out[-1][0], hi, label)
+        else:
+            out.append((lo, hi, label))
+
+    for start, end, label in nets:
+        while stack and stack[-1][0] < start:
+            top_end, top_label = stack.pop()
+            emit(cursor, top_end, top_label)
+            cursor = top_end + 1
+        if stack:
+            emit(cursor, start - 1, stack[-1][1])
+        stack.append((end, label))
+        cursor = start
+    while stack:
+        top_end, top_label = stack.pop()
+        emit(cursor, top_end, top_label)
+        cursor = top_end + 1
+    return out
+
+
+class GeoTable:
+    """Packed, immutable interval table; build with `from_rows` or `load`."""
+
+    def __init__(self, v4: list, v6: list, labels: list, path: str = "", stamp=None):
+        self.labels = labels
+        self._v4 = (array("I", (s for s, _, _ in v4)), array("I", (e for _, e, _ in v4)),
+                    array("I", (i for _, _, i in v4)))
+        self._v6 = ([s for s, _, _ in v6], [e for _, e, _ in v6], array("I", (i for _, _, i in v6)))
+        self.path, self.stamp, self.loaded_at = path, stamp, time.time()
+
+    @classmethod
+    def from_rows(cls, rows, path: str = "", stamp=None) -> "GeoTable":
+        """rows: iterable of (cidr, region, asn)."""
+        index, labels, nets = {}, [], {4: [], 6: []}
+        for cidr, region, asn in rows:
+            try:
+                net = ipaddress.ip_network(cidr.strip(), strict=False)
+            except ValueError as e:
+                raise GeoError(f"bad network {cidr!r}: {e}") from None
+            label = Geo(region.strip(), asn.strip())
+            if label not in index:
+                index[label] = len(labels)
+                labels.append(label)
+            nets[net.version].append((int(net.network_address), int(net.broadcast_address),
+                                      index[label]))
+        return cls(_flatten(nets[4]), _flatten(nets[6]), labels, path, stamp)
+
+    def lookup(self, ip: str) -> Geo | None:
+        parsed = parse_ip(ip)
+        if parsed is None:
+            return None
+        starts, ends, idx = self._v4 if parsed[0] == 4 else self._v6
+        i = bisect_right(starts, parsed[1]) - 1
+        if i >= 0 and parsed[1] <= ends[i]:
+            return self.labels[idx[i]]
+        return None
+
+    def __len__(self):
+        return len(self._v4[0]) + len(self._v6[0])
+
+    def nbytes(self) -> int:
+        """Approximate size of the interval arrays (IPv6 ints counted at 16 bytes)."""
+        s4, e4, i4 = self._v4
+        return (s4.itemsize * len(s4) * 2 + i4.itemsize * len(i4)
+                + len(self._v6[0]) * 32 + self._v6[2].itemsize * len(self._v6[2]))
+
+
+def _file_stamp(path: str):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _rows(fh):
+    for n, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(",")
+        if len(parts) < 2:
+            raise GeoError(f"line {n}: expected cidr,region[,asn]")
+        yield parts[0], parts[1], parts[2] if len(parts) > 2 else ""
+
+
+def load(path: str) -> GeoTable:
+    try:
+        stamp = _file_stamp(path)
+        with open(path, encoding="utf-8") as fh:
+            return GeoTable.from_rows(_rows(fh), path, stamp)
+    except OSError as e:
+        raise GeoError(f"{path}: {e}") from None
+    except GeoError as e:
+        raise GeoError(f"{path}: {e}") from None
+
+
+_active: GeoTable | None = None
+_lock = threading.Lock()
+_next_check = 0.0
+_rejected = None
+
+
+def reload(path: str | None = None) -> GeoTable:
+    """Load `path` (default FRACTALAUTH_GEOIP) and make it the active table."""
+    global _active, _rejected
+    table = load(path or GEOIP_PATH)
+    _active, _rejected = table, None
+    log.info("geoip: %d intervals, %d labels from %s", len(table), len(table.labels), table.path)
+    return table
+
+
+def _check_for_changes():
+    global _next_check, _rejected
+    if not _lock.acquire(blocking=False):
+        return
+    try:
+        _next_check = time.monotonic() + RELOAD_S
+        try:
+            stamp = _file_stamp(_active.path)
+        except OSError:
+            return
+        if stamp in (_active.stamp, _rejected):
+            return
+        try:
+            reload(_active.path)
+        except GeoError as e:
+            _rejected = stamp
+            log.error("geoip: keeping previous table: %s", e)
+    finally:
+        _lock.release()
+
+
+def current() -> GeoTable | None:
+    """The active table (None when FRACTALAUTH_GEOIP is unset or has never loaded)."""
+    global _next_check
+    if _active is None:
+        if not GEOIP_PATH or time.monotonic() < _next_check:
+            return None
+        with _lock:
+            if _active is None:
+                _next_check = time.monotonic() + RELOAD_S
+                try:
+                    reload()
+                except GeoError as e:
+                    log.error("geoip: %s", e)
+                    return None
+    elif RELOAD_S > 0 and time.monotonic() >= _next_check:
+        _check_for_changes()
+    return _active
+
+
+def lookup(ip: str) -> Geo | None:
+    table = current()
+    return table.lookup(ip) if table is not None else None
+
+
+def network(ip: str) -> str:
+    """The /24 (IPv4) or /48 (IPv6) network of `ip` as text; `ip` itself if it isn't an address."""
+    parsed = parse_ip(ip)
+    if parsed is None:
+        return ip
+    version, value = parsed
+    bits = 32 if version == 4 else 128
+    keep = FALLBACK_PREFIX[version]
+    return f"{version}:{value >> (bits - keep):x}/{keep}"
@@ -0,0 +1,171 @@
+"""
+hashing.py — Password hashing for FractalAuth.
+
+Hashes are stored in a self-describing, versioned format:
+
+    $scrypt$n=16384,r=8,p=1$<salt b64>$<key b64>
+
+so the cost can be raised later without breaking existing accounts. Bare
+64-char hex strings are the legacy unsalted SHA-256 hashes; they still
+verify, and `needs_rehash` flags them (and any scrypt hash with outdated
+parameters) so the login route can upgrade them transparently.
+
+scrypt is deliberately slow, so the async helpers run it in a process pool
+instead of on request threads. At most FRACTALAUTH_HASH_QUEUE jobs may be
+queued or running at once; beyond that `HashQueueFull` is raised so callers
+shed load instead of piling up latency.
+"""
+
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+SCRYPT_N = int(os.environ.get("FRACTALAUTH_SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.environ.get("FRACTALAUTH_SCRYPT_R", "8"))
+SCRYPT_P = int(os.environ.get("FRACTALAUTH_SCRYPT_P", "1"))
+HASH_WORKERS = int(os.environ.get("FRACTALAUTH_HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE   = int(os.environ.get("FRACTALAUTH_HASH_QUEUE", str(max(1, HASH_WORKERS) * 16)))
+
+SALT_BYTES = 16
+KEY_BYTES  = 32
+
+
+class HashQueueFull(RuntimeError):
+    """Too many hashing jobs in flight; retry later."""
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(pw: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(pw.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES,
+                          maxmem=128 * r * (n + p + 2) + (1 << 20))
+
+
+def _legacy(pw: str) -> str:
+    return hashlib.sha256(pw.encode()).hexdigest()
+
+
+def _is_legacy(stored: str) -> bool:
+    return len(stored) == 64 and all(c in "0123456789abcdef" for c in stored)
+
+
+def _parse(stored: str):
+    """Split a `$scrypt$...` hash into (n, r, p, salt, key); None if malformed."""
+    try:
+        _, scheme, params, salt, key = stored.split("$")
+        if scheme != "scrypt":
+            return None
+        opts = dict(kv.split("=") for kv in params.split(","))
+        return int(opts["n"]), int(opts["r"]), int(opts["p"]), _unb64(salt), _unb64(key)
+    except (ValueError, KeyError):
+        return None
+
+
+def hash_password(pw: str, n: int = None, r: int = None, p: int = None) -> str:
+    """Hash `pw` with scrypt at the configured (or given) cost. Blocks the caller."""
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    return f"$scrypt$n={n},r={r},p={p}${_b64(salt)}${_b64(_scrypt(pw, salt, n, r, p))}"
+
+
+def verify_password(pw: str, stored: str) -> bool:
+    """Constant-time check of `pw` against either hash format. Blocks the caller."""
+    if not stored:
+        return False
+    if _is_legacy(stored):
+        return hmac.compare_digest(_legacy(pw), stored)
+    parsed = _parse(stored)
+    if parsed is None:
+        return False
+    n, r, p, salt, key = parsed
+    return hmac.compare_digest(_scrypt(pw, salt, n, r, p), key)
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for legacy SHA-256 hashes and scrypt hashes not at the current cost."""
+    parsed = _parse(stored or "")
+    if parsed is None:
+        return True
+    n, r, p, _, _ = parsed
+    return (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+# ── Offloaded hashing ────────────────────────────────────────────────────────
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(max(1, HASH_QUEUE))
+
+
+def _executor():
+    """The shared process pool (created on first use); None when HASH_WORKERS=0."""
+    global _pool
+    if HASH_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that already runs the DB/writer threads is unsafe.
+            _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+async def _offload(fn, *args):
+    if not _slots.acquire(blocking=False):
+        raise HashQueueFull(f"more than {HASH_QUEUE} password hashes in flight")
+    try:
+        loop = asyncio.get_running_loop()
+        pool = _executor()
+        if pool is None:
+            return await asyncio.to_thread(fn, *args)
+        return await loop.run_in_executor(pool, fn, *args)
+    finally:
+        _slots.release()
+
+
+async def hash_password_async(pw: str) -> str:
+    # Cost is passed explicitly: workers must follow this process's settings.
+    return await _offload(hash_password, pw, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+
+async def verify_password_async(pw: str, stored: str) -> bool:
+    # Legacy hashes are a single SHA-256 — not worth a round trip to the pool.
+    if stored and _is_legacy(stored):
+        return verify_password(pw, stored)
+    return await _offload(verify_password, pw, stored)
+
+
+def hash_many(passwords, chunksize: int = 64) -> list:
+    """Hash a batch of passwords across the pool (bulk import); order is preserved."""
+    pool = _executor()
+    if pool is None:
+        return [hash_password(pw) for pw in passwords]
+    fn = functools.partial(hash_password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return list(pool.map(fn, passwords, chunksize=chunksize))
+
+
+def warmup():
+    """Start the worker processes now rather than on the first login."""
+    pool = _executor()
+    if pool is not None:
+        list(pool.map(int, range(HASH_WORKERS)))
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
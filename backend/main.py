@@ -3,15 +3,38 @@ FractalAuth Backend — FastAPI
 All Level 3 (Behavioral) and Level 4 (Contextual) risk logic lives here.
 """
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
-import json, math, statistics, time
+from pydantic import AfterValidator, BaseModel
+from typing import Annotated, Optional, List
+from contextlib import asynccontextmanager
+import ipaddress, json, math, os, statistics, time
 from datetime import datetime
-import db
+import adb, devices, hashing, markerkey, metrics, profiles, ratelimit, riskcache, rules, storage, telemetry, tokens, tracing
+from sketch import QuantileSketch
 
-app = FastAPI(title="FractalAuth API", version="2.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    storage.get_storage()
+    rules.current()          # compile the rule file now; a broken one fails startup
+    hashing.warmup()
+    yield
+    tracing.shutdown()
+    hashing.shutdown()
+    adb.shutdown()
+    storage.get_storage().shutdown()
+
+
+class TracedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with tracing.span("json.render"):
+            return super().render(content)
+
+
+app = FastAPI(title="FractalAuth API", version="2.0", lifespan=lifespan,
+              default_response_class=TracedJSONResponse if tracing.ENABLED else JSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,11 +42,25 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(tracing.TracingMiddleware)
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
 
-FRACTAL_THRESHOLD = 0.08  # lenient coordinate matching tolerance
+# Scoring weights, puzzle/risk cuts and the fractal tolerance live in risk_rules.json (rules.py).
+FAILURE_WINDOW_S  = 15 * 60  # failed attempts older than this no longer raise risk
+SHAPE_MIN_SAMPLES = 10       # learned samples before a series' p10–p90 band is compared
+# Reverse proxies (IPs / CIDRs) whose X-Forwarded-For is believed; unset = use the peer address.
+TRUSTED_PROXIES   = tuple(ipaddress.ip_network(n.strip(), strict=False)
+                          for n in os.environ.get("FRACTALAUTH_TRUSTED_PROXIES", "").split(",") if n.strip())
 
 # ─────────────────────────── SCHEMAS ────────────────────────────────────────
 
+# JSON bodies may carry NaN / Infinity / 1e400; such samples are dropped (a
+# non-finite fractal time counts as unmeasured) before they reach a mean,
+# a sketch or a learned profile.
+Samples     = Annotated[List[float], AfterValidator(lambda xs: [x for x in xs if math.isfinite(x)])]
+FractalTime = Annotated[float, AfterValidator(lambda v: v if math.isfinite(v) else 5000.0)]
+
 class RegisterL1(BaseModel):
     username: str
     email: str
@@ -39,13 +76,13 @@ class RegisterL2(BaseModel):
     markers: List[FractalMarker]
 
 class BehaviorPayload(BaseModel):
-    username: str
-    mouse_speeds: List[float] = []
-    pause_durations: List[float] = []
+    username: str = ""
+    mouse_speeds: Samples = []
+    pause_durations: Samples = []
     click_count: int = 3
     zoom_count: int = 1
-    fractal_time_ms: float = 5000.0
-    action_intervals: List[float] = []
+    fractal_time_ms: FractalTime = 5000.0
+    action_intervals: Samples = []
 
 class RegisterPuzzles(BaseModel):
     username: str
@@ -54,165 +91,215 @@ class RegisterPuzzles(BaseModel):
 
 class RegisterBehavior(BaseModel):
     username: str
-    mouse_speeds: List[float] = []
-    pause_durations: List[float] = []
+    mouse_speeds: Samples = []
+    pause_durations: Samples = []
     click_count: int = 3
     zoom_count: int = 1
-    fractal_time_ms: float = 5000.0
-    action_intervals: List[float] = []
+    fractal_time_ms: FractalTime = 5000.0
+    action_intervals: Samples = []
 
 class LoginL1(BaseModel):
     username: str
     password: str
 
 class LoginL2(BaseModel):
-    username: str
+    token: str
     markers: List[FractalMarker]
 
 class RiskRequest(BaseModel):
-    username: str
-    behavior: BehaviorPayload
+    token: str
+    behavior: Optional[BehaviorPayload] = None  # only needed without streamed telemetry
     ip_address: Optional[str] = "127.0.0.1"
     user_agent: Optional[str] = ""
     login_hour: Optional[int] = None
 
 class PuzzleVerify(BaseModel):
-    username: str
+    token: str
     answer: str
 
+class ProfilerConfig(BaseModel):
+    every: int = 0          # profile one in N requests; 0 = off
+    mode: str = "cpu"       # cpu | memory | both
+
 # ─────────────────────────── HELPERS ────────────────────────────────────────
 
-def markers_match(stored: list, incoming: List[FractalMarker]) -> bool:
+def markers_match(stored, incoming: List[FractalMarker]) -> bool:
+    """Plain coordinates: distance check; hashed keys (markerkey.py): one cell probe per marker."""
+    if markerkey.is_hashed(stored):
+        return markerkey.verify(stored, [(m.fx, m.fy) for m in incoming])
     if len(stored) != len(incoming):
         return False
+    threshold = rules.current().fractal_threshold
     for s, inp in zip(stored, incoming):
         dist = math.sqrt((s["fx"] - inp.fx) ** 2 + (s["fy"] - inp.fy) ** 2)
-        if dist > FRACTAL_THRESHOLD:
+        if dist > threshold:
             return False
     return True
 
 
+def enroll_markers(markers: list):
+    """What to store in fractal_markers for `markers` under FRACTALAUTH_MARKER_MODE."""
+    if markerkey.MARKER_MODE == "hashed":
+        return markerkey.enroll(markers, rules.current().fractal_threshold)
+    return markers
+
+
 def behavioral_risk(stored_profile: dict, current: BehaviorPayload) -> dict:
     """Level 3 — compare live session behaviour vs registration baseline."""
-    logs, scores = [], []
-
-    def deviation_risk(cur, ref, weight, label):
-        if ref and ref > 0:
-            dev = abs(cur - ref) / (ref + 1e-9)
-            risk = min(100, dev * 100)
-            scores.append(risk * weight)
-            lvl = "WARN" if risk > 40 else "OK"
-            logs.append({"level": lvl,
-                         "msg": f"{label}: deviation {risk:.1f}%  (now={cur:.3f} | reg={ref:.3f})"})
-        else:
-            scores.append(10 * weight)
-            logs.append({"level": "INFO", "msg": f"{label}: no baseline — assuming low risk"})
-
     cur_speed  = statistics.mean(current.mouse_speeds)  if current.mouse_speeds  else 0
     cur_pause  = statistics.mean(current.pause_durations) if current.pause_durations else 1000
-
-    deviation_risk(cur_speed, stored_profile.get("avg_mouse_speed", 0),  0.25, "Mouse speed")
-    deviation_risk(cur_pause, stored_profile.get("avg_pause_ms", 0),     0.25, "Pause duration")
-    deviation_risk(current.fractal_time_ms, stored_profile.get("fractal_time_ms", 0), 0.30, "Fractal time")
-    deviation_risk(current.click_count,     stored_profile.get("click_count", 0),     0.20, "Click count")
-
-    return {"risk": min(100, round(sum(scores))), "logs": logs}
-
-
-def contextual_risk(username: str, ip: str, ua: str, hour: int) -> dict:
-    """Level 4 — check device, time, IP, failed attempts."""
-    user = db.get_user(username)
-    logs, scores = [], []
-
-    # 1. Unusual login hour
-    if hour < 5 or hour >= 23:
-        scores.append(20)
-        logs.append({"level": "WARN", "msg": f"Login at unusual hour: {hour:02d}:xx"})
-    else:
-        scores.append(0)
-        logs.append({"level": "OK",   "msg": f"Login hour {hour:02d}:xx within normal range"})
-
-    # 2. Previous failed attempts
-    failed = user.get("failed_attempts", 0)
-    if failed >= 3:
-        scores.append(35)
-        logs.append({"level": "RISK", "msg": f"{failed} previous failed login attempts"})
-    elif failed >= 1:
-        scores.append(15)
-        logs.append({"level": "WARN", "msg": f"{failed} previous failed attempt(s)"})
-    else:
-        scores.append(0)
-        logs.append({"level": "OK",   "msg": "No prior failed attempts"})
-
-    # 3. User-Agent (device) fingerprint
-    stored_ua = user.get("registered_ua", "")
-    if stored_ua and ua and stored_ua != ua:
-        scores.append(20)
-        logs.append({"level": "WARN", "msg": "Device/browser fingerprint changed"})
-    elif not stored_ua:
-        scores.append(5)
-        logs.append({"level": "INFO", "msg": "No prior device fingerprint on record"})
-    else:
-        scores.append(0)
-        logs.append({"level": "OK",   "msg": "Device fingerprint consistent"})
-
-    # 4. IP address
-    stored_ip = user.get("registered_ip", "")
-    if stored_ip and ip and stored_ip != ip:
-        scores.append(15)
-        logs.append({"level": "WARN", "msg": f"IP changed: {stored_ip} → {ip}"})
-    else:
-        scores.append(0)
-        logs.append({"level": "OK",   "msg": f"IP address consistent ({ip})"})
-
-    # 5. Simulated geo (subnet prefix)
-    if stored_ip and ip:
-        if stored_ip.rsplit(".", 1)[0] != ip.rsplit(".", 1)[0]:
-            scores.append(10)
-            logs.append({"level": "WARN", "msg": "Geographic region anomaly detected"})
-        else:
-            scores.append(0)
-            logs.append({"level": "OK",   "msg": "Geographic region consistent"})
-
-    return {"risk": min(100, round(sum(scores))), "logs": logs}
+    return behavioral_risk_from(stored_profile, cur_speed, cur_pause,
+                                current.fractal_time_ms, current.click_count)
+
+
+def behavioral_risk_from(stored_profile: dict, cur_speed: float, cur_pause: float,
+                         fractal_time_ms: float, click_count: int) -> dict:
+    """Level 3 scoring on already-aggregated session behaviour (see telemetry.py).
+
+    Metrics with enough learned samples (profiles.py) are scored by z-score
+    around their EWMA; the rest by percentage deviation from the stored mean.
+    Weights and levels come from the compiled rule file (rules.py).
+    """
+    return rules.current().behavioral(stored_profile, (cur_speed, cur_pause,
+                                                       fractal_time_ms, click_count))
+
+
+@tracing.traced("risk.contextual")
+def contextual_risk(username: str, ip: str, ua: str, hour: int, user: dict | None = None,
+                    recent_failures: int | None = None) -> dict:
+    """Level 4 — check device, time, IP, failed attempts (rules.py).
+
+    Pass `user` / `recent_failures` when the caller already loaded them to skip
+    the lookups.
+    """
+    if user is None:
+        user = storage.get_storage().get_user(username)
+    if recent_failures is None:
+        recent_failures = storage.get_storage().count_failures(username, FAILURE_WINDOW_S)
+    return rules.current().contextual(rules.Context(
+        hour, recent_failures, f"{FAILURE_WINDOW_S // 60} min", ip, ua,
+        user.get("registered_ip", ""), user.get("registered_ua", ""),
+        user.get("known_devices") or b""))
+
+
+SHAPE_SERIES = (("mouse_speeds", "Mouse speed"), ("pause_durations", "Pause"),
+                ("action_intervals", "Click interval"))
+
+
+@tracing.traced("risk.shape")
+def behavior_shape(stored_profile: dict, sketches: dict) -> tuple[dict, list]:
+    """p10/p50/p90 of each behaviour series, checked against the learned sketches.
+
+    Informational only — the Level 3 score is unchanged — so a session's
+    spread can be inspected (and replayed) before it is given a weight.
+    """
+    features, logs = {}, []
+    for name, label in SHAPE_SERIES:
+        sk = sketches.get(name)
+        cur = sk.features() if sk is not None else None
+        if cur is None:
+            continue
+        features[name] = cur
+        base = profiles.sketch(stored_profile, name)
+        if base.count < SHAPE_MIN_SAMPLES:
+            continue
+        usual = base.features()
+        inside = base.quantile(0.1) <= sk.quantile(0.5) <= base.quantile(0.9)
+        logs.append({"level": "OK" if inside else "WARN",
+                     "msg": f"{label} p10/p50/p90: now={cur['p10']:.3g}/{cur['p50']:.3g}/{cur['p90']:.3g}"
+                            f" | usual={usual['p10']:.3g}/{usual['p50']:.3g}/{usual['p90']:.3g}"})
+    return features, logs
+
+
+def composite_risk(behavioral: int, contextual: int) -> int:
+    """Level 3 and Level 4 blended by the rule file's behavioral_share."""
+    return rules.current().composite(behavioral, contextual)
+
+
+def _trusted_proxy(host: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(addr in net for net in TRUSTED_PROXIES)
+
+
+def client_meta(request: Request) -> tuple[str, str]:
+    """(client IP, User-Agent). The IP is the peer address unless that is a trusted
+    proxy; then it is the nearest X-Forwarded-For hop not added by a trusted proxy."""
+    ip = request.client.host if request.client else ""
+    if TRUSTED_PROXIES and _trusted_proxy(ip):
+        for hop in reversed(request.headers.get("x-forwarded-for", "").split(",")):
+            hop = hop.strip()
+            if not hop:
+                continue
+            ip = hop
+            if not _trusted_proxy(hop):
+                break
+    return ip, request.headers.get("user-agent", "")
+
+
+async def _hash_call(job):
+    """Await an offloaded hashing job, mapping a full hashing queue to 503."""
+    try:
+        return await job
+    except hashing.HashQueueFull:
+        raise HTTPException(503, "Server busy, please retry", headers={"Retry-After": "1"})
+
+
+def _throttle(scope: str, username: str, request: Request):
+    """Token-bucket check per username and client IP; 429 before any DB access."""
+    ip, _ = client_meta(request)
+    wait = ratelimit.check(scope, username, ip)
+    if wait:
+        raise HTTPException(429, "Too many login attempts, please slow down",
+                            headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+def _step(token: str, level: int) -> tokens.StepToken:
+    """Validate the step token from the previous login step, or 401."""
+    try:
+        return tokens.verify(token, level)
+    except tokens.TokenError as e:
+        raise HTTPException(401, str(e))
 
 # ─────────────────────────── ROUTES ─────────────────────────────────────────
 
 @app.get("/")
 def root():
-    return {"status": "FractalAuth API v2 running", "db": "SQLite"}
+    return {"status": "FractalAuth API v2 running", "db": storage.get_storage().name}
 
 
 # ── REGISTRATION ─────────────────────────────────────────────────────────────
 
 @app.post("/register/level1")
-def register_l1(data: RegisterL1, request: Request):
-    if db.user_exists(data.username):
+async def register_l1(data: RegisterL1, request: Request):
+    if await adb.user_exists(data.username):
         raise HTTPException(400, "Username already taken")
     if len(data.password) < 8:
         raise HTTPException(400, "Password must be at least 8 characters")
-    ip = request.headers.get("x-forwarded-for", "") or (request.client.host if request.client else "")
-    ua = request.headers.get("user-agent", "")
-    db.create_user(data.username, data.email, data.password, ip, ua)
+    ip, ua = client_meta(request)
+    pw_hash = await _hash_call(hashing.hash_password_async(data.password))
+    await adb.create_user(data.username, data.email, data.password, ip, ua, password_hash=pw_hash)
     return {"success": True, "message": "Identity verified"}
 
 
 @app.post("/register/level2")
-def register_l2(data: RegisterL2):
-    if not db.user_exists(data.username):
+async def register_l2(data: RegisterL2):
+    if not await adb.user_exists(data.username):
         raise HTTPException(404, "User not found")
     if len(data.markers) < 3:
         raise HTTPException(400, "Exactly 3 markers required")
-    db.update_many(data.username, {
+    await adb.update_many(data.username, {
         "fractal_type": data.fractal_type,
-        "fractal_markers": [{"fx": m.fx, "fy": m.fy} for m in data.markers],
+        "fractal_markers": enroll_markers([{"fx": m.fx, "fy": m.fy} for m in data.markers]),
     })
     return {"success": True}
 
 
 @app.post("/register/behavior")
-def register_behavior(data: RegisterBehavior):
-    if not db.user_exists(data.username):
+async def register_behavior(data: RegisterBehavior):
+    if not await adb.user_exists(data.username):
         raise HTTPException(404, "User not found")
     profile = {
         "avg_mouse_speed": statistics.mean(data.mouse_speeds) if data.mouse_speeds else 0,
@@ -220,16 +307,18 @@ def register_behavior(data: RegisterBehavior):
         "fractal_time_ms": data.fractal_time_ms,
         "click_count":     data.click_count,
         "zoom_count":      data.zoom_count,
+        "sketches":        {name: QuantileSketch().extend(getattr(data, name)).to_list()
+                            for name in profiles.SERIES if getattr(data, name)},
     }
-    db.update_field(data.username, "behavior_profile", profile)
+    await adb.update_field(data.username, "behavior_profile", profile)
     return {"success": True, "profile": profile}
 
 
 @app.post("/register/puzzles")
-def register_puzzles(data: RegisterPuzzles):
-    if not db.user_exists(data.username):
+async def register_puzzles(data: RegisterPuzzles):
+    if not await adb.user_exists(data.username):
         raise HTTPException(404, "User not found")
-    db.update_many(data.username, {
+    await adb.update_many(data.username, {
         "easy_puzzle": data.easy_puzzle,
         "hard_puzzle": data.hard_puzzle,
         "is_complete":  1,
@@ -239,79 +328,266 @@ def register_puzzles(data: RegisterPuzzles):
 
 # ── LOGIN ─────────────────────────────────────────────────────────────────────
 
+
+async def _login_failed(username: str, reason: str, request: Request):
+    ip, ua = client_meta(request)
+    await adb.increment_failed(username)
+    await adb.record_attempt(username, reason, ip, ua)
+
+
 @app.post("/login/level1")
-def login_l1(data: LoginL1):
-    user = db.get_user(data.username)
+async def login_l1(data: LoginL1, request: Request):
+    _throttle("level1", data.username, request)
+    user = await adb.get_user(data.username)
     if not user:
         raise HTTPException(401, "Invalid credentials")
     if not user.get("is_complete"):
         raise HTTPException(401, "Registration not complete. Please finish registration first.")
-    if user["password_hash"] != db.hash_password(data.password):
-        db.increment_failed(data.username)
+    stored = user["password_hash"]
+    if not await _hash_call(hashing.verify_password_async(data.password, stored)):
+        await _login_failed(data.username, "bad_password", request)
         raise HTTPException(401, "Invalid credentials")
+    if hashing.needs_rehash(stored):
+        # Upgrade legacy SHA-256 / outdated-cost hashes while we know the password.
+        try:
+            new_hash = await hashing.hash_password_async(data.password)
+        except hashing.HashQueueFull:
+            pass  # try again on a later login
+        else:
+            await adb.update_field(data.username, "password_hash", new_hash)
     # Return ONLY fractal type — never coordinates
-    return {"success": True, "fractal_type": user["fractal_type"]}
+    return {"success": True, "fractal_type": user["fractal_type"],
+            "token": tokens.issue(data.username, tokens.LEVEL_PASSWORD, user["fractal_type"])}
 
 
 @app.post("/login/level2")
-def login_l2(data: LoginL2):
-    user = db.get_user(data.username)
+async def login_l2(data: LoginL2, request: Request):
+    tok  = _step(data.token, tokens.LEVEL_PASSWORD)
+    _throttle("level2", tok.username, request)
+    user = await adb.get_fields(tok.username, "fractal_markers")
     if not user:
         raise HTTPException(404, "User not found")
-    if not markers_match(user["fractal_markers"], data.markers):
-        db.increment_failed(data.username)
+    stored = user["fractal_markers"]
+    if not markers_match(stored, data.markers):
+        await _login_failed(tok.username, "bad_markers", request)
         raise HTTPException(401, "Fractal key mismatch — check your marker positions")
-    return {"success": True, "message": "Fractal key verified"}
+    if markerkey.MARKER_MODE == "hashed" and not markerkey.is_hashed(stored):
+        await adb.update_field(tok.username, "fractal_markers", markerkey.enroll(
+            stored, rules.current().fractal_threshold))
+    return {"success": True, "message": "Fractal key verified",
+            "token": tokens.advance(tok, tokens.LEVEL_FRACTAL)}
+
+
+# ── TELEMETRY ─────────────────────────────────────────────────────────────────
+
+@tracing.traced("risk.behavioral")
+def _session_behavior(tok: tokens.StepToken, profile: dict,
+                      posted: Optional[BehaviorPayload]) -> tuple[dict, dict, dict]:
+    """Level 3 result, observed metrics and series sketches.
+
+    Taken from streamed telemetry if any, else from the posted arrays.
+    """
+    s = telemetry.session(tok.session)
+    if s is not None and s.events:
+        if s.ready is not None and s.ready[0] == s.events:
+            return s.ready[1], s.observed(), s.sketches
+        return behavioral_risk_from(profile, *s.summary()), s.observed(), s.sketches
+    if posted is None:
+        raise HTTPException(400, "No behavioral telemetry for this login")
+    observed = {
+        "avg_mouse_speed": statistics.mean(posted.mouse_speeds) if posted.mouse_speeds else None,
+        "avg_pause_ms":    statistics.mean(posted.pause_durations) if posted.pause_durations else None,
+        "fractal_time_ms": posted.fractal_time_ms,
+        "click_count":     posted.click_count,
+        "zoom_count":      posted.zoom_count,
+    }
+    sketches = {name: QuantileSketch().extend(getattr(posted, name)) for name in profiles.SERIES}
+    return behavioral_risk(profile, posted), observed, sketches
+
+
+async def _ingested(tok: tokens.StepToken, s: telemetry.Session):
+    """Once the third marker lands, score behaviour so risk assessment is instant."""
+    if s.markers >= 3 and (s.ready is None or s.ready[0] != s.events):
+        user = await adb.get_user(tok.username)     # also warms the record cache
+        if user is not None:
+            s.ready = (s.events, behavioral_risk_from(user.get("behavior_profile", {}),
+                                                      *s.summary()))
+
+
+@app.websocket("/login/telemetry")
+async def telemetry_ws(ws: WebSocket, token: str = ""):
+    """Stream behaviour events (telemetry.py) for the login attempt `token` belongs to."""
+    try:
+        tok = tokens.verify(token, tokens.LEVEL_PASSWORD)
+    except tokens.TokenError:
+        await ws.close(code=4401)
+        return
+    await ws.accept()
+    s = telemetry.session(tok.session, create=True)
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+            if msg.get("text") is None:       # events are NDJSON text; refuse binary frames
+                await ws.close(code=1003)
+                return
+            telemetry.feed(s, msg["text"])
+            was_ready = s.ready
+            await _ingested(tok, s)
+            if s.ready is not was_ready:
+                await ws.send_json({"ready": True, **s.stats()})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.post("/login/telemetry")
+async def telemetry_post(request: Request, token: str = ""):
+    """NDJSON alternative to the WebSocket; the body may be streamed in chunks."""
+    tok = _step(token, tokens.LEVEL_PASSWORD)
+    s   = telemetry.session(tok.session, create=True)
+    accepted = await telemetry.feed_stream(s, request.stream())
+    await _ingested(tok, s)
+    return {"accepted": accepted, "ready": s.ready is not None, **s.stats()}
 
 
 @app.post("/login/risk-assessment")
-def risk_assessment(data: RiskRequest, request: Request):
+async def risk_assessment(data: RiskRequest, request: Request):
     """Level 3 + Level 4 combined — returns composite risk + puzzle (answer redacted)."""
-    user = db.get_user(data.username)
-    if not user:
-        raise HTTPException(404, "User not found")
-
-    ip   = data.ip_address or request.headers.get("x-forwarded-for", "127.0.0.1")
-    ua   = data.user_agent  or request.headers.get("user-agent", "")
+    tok  = _step(data.token, tokens.LEVEL_FRACTAL)
+    peer_ip, peer_ua = client_meta(request)
+    ip   = data.ip_address or peer_ip or "127.0.0.1"
+    ua   = data.user_agent  or peer_ua
     hour = data.login_hour if data.login_hour is not None else datetime.now().hour
 
-    beh_result = behavioral_risk(user.get("behavior_profile", {}), data.behavior)
-    ctx_result = contextual_risk(data.username, ip, ua, hour)
+    # A re-post within this login attempt with the same inputs gets the same answer.
+    s   = telemetry.session(tok.session)
+    key = riskcache.digest(data.behavior.model_dump() if data.behavior else None,
+                           ip, ua, hour, s.events if s is not None else 0)
+    cached = riskcache.get(tok.username, tok.session, key)
+    if cached is not None:
+        return cached
+
+    user = await adb.get_fields(tok.username, "behavior_profile", "registered_ip",
+                                "registered_ua", "known_devices", "easy_puzzle", "hard_puzzle")
+    if not user:
+        raise HTTPException(404, "User not found")
 
-    composite  = round(beh_result["risk"] * 0.5 + ctx_result["risk"] * 0.5)
-    difficulty = "hard" if composite >= 40 else "easy"
+    failures   = await adb.count_failures(tok.username, FAILURE_WINDOW_S)
+    profile    = user.get("behavior_profile", {})
+    beh_result, observed, sketches = _session_behavior(tok, profile, data.behavior)
+    features, shape_logs = behavior_shape(profile, sketches)
+    ctx_result = contextual_risk(tok.username, ip, ua, hour, user, failures)
+
+    rs         = rules.current()
+    composite  = rs.composite(beh_result["risk"], ctx_result["risk"])
+    difficulty = "hard" if composite >= rs.hard_puzzle_at else "easy"
+    metrics.RISK_SCORE.labels("behavioral").observe(beh_result["risk"])
+    metrics.RISK_SCORE.labels("contextual").observe(ctx_result["risk"])
+    metrics.RISK_SCORE.labels("composite").observe(composite)
+    metrics.PUZZLES.labels(difficulty).inc()
     raw_puzzle = user["hard_puzzle"] if difficulty == "hard" else user["easy_puzzle"]
 
     # Strip answer before sending to client
     safe_puzzle = {k: v for k, v in raw_puzzle.items() if k != "answer"}
 
-    return {
+    result = {
         "behavioral_risk":  beh_result["risk"],
         "contextual_risk":  ctx_result["risk"],
         "composite_risk":   composite,
-        "risk_level":       "HIGH" if composite >= 60 else "MEDIUM" if composite >= 30 else "LOW",
+        "risk_level":       ("HIGH" if composite >= rs.high_risk_at else
+                             "MEDIUM" if composite >= rs.medium_risk_at else "LOW"),
         "difficulty":       difficulty,
         "puzzle":           safe_puzzle,
-        "behavioral_logs":  beh_result["logs"],
+        "behavioral_logs":  beh_result["logs"] + shape_logs,
+        "behavioral_features": features,
         "contextual_logs":  ctx_result["logs"],
+        "token":            tokens.advance(tok, tokens.LEVEL_RISK, difficulty=difficulty,
+                                           behavior=tuple(observed.get(k) for k in profiles.METRICS),
+                                           sketches={name: sk.to_list() for name, sk in sketches.items()
+                                                     if sk.count},
+                                           device=devices.fingerprint(ua).hex() if ua else None),
     }
+    riskcache.put(tok.username, tok.session, key, result)
+    return result
 
 
 @app.post("/login/verify-puzzle")
-def verify_puzzle(data: PuzzleVerify):
-    user = db.get_user(data.username)
+async def verify_puzzle(data: PuzzleVerify, request: Request):
+    tok    = _step(data.token, tokens.LEVEL_RISK)
+    if not tokens.attempt(tok.session):
+        raise HTTPException(401, "This login attempt is finished; please log in again")
+    column = f"{tok.difficulty}_puzzle"   # only the puzzle that was actually served
+    user   = await adb.get_fields(tok.username, column, "behavior_profile", "known_devices")
     if not user:
         raise HTTPException(404, "User not found")
-    easy_ans = user.get("easy_puzzle", {}).get("answer", "")
-    hard_ans = user.get("hard_puzzle", {}).get("answer", "")
-    if data.answer in (easy_ans, hard_ans):
-        db.reset_failed(data.username)
+    answer = user.get(column, {}).get("answer", "")
+    if answer and data.answer == answer:
+        if not tokens.spend(tok.session):
+            raise HTTPException(401, "This login attempt is finished; please log in again")
+        ip, ua = client_meta(request)
+        await adb.reset_failed(tok.username)
+        await adb.record_attempt(tok.username, "success", ip, ua)
+        telemetry.discard(tok.session)
+        riskcache.invalidate(tok.username, tok.session)
+        # This device is now trusted, and this login's behaviour is learned into the profile.
+        learned = {}
+        if tok.device:
+            learned["known_devices"] = devices.remember(user.get("known_devices"),
+                                                        bytes.fromhex(tok.device))
+        if tok.behavior is not None:
+            learned["behavior_profile"] = profiles.update(
+                user.get("behavior_profile", {}), dict(zip(profiles.METRICS, tok.behavior)), tok.sketches)
+        await adb.update_many(tok.username, learned)
         return {"success": True, "message": "Authentication complete"}
-    db.increment_failed(data.username)
+    await _login_failed(tok.username, "bad_puzzle", request)
     raise HTTPException(401, "Incorrect answer")
 
 
+@metrics.register
+def _collect_login():
+    served = {d: metrics.PUZZLES.labels(d).totals()[0] for d in ("easy", "hard")}
+    total  = served["easy"] + served["hard"]
+    return [("fractalauth_puzzle_hard_ratio", "gauge", "Share of served puzzles that were hard.",
+             [({}, served["hard"] / total if total else 0.0)]),
+            ("fractalauth_risk_cache_events_total", "counter", "Risk-assessment result cache lookups.",
+             [({"event": k}, v) for k, v in riskcache.stats().items() if k in ("hits", "misses")]),
+            ("fractalauth_ratelimit_rejected_total", "counter", "Login attempts answered 429.",
+             [({"key": k}, v["rejected"]) for k, v in ratelimit.stats().items()]),
+            ("fractalauth_ratelimit_buckets", "gauge", "Token buckets held in memory.",
+             [({"key": k}, v["buckets"]) for k, v in ratelimit.stats().items()])]
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of this worker's counters and histograms."""
+    if not metrics.ENABLED:
+        raise HTTPException(404, "Metrics disabled")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/dev/rules")
+def dev_rules():
+    """Active rule file and per-rule call counts / evaluation time."""
+    return {**rules.current().describe(), "timings": rules.timings()}
+
+
+@app.get("/dev/profiler")
+def dev_profiler():
+    """Sampling profiler settings and the most recent captures."""
+    return tracing.profiler.status()
+
+
+@app.post("/dev/profiler")
+def dev_profiler_configure(data: ProfilerConfig):
+    """Profile one in `every` requests (cpu / memory / both); every=0 turns it off."""
+    try:
+        return tracing.profiler.configure(data.every, data.mode)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+
 @app.delete("/dev/user/{username}")
-def dev_delete_user(username: str):
-    db.delete_user(username)
+async def dev_delete_user(username: str):
+    await adb.delete_user(username)
     return {"deleted": username}
@@ -0,0 +1,85 @@
+"""
+markerkey.py — Fractal key markers stored as salted grid-cell hashes.
+
+Instead of the raw (fx, fy) coordinates, enrollment keeps for every marker
+the hashes of the grid cells its tolerance disc touches. The grid is
+FRACTALAUTH_MARKER_GRID_DIV cells per tolerance (fractal_threshold in the
+rule file), so a marker is stored as ~(2·div+1)² digests:
+
+    {"cell": 0.04, "salt": "<hex>", "cells": [["<hex>", ...], ...]}
+
+Verifying an attempt quantizes each incoming marker to its cell and probes
+one hash per marker — no coordinates are decoded or compared. Every point
+within the tolerance of the enrolled marker lands in a stored cell, so
+nothing the distance check accepts is rejected; the accepted region is the
+disc rounded out to whole cells, which shrinks towards the disc as div grows
+(benchmarks/bench_markers.py measures both error rates).
+
+Digests are keyed BLAKE2b over (marker index, cell) with a per-user salt
+and the optional server pepper FRACTALAUTH_MARKER_PEPPER. The cell space is
+small, so without the pepper a stolen database can still be brute-forced
+cell by cell; set it (and keep it out of the database) for at-rest secrecy.
+
+FRACTALAUTH_MARKER_MODE=hashed enrolls new keys this way and upgrades plain
+ones on their next successful login. The default, `plain`, keeps storing
+coordinates: hashing trades the exact disc for its cell cover, which also
+accepts some points just beyond the tolerance.
+"""
+
+import hashlib
+import math
+import os
+import struct
+
+MARKER_MODE = os.environ.get("FRACTALAUTH_MARKER_MODE", "plain")
+GRID_DIV    = max(1, int(os.environ.get("FRACTALAUTH_MARKER_GRID_DIV", "2")))
+_PEPPER     = os.environ.get("FRACTALAUTH_MARKER_PEPPER", "").encode()[:64]
+
+DIGEST = 8
+_CELL  = struct.Struct("<Iqq")
+
+
+def is_hashed(stored) -> bool:
+    return isinstance(stored, dict) and "cells" in stored
+
+
+def _digest(salt: bytes, i: int, cx: int, cy: int) -> str:
+    return hashlib.blake2b(_CELL.pack(i, cx, cy), digest_size=DIGEST, key=_PEPPER,
+                           salt=salt).hexdigest()
+
+
+def _near(x: float, y: float, size: float, tolerance: float, div: int):
+    """Cells (cx, cy) of side `size` with a point within `tolerance` of (x, y)."""
+    cx, cy = math.floor(x / size), math.floor(y / size)
+    for dx in range(-div - 1, div + 2):
+        lo_x = (cx + dx) * size
+        gap_x = max(lo_x - x, 0.0, x - (lo_x + size))
+        for dy in range(-div - 1, div + 2):
+            lo_y = (cy + dy) * size
+            gap_y = max(lo_y - y, 0.0, y - (lo_y + size))
+            if gap_x * gap_x + gap_y * gap_y <= tolerance * tolerance:
+                yield cx + dx, cy + dy
+
+
+def enroll(markers: list, tolerance: float, div: int = GRID_DIV) -> dict:
+    """Hashed key for `markers` ([{"fx", "fy"}]) accepting anything within `tolerance`."""
+    size, salt = tolerance / div, os.urandom(16)
+    cells = [sorted({_digest(salt, i, cx, cy)
+                     for cx, cy in _near(m["fx"], m["fy"], size, tolerance, div)})
+             for i, m in enumerate(markers)]
+    return {"cell": size, "salt": salt.hex(), "cells": cells}
+
+
+def verify(key: dict, incoming) -> bool:
+    """`incoming` is [(fx, fy)] in enrollment order; every marker is probed, no early exit."""
+    cells = key["cells"]
+    if len(incoming) != len(cells):
+        return False
+    size, salt, ok = key["cell"], bytes.fromhex(key["salt"]), True
+    for i, ((fx, fy), allowed) in enumerate(zip(incoming, cells)):
+        try:
+            probe = _digest(salt, i, math.floor(fx / size), math.floor(fy / size))
+        except (ValueError, OverflowError):        # NaN / inf coordinates
+            probe = ""
+        ok &= probe in allowed     # digests are keyed and salted: timing reveals nothing usable
+    return ok
@@ -0,0 +1,294 @@
+"""
+metrics.py — Counters and histograms for GET /metrics (Prometheus text format).
+
+Recording never takes a lock. Each metric child (one label set) hands every
+thread its own array of cells through a threading.local; a thread only ever
+writes its own cells, and a scrape sums the cells of every thread that has
+written. The one lock per family is taken only the first time a label set
+or a thread shows up. Values are per worker process — scrape each worker,
+or sum them in the query.
+
+    HTTP_REQUESTS   fractalauth_http_requests_total{route,method,status}
+    HTTP_SECONDS    fractalauth_http_request_duration_seconds{route,method}
+    DB_SECONDS      fractalauth_db_op_duration_seconds{op}   get_user / get_fields: as adb.py
+                                                             serves them, cache hits included
+    DB_LOCK_WAIT    fractalauth_db_lock_wait_seconds{shard}
+    RISK_SCORE      fractalauth_risk_score{kind}       behavioral / contextual / composite
+    PUZZLES         fractalauth_puzzles_total{difficulty}
+
+Routes are labelled by their path template (unmatched paths share one label),
+so label cardinality stays fixed. Point-in-time values owned by other modules
+(cache sizes, limiter rejections, …) are added at scrape time by callbacks
+passed to `register`. FRACTALAUTH_METRICS=0 drops the middleware and endpoint.
+"""
+
+import functools
+import inspect
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from time import perf_counter
+
+ENABLED = os.environ.get("FRACTALAUTH_METRICS", "1") != "0"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+WAIT_BUCKETS    = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+SCORE_BUCKETS   = (10, 20, 30, 40, 50, 60, 70, 80, 90, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Child:
+    """Per-thread cells for one label set; `totals` sums them."""
+
+    __slots__ = ("_local", "_all", "_size", "_lock")
+
+    def __init__(self, size: int, lock: threading.Lock):
+        self._local = threading.local()
+        self._all   = []
+        self._size  = size
+        self._lock  = lock
+
+    def _cells(self) -> array:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = self._local.cells = array("d", bytes(8 * self._size))
+            with self._lock:
+                self._all.append(cells)
+            return cells
+
+    def totals(self) -> list[float]:
+        out = [0.0] * self._size
+        for cells in list(self._all):
+            for i, v in enumerate(cells):
+                out[i] += v
+        return out
+
+
+class CounterChild(_Child):
+    __slots__ = ()
+
+    def inc(self, n: float = 1.0):
+        self._cells()[0] += n
+
+
+class HistogramChild(_Child):
+    __slots__ = ("bounds",)
+
+    def __init__(self, bounds, lock):
+        super().__init__(len(bounds) + 3, lock)   # buckets, +Inf, sum, count
+        self.bounds = bounds
+
+    def observe(self, v: float):
+        cells = self._cells()
+        cells[bisect_left(self.bounds, v)] += 1
+        cells[-2] += v
+        cells[-1] += 1
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new())
+        return child
+
+    def _label_str(self, values, extra=()) -> str:
+        pairs = [*zip(self.labelnames, values), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class Counter(_Family):
+    kind = "counter"
+
+    def _new(self):
+        return CounterChild(1, self._lock)
+
+    def inc(self, n: float = 1.0):
+        self.labels().inc(n)
+
+    def _samples(self, values, child):
+        yield f"{self.name}{self._label_str(values)} {_num(child.totals()[0])}"
+
+
+class Histogram(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new(self):
+        return HistogramChild(self.bounds, self._lock)
+
+    def observe(self, v: float):
+        self.labels().observe(v)
+
+    def _samples(self, values, child):
+        t, acc = child.totals(), 0.0
+        for bound, n in zip((*self.bounds, "+Inf"), t):
+            acc += n
+            le = bound if bound == "+Inf" else _num(bound)
+            yield f"{self.name}_bucket{self._label_str(values, [('le', le)])} {_num(acc)}"
+        yield f"{self.name}_sum{self._label_str(values)} {_num(t[-2])}"
+        yield f"{self.name}_count{self._label_str(values)} {_num(t[-1])}"
+
+
+def _escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+_registry: list[_Family] = []
+_collectors = []
+
+
+def register(collect):
+    """Add a scrape-time callback returning [(name, kind, help, [(labels dict, value)])]."""
+    _collectors.append(collect)
+    return collect
+
+
+def render() -> str:
+    lines = []
+    for fam in _registry:
+        lines.extend(fam.render())
+    for collect in _collectors:
+        for name, kind, help, samples in collect():
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                ls = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+                lines.append(f"{name}{{{ls}}} {_num(value)}" if ls else f"{name} {_num(value)}")
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUESTS = Counter("fractalauth_http_requests_total", "HTTP requests by route, method and status.",
+                        ("route", "method", "status"))
+HTTP_SECONDS  = Histogram("fractalauth_http_request_duration_seconds", "HTTP request latency.",
+                          ("route", "method"))
+DB_SECONDS    = Histogram("fractalauth_db_op_duration_seconds", "Storage call latency (db.py; adb.py for get_user / get_fields).", ("op",))
+DB_LOCK_WAIT  = Histogram("fractalauth_db_lock_wait_seconds", "Time spent waiting for a shard's writer lock.",
+                          ("shard",), WAIT_BUCKETS)
+RISK_SCORE    = Histogram("fractalauth_risk_score", "Risk scores assessed at login.", ("kind",), SCORE_BUCKETS)
+PUZZLES       = Counter("fractalauth_puzzles_total", "Puzzles served by difficulty.", ("difficulty",))
+
+
+def timed(family: Histogram, *labels):
+    """Decorator recording the wrapped call's (sync or async) duration in `family.labels(*labels)`."""
+    child = family.labels(*labels)
+
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                t0 = perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    child.observe(perf_counter() - t0)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+class TimedLock:
+    """threading.Lock that records how long each `with` waited to acquire it."""
+
+    __slots__ = ("_lock", "_wait")
+
+    def __init__(self, wait: HistogramChild):
+        self._lock = threading.Lock()
+        self._wait = wait
+
+    def __enter__(self):
+        if self._lock.acquire(False):
+            self._wait.observe(0.0)
+        else:
+            t0 = perf_counter()
+            self._lock.acquire()
+            self._wait.observe(perf_counter() - t0)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+
+_paths = {}
+
+
+def route_template(scope) -> str:
+    """Path template of the route that handled `scope` ("unmatched" if none did)."""
+    global _paths
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if endpoint not in _paths:
+        _paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+    return _paths.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting HTTP requests and timing them per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        t0 = perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route, method = route_template(scope), scope["method"]
+            HTTP_SECONDS.labels(route, method).observe(perf_counter() - t0)
+            HTTP_REQUESTS.labels(route, method, str(status)).inc()
@@ -0,0 +1,85 @@
+"""
+migrate.py — Convert legacy JSON TEXT blob columns to the compact codec format.
+
+Reads keep accepting both formats, so this can run against a live database;
+rows are rewritten in small batches to keep write-lock hold times short.
+
+Usage (from backend/):
+    python migrate.py                 # migrate FRACTALAUTH_DB in place
+    python migrate.py --dry-run       # report what would change
+    python migrate.py --vacuum        # reclaim freed pages afterwards
+"""
+
+import argparse
+import time
+
+import codec
+import db
+from codec import BLOB_FIELDS
+
+
+def migrate_blob_columns(batch_size: int = 500, dry_run: bool = False) -> dict:
+    """Re-encode every TEXT blob column on every shard; returns row/byte counters."""
+    stats = {"rows": 0, "migrated": 0, "bytes_before": 0, "bytes_after": 0}
+    for sh in db.shards():
+        _migrate_shard(sh, batch_size, dry_run, stats)
+    return stats
+
+
+def _migrate_shard(sh, batch_size: int, dry_run: bool, stats: dict):
+    cols = ",".join(BLOB_FIELDS)
+    last = 0
+    while True:
+        with sh.pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT rowid,username,{cols} FROM users WHERE rowid>? ORDER BY rowid LIMIT ?",
+                (last, batch_size),
+            ).fetchall()
+        if not rows:
+            break
+        last = rows[-1]["rowid"]
+        updates = []
+        for row in rows:
+            stats["rows"] += 1
+            if not any(isinstance(row[f], str) for f in BLOB_FIELDS):
+                continue
+            new = []
+            for f in BLOB_FIELDS:
+                old = row[f]
+                enc = codec.encode(f, codec.decode(f, old)) if isinstance(old, str) else old
+                stats["bytes_before"] += len(old.encode()) if isinstance(old, str) else len(old or b"")
+                stats["bytes_after"]  += len(enc or b"")
+                new.append(enc)
+            updates.append((*new, row["username"]))
+        stats["migrated"] += len(updates)
+        if updates and not dry_run:
+            sets = ",".join(f"{f}=?" for f in BLOB_FIELDS)
+            with sh.lock, sh.pool.connection() as conn:
+                conn.executemany(f"UPDATE users SET {sets} WHERE username=?", updates)
+                conn.commit()
+            for u in updates:
+                db._user_cache.invalidate(u[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Migrate user blob columns to the compact format")
+    ap.add_argument("--batch-size", type=int, default=500)
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--vacuum", action="store_true")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    stats = migrate_blob_columns(args.batch_size, args.dry_run)
+    print(f"{db.DB_PATH}: {stats['migrated']}/{stats['rows']} rows "
+          f"{'would be ' if args.dry_run else ''}migrated, blob bytes "
+          f"{stats['bytes_before']:,} -> {stats['bytes_after']:,} "
+          f"in {time.perf_counter() - t0:.2f}s")
+    if args.vacuum and not args.dry_run:
+        for sh in db.shards():
+            with sh.lock, sh.pool.connection() as conn:
+                conn.execute("VACUUM")
+        print("VACUUM complete")
+
+
+if __name__ == "__main__":
+    main()
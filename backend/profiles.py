@@ -0,0 +1,101 @@
+"""
+profiles.py — Incrementally learned behaviour profiles.
+
+Registration stores one snapshot of means. After every successful login the
+observed session is folded into per-metric running statistics:
+
+    n      samples seen
+    mean   Welford running mean      (stored under the metric's usual key,
+    m2     Welford sum of squares     so snapshot readers keep working)
+    ewma   exponentially weighted mean, tracks gradual drift
+
+The raw series behind those means (mouse speeds, pauses, click intervals)
+are also kept as mergeable quantile sketches (sketch.py) under "sketches",
+so the baseline remembers their p10/p50/p90 and not just the average.
+
+Updates are O(1) and the profile stays the same size however many logins
+accumulate. Once a metric has FRACTALAUTH_PROFILE_MIN_SAMPLES samples, scoring
+switches from percentage deviation against the mean to a z-score around the
+EWMA, scaled by the learned standard deviation.
+"""
+
+import math
+import os
+
+from sketch import QuantileSketch
+
+METRICS = ("avg_mouse_speed", "avg_pause_ms", "fractal_time_ms", "click_count", "zoom_count")
+SERIES  = ("mouse_speeds", "pause_durations", "action_intervals")
+
+EWMA_ALPHA  = float(os.environ.get("FRACTALAUTH_PROFILE_ALPHA", "0.2"))
+MIN_SAMPLES = int(os.environ.get("FRACTALAUTH_PROFILE_MIN_SAMPLES", "5"))
+Z_FULL      = 3.0    # a z-score this large counts as 100% risk for the metric
+STD_FLOOR   = 0.05   # std never drops below 5% of the typical value…
+STD_MIN     = {"click_count": 0.5, "zoom_count": 0.5}   # …nor half a click for counts
+
+
+def _stats(profile: dict, key: str):
+    """(n, mean, m2, ewma) for `key`; a bare snapshot value counts as one sample."""
+    st = (profile.get("stats") or {}).get(key)
+    if st is not None:
+        n, m2, ewma = st
+        return int(n), float(profile.get(key, 0)), float(m2), float(ewma)
+    value = profile.get(key)
+    if not value:
+        return 0, 0.0, 0.0, 0.0
+    return 1, float(value), 0.0, float(value)
+
+
+def update(profile: dict, observed: dict, sketches: dict | None = None) -> dict:
+    """Return a new profile with `observed` {metric: value or None} folded in.
+
+    Non-finite values (and ones that would overflow the statistics) are skipped.
+
+    `sketches` ({series: compact sketch}) are merged into the stored ones.
+    """
+    new, stats = dict(profile), dict(profile.get("stats") or {})
+    if sketches:
+        new["sketches"] = merge_sketches(profile.get("sketches") or {}, sketches)
+    for key in METRICS:
+        n, mean, m2, ewma = _stats(profile, key)
+        x = observed.get(key)
+        if x is not None and math.isfinite(x := float(x)):
+            delta  = x - mean
+            mean_x = mean + delta / (n + 1)
+            m2_x   = m2 + delta * (x - mean_x)
+            ewma_x = x if n == 0 else EWMA_ALPHA * x + (1 - EWMA_ALPHA) * ewma
+            # A sample so large that the statistics overflow is skipped like NaN / ±inf:
+            # once stored, an inf or NaN would never leave the profile.
+            if math.isfinite(m2_x) and math.isfinite(mean_x) and math.isfinite(ewma_x):
+                n, mean, m2, ewma = n + 1, mean_x, m2_x, ewma_x
+        new[key] = mean
+        stats[key] = [n, m2, ewma]
+    new["stats"] = stats
+    return new
+
+
+def merge_sketches(stored: dict, incoming: dict) -> dict:
+    merged = dict(stored)
+    for name in SERIES:
+        if incoming.get(name):
+            sk = QuantileSketch.from_list(stored.get(name)).merge(QuantileSketch.from_list(incoming[name]))
+            merged[name] = sk.to_list()
+    return merged
+
+
+def sketch(profile: dict, name: str) -> QuantileSketch:
+    """The learned sketch of series `name` (empty if none was recorded)."""
+    return QuantileSketch.from_list((profile.get("sketches") or {}).get(name))
+
+
+def baseline(profile: dict, key: str) -> tuple[int, float, float]:
+    """(samples, centre, std) to score `key` against; std is 0 until there are 2 samples."""
+    n, mean, m2, ewma = _stats(profile, key)
+    if n < 2:
+        return n, ewma, 0.0
+    std = math.sqrt(m2 / (n - 1))
+    return n, ewma, max(std, STD_FLOOR * abs(ewma), STD_MIN.get(key, 1e-9))
+
+
+def uses_zscore(n: int, std: float) -> bool:
+    return n >= MIN_SAMPLES and std > 0
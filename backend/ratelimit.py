@@ -0,0 +1,110 @@
+"""
+ratelimit.py — Token-bucket throttling of login attempts, per username and per IP.
+
+Both login steps check two buckets before touching the database: one keyed
+by the claimed username (slows guessing against one account) and one keyed
+by the client IP (slows stuffing many accounts from one source). A bucket
+holds up to BURST tokens and refills at PER_MIN tokens a minute; an attempt
+takes one token or is answered 429 with the seconds until the next one.
+
+Buckets are spread over FRACTALAUTH_RATE_SHARDS shards by key hash, each an
+OrderedDict in least-recently-used order behind its own lock, so concurrent
+callers rarely wait on each other and the critical section is a few float
+ops. Memory is bounded two ways on every insert: buckets idle long enough to
+have refilled completely are dropped from the cold end (losslessly — a
+missing bucket *is* a full one), and a shard past its share of
+FRACTALAUTH_RATE_MAX_KEYS evicts its least recently used bucket regardless.
+Counters are per worker process; set BURST to 0 to disable a limiter.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+USER_PER_MIN = float(os.environ.get("FRACTALAUTH_RATE_USER_PER_MIN", "10"))
+USER_BURST   = int(os.environ.get("FRACTALAUTH_RATE_USER_BURST", "10"))
+IP_PER_MIN   = float(os.environ.get("FRACTALAUTH_RATE_IP_PER_MIN", "120"))
+IP_BURST     = int(os.environ.get("FRACTALAUTH_RATE_IP_BURST", "60"))
+SHARDS       = int(os.environ.get("FRACTALAUTH_RATE_SHARDS", "16"))
+MAX_KEYS     = int(os.environ.get("FRACTALAUTH_RATE_MAX_KEYS", "100000"))
+
+_IDLE_SWEEP = 4     # idle buckets dropped per insert at most (keeps the worst case flat)
+
+
+class TokenBucketLimiter:
+    """Sharded token buckets with idle and LRU eviction."""
+
+    def __init__(self, per_min: float, burst: int, shards: int = SHARDS,
+                 max_keys: int = MAX_KEYS):
+        self.rate   = max(per_min, 0.0) / 60.0
+        self.burst  = max(burst, 0)
+        self.idle_s = self.burst / self.rate if self.rate else float("inf")
+        n = max(1, shards)
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(n)]
+        self._cap    = max(1, max_keys // n)
+        self.rejected = self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.burst > 0
+
+    def hit(self, key, now: float | None = None) -> float:
+        """Take one token for `key`: 0.0 if allowed, else seconds until one is available."""
+        if not self.burst:
+            return 0.0
+        if now is None:
+            now = time.monotonic()
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = [float(self.burst), now]
+                self._trim(buckets, now)
+            else:
+                b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+                buckets.move_to_end(key)
+            if b[0] >= 1.0:
+                b[0] -= 1.0
+                return 0.0
+            wait = (1.0 - b[0]) / self.rate if self.rate else float("inf")
+        self.rejected += 1
+        return wait
+
+    def _trim(self, buckets: OrderedDict, now: float):
+        for _ in range(_IDLE_SWEEP):
+            key, b = next(iter(buckets.items()))
+            if now - b[1] < self.idle_s:
+                break
+            del buckets[key]
+        while len(buckets) > self._cap:
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return sum(len(buckets) for buckets, _ in self._shards)
+
+    def stats(self) -> dict:
+        return {"per_min": self.rate * 60, "burst": self.burst, "buckets": len(self),
+                "rejected": self.rejected, "evictions": self.evictions}
+
+
+users = TokenBucketLimiter(USER_PER_MIN, USER_BURST)
+ips   = TokenBucketLimiter(IP_PER_MIN, IP_BURST)
+
+
+def check(scope: str, username: str, ip: str, now: float | None = None) -> float:
+    """Charge one `scope` attempt to `ip` and `username`; seconds to wait, 0.0 if allowed.
+
+    The IP is charged first, so a source that is already throttled doesn't
+    also drain the budget of the accounts it is trying.
+    """
+    wait = ips.hit((scope, ip), now) if ip else 0.0
+    if not wait:
+        wait = users.hit((scope, username), now)
+    return wait
+
+
+def stats() -> dict:
+    return {"user": users.stats(), "ip": ips.stats()}
@@ -0,0 +1,95 @@
+"""
+reshard.py — Rebalance users between shard layouts.
+
+Copies every row from the FROM layout into the TO layout, routing each user
+with db.shard_index. Source files are left untouched, so a failed run can be
+repeated; once it finishes, restart the API with FRACTALAUTH_DB_SHARDS=TO
+and delete the old files. Run it with the API stopped (or drained) so no
+writes land in the old layout mid-copy.
+
+Usage (from backend/):
+    python reshard.py --from 1 --to 4        # split fractalauth.db into 4 shards
+    python reshard.py --from 4 --to 8
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+import db
+
+_INSERT_BATCH = 5000
+
+
+def _copy_table(src, table: str, dst: list, dst_n: int, batch_size: int) -> list[int]:
+    if not src.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                       (table,)).fetchone():
+        return [0] * dst_n
+    cur = src.execute(f"SELECT * FROM {table} ORDER BY rowid")
+    # login_attempts ids are per-file; let the destination assign new ones.
+    cols = [d[0] for d in cur.description if d[0] != "id"]
+    skip_id = len(cols) != len(cur.description)
+    sql = (f"INSERT OR REPLACE INTO {table} ({','.join(cols)}) "
+           f"VALUES ({','.join('?' * len(cols))})")
+    moved = [0] * dst_n
+    while True:
+        chunk = cur.fetchmany(batch_size)
+        if not chunk:
+            break
+        groups = {}
+        for row in chunk:
+            row = row[1:] if skip_id else row
+            groups.setdefault(db.shard_index(row[0], dst_n), []).append(row)
+        for idx, rows in groups.items():
+            sh = dst[idx]
+            with sh.lock, sh.pool.connection() as conn:
+                conn.executemany(sql, rows)
+                conn.commit()
+            moved[idx] += len(rows)
+    return moved
+
+
+def reshard(src_n: int, dst_n: int, batch_size: int = _INSERT_BATCH) -> dict:
+    src_paths = db.shard_paths(src_n)
+    dst_paths = db.shard_paths(dst_n)
+    if set(src_paths) & set(dst_paths):
+        raise SystemExit("source and destination layouts share files")
+    missing = [p for p in src_paths if not os.path.exists(p)]
+    if missing:
+        raise SystemExit(f"missing source shard(s): {', '.join(missing)}")
+
+    db.configure(shards=dst_n)            # creates the destination schema
+    dst = db.shards()
+    for sh in dst:                        # attempt rows have no natural key; start clean
+        with sh.lock, sh.pool.connection() as conn:
+            conn.execute("DELETE FROM login_attempts")
+            conn.commit()
+    moved, attempts = [0] * dst_n, 0
+    t0 = time.perf_counter()
+    for path in src_paths:
+        src = sqlite3.connect(path)
+        moved = [a + b for a, b in zip(moved, _copy_table(src, "users", dst, dst_n, batch_size))]
+        attempts += sum(_copy_table(src, "login_attempts", dst, dst_n, batch_size))
+        src.close()
+    return {"rows": sum(moved), "per_shard": moved, "attempts": attempts,
+            "seconds": time.perf_counter() - t0}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebalance users between shard layouts")
+    ap.add_argument("--from", dest="src", type=int, required=True, help="current shard count")
+    ap.add_argument("--to",   dest="dst", type=int, required=True, help="new shard count")
+    ap.add_argument("--batch-size", type=int, default=_INSERT_BATCH)
+    args = ap.parse_args()
+
+    stats = reshard(args.src, args.dst, args.batch_size)
+    print(f"moved {stats['rows']:,} users and {stats['attempts']:,} login attempts "
+          f"in {stats['seconds']:.2f}s")
+    for path, n in zip(db.shard_paths(args.dst), stats["per_shard"]):
+        print(f"  {path}: {n:,}")
+    print(f"restart the API with FRACTALAUTH_DB_SHARDS={args.dst}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+riskcache.py — Short-lived memo of /login/risk-assessment results per login attempt.
+
+The puzzle page posts the assessment again whenever its session state has no
+result (RETRY, a lost session, a rerun with the level-3 token it stored).
+Recomputing costs two storage reads and can flip the served puzzle between
+easy and hard, so the result is kept per login attempt — keyed by (username,
+step-token session id) and stamped with a digest of the inputs it was computed
+from: the posted behaviour, IP, User-Agent, hour and the number of telemetry
+events streamed so far. A repeat with the same digest gets the stored response
+back untouched; changed inputs are assessed afresh and replace it.
+
+Entries live for FRACTALAUTH_RISK_CACHE_TTL seconds in an LRU of
+FRACTALAUTH_RISK_CACHE_SIZE attempts per worker, and verify-puzzle drops the
+attempt's entry once the login completes.
+"""
+
+import hashlib
+import json
+import os
+
+from cache import LRUCache
+
+CACHE_SIZE = int(os.environ.get("FRACTALAUTH_RISK_CACHE_SIZE", "10000"))
+CACHE_TTL  = float(os.environ.get("FRACTALAUTH_RISK_CACHE_TTL", "300"))
+
+_results = LRUCache(CACHE_SIZE, CACHE_TTL)
+_hits = _misses = 0     # by digest: an entry for the attempt with other inputs is a miss
+
+
+def digest(*inputs) -> bytes:
+    """Stable digest of JSON-able assessment inputs."""
+    raw = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+
+
+def get(username: str, session: str, key: bytes) -> dict | None:
+    global _hits, _misses
+    entry = _results.get((username, session))
+    if entry is not None and entry[0] == key:
+        _hits += 1
+        return entry[1]
+    _misses += 1
+    return None
+
+
+def put(username: str, session: str, key: bytes, result: dict):
+    _results.put((username, session), (key, result))
+
+
+def invalidate(username: str, session: str):
+    _results.invalidate((username, session))
+
+
+def stats() -> dict:
+    return {**_results.stats(), "hits": _hits, "misses": _misses}
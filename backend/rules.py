@@ -0,0 +1,356 @@
+"""
+rules.py — Declarative Level 3/4 risk rules, compiled once, hot-reloaded.
+
+Weights, contextual score bumps, the puzzle/risk-level cuts and the fractal
+matching tolerance live in a JSON rule file (risk_rules.json by default,
+FRACTALAUTH_RULES to override). The file is compiled into a RuleSet of
+plain closures — one per rule, parameters bound at compile time — so a
+request only runs a flat loop over pre-built functions; nothing is looked
+up or interpreted per call.
+
+Contextual rule kinds:
+
+    hour_outside    score when hour < from or hour >= to
+    failures        first tier whose `at` ≤ recent failures
+    ua_changed      score on a User-Agent that is neither the registered one nor
+                    a known device (devices.py); unknown_score if none stored
+    ip_changed      score on a changed IP
+    geo_changed     score when region or ASN differs (geoip.py); addresses
+                    missing from the CIDR table compare their /24 or /48
+    subnet_changed  score when the dotted /24-style prefix differs (legacy)
+
+Every worker checks the file's mtime at most every FRACTALAUTH_RULES_RELOAD_S
+seconds and swaps in a freshly compiled RuleSet with a single reference
+assignment, so in-flight requests finish on the old rules and no worker
+restarts. A file that fails to parse or validate is logged and ignored
+until it changes again; write new rules with an atomic rename.
+
+Each compiled rule counts its calls and time (`timings()`).
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+import devices
+import geoip
+import profiles
+
+log = logging.getLogger(__name__)
+
+RULES_PATH = os.environ.get("FRACTALAUTH_RULES",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "risk_rules.json"))
+RELOAD_S   = float(os.environ.get("FRACTALAUTH_RULES_RELOAD_S", "2"))   # 0 = never reload
+
+INPUTS = ("speed", "pause", "time", "clicks")   # order of behavioral_risk_from's values
+
+
+class RuleError(ValueError):
+    """The rule file is unreadable or does not describe a valid rule set."""
+
+
+class Context(NamedTuple):
+    hour: int
+    failures: int
+    window: str          # failure window, for messages ("15 min")
+    ip: str
+    ua: str
+    stored_ip: str
+    stored_ua: str
+    devices: bytes = b""     # users.known_devices
+
+
+_timings: dict[str, list] = {}     # rule name -> [calls, total ns]; survives reloads
+
+
+def _stat(name: str) -> list:
+    return _timings.setdefault(name, [0, 0])
+
+
+def timings() -> dict:
+    return {name: {"calls": calls, "total_ms": round(ns / 1e6, 3),
+                   "mean_us": round(ns / calls / 1e3, 3) if calls else 0.0}
+            for name, (calls, ns) in _timings.items()}
+
+
+def _field(rule: dict, key: str, kind=(int, float)):
+    value = rule.get(key)
+    if not isinstance(value, kind) or isinstance(value, bool):
+        raise RuleError(f"rule {rule.get('name', '?')!r}: {key!r} missing or invalid")
+    return value
+
+
+# ── Behavioral (Level 3) ─────────────────────────────────────────────────────
+
+def _compile_deviation(rule: dict, warn_above: float, no_baseline: float):
+    key    = _field(rule, "profile_key", str)
+    weight = _field(rule, "weight")
+    label  = rule.get("label", rule["name"])
+
+    def deviation(cur, profile):
+        ref = profile.get(key, 0)
+        n, centre, std = profiles.baseline(profile, key)
+        if profiles.uses_zscore(n, std):
+            z = abs(cur - centre) / std
+            risk = min(100, z / profiles.Z_FULL * 100)
+            return risk * weight, {
+                "level": "WARN" if risk > warn_above else "OK",
+                "msg": f"{label}: z={z:.2f}  (now={cur:.3f} | usual={centre:.3f}±{std:.3f}, n={n})"}
+        if ref and ref > 0:
+            dev = abs(cur - ref) / (ref + 1e-9)
+            risk = min(100, dev * 100)
+            return risk * weight, {
+                "level": "WARN" if risk > warn_above else "OK",
+                "msg": f"{label}: deviation {risk:.1f}%  (now={cur:.3f} | reg={ref:.3f})"}
+        return no_baseline * weight, {"level": "INFO", "msg": f"{label}: no baseline — assuming low risk"}
+
+    return deviation
+
+
+# ── Contextual (Level 4) ─────────────────────────────────────────────────────
+
+def _hour_outside(rule):
+    start, end, score = _field(rule, "from"), _field(rule, "to"), _field(rule, "score")
+
+    def hour_outside(c: Context):
+        if c.hour < start or c.hour >= end:
+            return score, {"level": "WARN", "msg": f"Login at unusual hour: {c.hour:02d}:xx"}
+        return 0, {"level": "OK", "msg": f"Login hour {c.hour:02d}:xx within normal range"}
+    return hour_outside
+
+
+def _failures(rule):
+    tiers = rule.get("tiers")
+    if not isinstance(tiers, list) or not tiers:
+        raise RuleError(f"rule {rule['name']!r}: 'tiers' missing or empty")
+    tiers = sorted(((_field(t, "at"), _field(t, "score"), t.get("level", "WARN")) for t in tiers),
+                   reverse=True)
+    top = tiers[0][0]
+
+    def failures(c: Context):
+        for at, score, level in tiers:
+            if c.failures >= at:
+                msg = (f"{c.failures} failed login attempts in the last {c.window}" if at == top
+                       else f"{c.failures} failed attempt(s) in the last {c.window}")
+                return score, {"level": level, "msg": msg}
+        return 0, {"level": "OK", "msg": f"No failed attempts in the last {c.window}"}
+    return failures
+
+
+def _ua_changed(rule):
+    score, unknown = _field(rule, "score"), rule.get("unknown_score", 0)
+
+    def ua_changed(c: Context):
+        if c.ua and c.ua != c.stored_ua and devices.known(c.devices, c.ua):
+            return 0, {"level": "OK", "msg": f"Known device ({devices.count(c.devices)} on record)"}
+        if c.stored_ua and c.ua and c.stored_ua != c.ua:
+            return score, {"level": "WARN", "msg": "Device/browser fingerprint changed"}
+        if not c.stored_ua:
+            return unknown, {"level": "INFO", "msg": "No prior device fingerprint on record"}
+        return 0, {"level": "OK", "msg": "Device fingerprint consistent"}
+    return ua_changed
+
+
+def _ip_changed(rule):
+    score = _field(rule, "score")
+
+    def ip_changed(c: Context):
+        if c.stored_ip and c.ip and c.stored_ip != c.ip:
+            return score, {"level": "WARN", "msg": f"IP changed: {c.stored_ip} → {c.ip}"}
+        return 0, {"level": "OK", "msg": f"IP address consistent ({c.ip})"}
+    return ip_changed
+
+
+def _subnet_changed(rule):
+    score = _field(rule, "score")
+
+    def subnet_changed(c: Context):
+        if not (c.stored_ip and c.ip):
+            return 0, None
+        if c.stored_ip.rsplit(".", 1)[0] != c.ip.rsplit(".", 1)[0]:
+            return score, {"level": "WARN", "msg": "Geographic region anomaly detected"}
+        return 0, {"level": "OK", "msg": "Geographic region consistent"}
+    return subnet_changed
+
+
+def _geo_changed(rule):
+    score = _field(rule, "score")
+
+    def geo_changed(c: Context):
+        if not (c.stored_ip and c.ip):
+            return 0, None
+        old, new = geoip.lookup(c.stored_ip), geoip.lookup(c.ip)
+        if old is not None and new is not None:
+            if old.region != new.region:
+                return score, {"level": "WARN",
+                               "msg": f"Geographic region anomaly detected ({old.region} → {new.region})"}
+            if old.asn != new.asn:
+                return score, {"level": "WARN", "msg": f"Network changed: {old.asn} → {new.asn}"}
+            return 0, {"level": "OK", "msg": f"Geographic region consistent ({new.region}, {new.asn})"}
+        if geoip.network(c.stored_ip) != geoip.network(c.ip):
+            return score, {"level": "WARN", "msg": "Geographic region anomaly detected"}
+        return 0, {"level": "OK", "msg": "Geographic region consistent"}
+    return geo_changed
+
+
+CONTEXT_KINDS = {"hour_outside": _hour_outside, "failures": _failures, "ua_changed": _ua_changed,
+                 "ip_changed": _ip_changed, "geo_changed": _geo_changed,
+                 "subnet_changed": _subnet_changed}
+
+
+# ── Compiled rule set ────────────────────────────────────────────────────────
+
+class RuleSet:
+    """One compiled rule file. Immutable once built; replaced wholesale on reload."""
+
+    def __init__(self, spec: dict, path: str = "", version: str = "", stamp=None):
+        self.spec, self.path, self.version, self.stamp = spec, path, version, stamp
+        self.loaded_at = time.time()
+        try:
+            beh  = spec["behavioral"]
+            ctx  = spec["contextual"]["rules"]
+            comp = spec["composite"]
+        except (KeyError, TypeError):
+            raise RuleError("rule file needs 'behavioral', 'contextual.rules' and 'composite'") from None
+
+        self.fractal_threshold = _field(spec, "fractal_threshold")
+        self.behavioral_share  = _field(comp, "behavioral_share")
+        self.hard_puzzle_at    = _field(comp, "hard_puzzle_at")
+        self.high_risk_at      = _field(comp, "high_risk_at")
+        self.medium_risk_at    = _field(comp, "medium_risk_at")
+        self.warn_above        = beh.get("warn_above", 40)
+        self.no_baseline_risk  = beh.get("no_baseline_risk", 10)
+
+        names, self.weights, compiled = set(), {}, []
+        for rule in beh.get("rules", []):
+            self._named(rule, names, "behavioral")
+            if rule.get("input") not in INPUTS:
+                raise RuleError(f"rule {rule['name']!r}: input must be one of {INPUTS}")
+            if rule["input"] in self.weights:
+                raise RuleError(f"rule {rule['name']!r}: input {rule['input']!r} scored twice")
+            fn = _compile_deviation(rule, self.warn_above, self.no_baseline_risk)
+            self.weights[rule["input"]] = rule["weight"]
+            compiled.append((INPUTS.index(rule["input"]), fn, _stat(f"behavioral.{rule['name']}")))
+        self._behavioral = tuple(compiled)
+
+        compiled = []
+        for rule in ctx:
+            self._named(rule, names, "contextual")
+            make = CONTEXT_KINDS.get(rule.get("kind"))
+            if make is None:
+                raise RuleError(f"rule {rule['name']!r}: unknown kind {rule.get('kind')!r}")
+            compiled.append((make(rule), _stat(f"contextual.{rule['name']}")))
+        self._contextual = tuple(compiled)
+        self.contextual_rules = tuple(ctx)
+
+    @staticmethod
+    def _named(rule, names: set, section: str):
+        if not isinstance(rule, dict) or not isinstance(rule.get("name"), str):
+            raise RuleError(f"every {section} rule needs a 'name'")
+        if rule["name"] in names:
+            raise RuleError(f"duplicate rule name {rule['name']!r}")
+        names.add(rule["name"])
+
+    def behavioral(self, profile: dict, values: tuple) -> dict:
+        """Level 3 over `values` ordered as INPUTS → {"risk", "logs"}."""
+        clock, total, logs = time.perf_counter_ns, 0.0, []
+        for idx, fn, stat in self._behavioral:
+            t0 = clock()
+            score, entry = fn(values[idx], profile)
+            stat[1] += clock() - t0
+            stat[0] += 1
+            total += score
+            logs.append(entry)
+        return {"risk": min(100, round(total)), "logs": logs}
+
+    def contextual(self, ctx: Context) -> dict:
+        clock, total, logs = time.perf_counter_ns, 0, []
+        for fn, stat in self._contextual:
+            t0 = clock()
+            score, entry = fn(ctx)
+            stat[1] += clock() - t0
+            stat[0] += 1
+            total += score
+            if entry is not None:
+                logs.append(entry)
+        return {"risk": min(100, round(total)), "logs": logs}
+
+    def composite(self, behavioral: int, contextual: int) -> int:
+        share = self.behavioral_share
+        return round(behavioral * share + contextual * (1 - share))
+
+    def describe(self) -> dict:
+        return {"path": self.path, "version": self.version, "loaded_at": self.loaded_at}
+
+
+# ── Loading and hot reload ───────────────────────────────────────────────────
+
+def _file_stamp(path: str):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def load(path: str | None = None) -> RuleSet:
+    """Read and compile a rule file; raises RuleError and leaves the active rules alone."""
+    path = path or RULES_PATH
+    try:
+        stamp = _file_stamp(path)
+        with open(path, "rb") as fh:
+            raw = fh.read()
+        spec = json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise RuleError(f"{path}: {e}") from None
+    if not isinstance(spec, dict):
+        raise RuleError(f"{path}: top level must be an object")
+    return RuleSet(spec, path, hashlib.sha256(raw).hexdigest()[:12], stamp)
+
+
+_active: RuleSet | None = None
+_lock = threading.Lock()
+_next_check = 0.0
+_rejected = None          # stamp of the last file that failed to compile
+
+
+def reload(path: str | None = None) -> RuleSet:
+    """Compile `path` (default: the configured file) and make it the active rule set."""
+    global _active, _rejected
+    rs = load(path)
+    _active, _rejected = rs, None
+    log.info("risk rules %s loaded from %s", rs.version, rs.path)
+    return rs
+
+
+def _check_for_changes():
+    global _next_check, _rejected
+    if not _lock.acquire(blocking=False):
+        return                                  # another thread is already checking
+    try:
+        _next_check = time.monotonic() + RELOAD_S
+        try:
+            stamp = _file_stamp(_active.path)
+        except OSError:
+            return
+        if stamp in (_active.stamp, _rejected):
+            return
+        try:
+            reload(_active.path)
+        except RuleError as e:
+            _rejected = stamp
+            log.error("keeping risk rules %s: %s", _active.version, e)
+    finally:
+        _lock.release()
+
+
+def current() -> RuleSet:
+    """The active rule set, picking up file changes every RELOAD_S seconds."""
+    if _active is None:
+        with _lock:
+            if _active is None:
+                reload()
+    elif RELOAD_S > 0 and time.monotonic() >= _next_check:
+        _check_for_changes()
+    return _active
@@ -0,0 +1,126 @@
+"""
+sketch.py — Fixed-memory, mergeable quantile sketch for behaviour series.
+
+Means of mouse speeds, pauses and click intervals are dragged around by
+outliers (the page's 500 ms pause poller reports one long pause as a run of
+growing gaps). `QuantileSketch` keeps the shape of the distribution instead,
+in the style of DDSketch: values fall into logarithmic buckets
+γ^(i-1) < x ≤ γ^i with γ = (1+α)/(1−α), so any quantile comes back within
+relative error α. At most MAX_BINS buckets are kept — past that the lowest
+ones are folded together, trading accuracy only in the bottom tail — and two
+sketches merge by adding bucket counts, so per-login sketches can be summed
+into a per-user baseline that never grows.
+
+Compact form (what profiles and tokens store): [zero_count, offset, *counts].
+
+NaN and ±inf are ignored; finite values too large for the top bucket share
+it, so every reported quantile stays a finite float.
+"""
+
+import math
+import sys
+
+ALPHA     = 0.05       # relative accuracy of every reported quantile
+MAX_BINS  = 64
+MIN_VALUE = 1e-6       # values at or below this land in the zero bucket
+QUANTILES = (0.1, 0.5, 0.9)
+
+_GAMMA     = (1 + ALPHA) / (1 - ALPHA)
+_LOG_GAMMA = math.log(_GAMMA)
+# Highest bucket whose reported value 2·γ^i/(γ+1) is still a finite float.
+_MAX_INDEX = math.floor((math.log(sys.float_info.max) - math.log(2)) / _LOG_GAMMA) - 1
+
+
+def _value(i: int) -> float:
+    return 2 * _GAMMA ** min(i, _MAX_INDEX) / (_GAMMA + 1)
+
+
+class QuantileSketch:
+    __slots__ = ("zero", "offset", "counts", "count")
+
+    def __init__(self):
+        self.zero   = 0
+        self.offset = 0        # bucket index of counts[0]
+        self.counts = []
+        self.count  = 0
+
+    def add(self, x: float):
+        if not math.isfinite(x):
+            return
+        self.count += 1
+        if x <= MIN_VALUE:
+            self.zero += 1
+            return
+        i = min(math.ceil(math.log(x) / _LOG_GAMMA), _MAX_INDEX)
+        self._extend(i, i)
+        self.counts[i - self.offset] += 1
+        self._collapse()
+
+    def extend(self, values) -> "QuantileSketch":
+        for x in values:
+            self.add(x)
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Fold `other` into this sketch (in place) and return it."""
+        if other.counts:
+            self._extend(other.offset, other.offset + len(other.counts) - 1)
+            base = other.offset - self.offset
+            for j, c in enumerate(other.counts):
+                self.counts[base + j] += c
+        self.zero  += other.zero
+        self.count += other.count
+        self._collapse()
+        return self
+
+    def _extend(self, lo: int, hi: int):
+        if not self.counts:
+            self.offset, self.counts = lo, [0] * (hi - lo + 1)
+            return
+        if lo < self.offset:
+            self.counts[:0] = [0] * (self.offset - lo)
+            self.offset = lo
+        top = self.offset + len(self.counts) - 1
+        if hi > top:
+            self.counts.extend([0] * (hi - top))
+
+    def _collapse(self):
+        extra = len(self.counts) - MAX_BINS
+        if extra > 0:
+            self.counts[:extra + 1] = [sum(self.counts[:extra + 1])]
+            self.offset += extra
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile `q` in [0, 1]; None for an empty sketch."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0.0
+        for j, c in enumerate(self.counts):
+            seen += c
+            if rank < seen:
+                return _value(self.offset + j)
+        return _value(self.offset + len(self.counts) - 1)
+
+    def features(self) -> dict | None:
+        """{"p10", "p50", "p90"} rounded for display, or None if nothing was added."""
+        if not self.count:
+            return None
+        return {f"p{round(q * 100)}": round(self.quantile(q), 4) for q in QUANTILES}
+
+    def to_list(self) -> list:
+        return [self.zero, self.offset, *self.counts]
+
+    @classmethod
+    def from_list(cls, data) -> "QuantileSketch":
+        sk = cls()
+        if data:
+            sk.zero, sk.offset, sk.counts = int(data[0]), int(data[1]), [int(c) for c in data[2:]]
+            sk.count = sk.zero + sum(sk.counts)
+            sk._collapse()
+        return sk
+
+    def __repr__(self):
+        return f"QuantileSketch(count={self.count}, bins={len(self.counts)})"
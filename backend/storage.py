@@ -0,0 +1,207 @@
+"""
+storage.py — Pluggable user storage backends.
+
+`Storage` is the contract the API depends on. Two implementations ship:
+
+    sqlite   db.py (pool, cache, write-behind, shards) — the default
+    memory   process-local dicts; for latency-critical single-worker
+             deployments and tests. Nothing survives a restart.
+
+Select with FRACTALAUTH_STORAGE=sqlite|memory. Records returned by
+get_user are read-only mappings; all changes go through the update helpers.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping
+from typing import Protocol, runtime_checkable
+
+from codec import BLOB_FIELDS, UserRecord
+from hashing import hash_password
+
+STORAGE_BACKEND = os.environ.get("FRACTALAUTH_STORAGE", "sqlite")
+ATTEMPT_RETENTION_S = float(os.environ.get("FRACTALAUTH_ATTEMPT_RETENTION_S", str(7 * 86400)))
+
+
+@runtime_checkable
+class Storage(Protocol):
+    name: str
+    # False when every call is cheap enough to run directly on the event loop.
+    blocking: bool
+
+    def user_exists(self, username: str) -> bool: ...
+    def create_user(self, username: str, email: str, password: str,
+                    ip: str = "", ua: str = "", password_hash: str | None = None): ...
+    def get_user(self, username: str) -> Mapping | None: ...
+    def cached_user(self, username: str) -> Mapping | None: ...
+    def load_user(self, username: str) -> Mapping | None: ...
+    def get_fields(self, username: str, fields) -> Mapping | None: ...
+    def update_field(self, username: str, field: str, value): ...
+    def update_many(self, username: str, fields: dict): ...
+    def increment_failed(self, username: str): ...
+    def reset_failed(self, username: str): ...
+    def delete_user(self, username: str): ...
+    def record_attempt(self, username: str, outcome: str, ip: str = "", ua: str = "",
+                       ts: float | None = None): ...
+    def count_failures(self, username: str, window_s: float, now: float | None = None) -> int: ...
+    def prune_attempts(self, older_than_s: float | None = None) -> int: ...
+    def flush(self) -> bool: ...
+    def shutdown(self): ...
+
+
+class SQLiteStorage:
+    """Adapter over the db module; importing it opens the configured database."""
+
+    name     = "sqlite"
+    blocking = True
+
+    def __init__(self):
+        import db
+        self.user_exists      = db.user_exists
+        self.create_user      = db.create_user
+        self.get_user         = db.get_user
+        self.cached_user      = db.cached_user
+        self.load_user        = db.load_user
+        self.get_fields       = db.get_fields
+        self.update_field     = db.update_field
+        self.update_many      = db.update_many
+        self.increment_failed = db.increment_failed
+        self.reset_failed     = db.reset_failed
+        self.delete_user      = db.delete_user
+        self.record_attempt   = db.record_attempt
+        self.count_failures   = db.count_failures
+        self.prune_attempts   = db.prune_attempts
+        self.flush            = db.flush_writes
+        self.shutdown         = db.shutdown
+
+
+class MemoryStorage:
+    """Dict-backed store. Records are immutable snapshots replaced on write."""
+
+    name     = "memory"
+    blocking = False
+
+    _DEFAULTS = {
+        "registered_ip": "", "registered_ua": "", "registered_at": 0.0,
+        "failed_attempts": 0, "fractal_type": "mandelbrot", "is_complete": 0,
+        "known_devices": b"",
+    }
+
+    # Per-user attempt history is capped; the newest entries win.
+    ATTEMPTS_PER_USER = 1000
+
+    def __init__(self):
+        self._users    = {}
+        self._attempts = {}     # username -> deque[(ts, outcome, ip, ua)]
+        self._lock     = threading.Lock()
+
+    def user_exists(self, username: str) -> bool:
+        return username in self._users
+
+    def create_user(self, username: str, email: str, password: str, ip: str = "", ua: str = "",
+                    password_hash: str | None = None):
+        if password_hash is None:
+            password_hash = hash_password(password)
+        raw = {"username": username, "email": email, "password_hash": password_hash,
+               **self._DEFAULTS, "registered_ip": ip, "registered_ua": ua,
+               "registered_at": time.time()}
+        raw.update({f: None for f in BLOB_FIELDS})
+        rec = UserRecord(raw, {f: [] if f == "fractal_markers" else {} for f in BLOB_FIELDS})
+        with self._lock:
+            if username in self._users:
+                raise ValueError(f"user {username!r} already exists")
+            self._users[username] = rec
+
+    def get_user(self, username: str):
+        return self._users.get(username)
+
+    cached_user = load_user = get_user
+
+    def get_fields(self, username: str, fields):
+        return self._users.get(username)
+
+    def _patch(self, username: str, fn):
+        with self._lock:
+            rec = self._users.get(username)
+            if rec is not None:
+                self._users[username] = fn(rec)
+
+    def update_field(self, username: str, field: str, value):
+        self._patch(username, lambda rec: rec.replace({field: value}))
+
+    def update_many(self, username: str, fields: dict):
+        if fields:
+            self._patch(username, lambda rec: rec.replace(dict(fields)))
+
+    def increment_failed(self, username: str):
+        self._patch(username, lambda rec: rec.replace({"failed_attempts": rec["failed_attempts"] + 1}))
+
+    def reset_failed(self, username: str):
+        self._patch(username, lambda rec: rec.replace({"failed_attempts": 0}))
+
+    def delete_user(self, username: str):
+        with self._lock:
+            self._users.pop(username, None)
+            self._attempts.pop(username, None)
+
+    def record_attempt(self, username: str, outcome: str, ip: str = "", ua: str = "",
+                       ts: float | None = None):
+        with self._lock:
+            log = self._attempts.get(username)
+            if log is None:
+                log = self._attempts[username] = deque(maxlen=self.ATTEMPTS_PER_USER)
+            log.append((ts or time.time(), outcome, ip or "", ua or ""))
+
+    def count_failures(self, username: str, window_s: float, now: float | None = None) -> int:
+        since = (now or time.time()) - window_s
+        n = 0
+        with self._lock:
+            for ts, outcome, _, _ in reversed(self._attempts.get(username, ())):
+                if ts < since or outcome == "success":
+                    break
+                n += 1
+        return n
+
+    def prune_attempts(self, older_than_s: float | None = None) -> int:
+        cutoff = time.time() - (ATTEMPT_RETENTION_S if older_than_s is None else older_than_s)
+        n = 0
+        with self._lock:
+            for username in list(self._attempts):
+                log = self._attempts[username]
+                while log and log[0][0] < cutoff:
+                    log.popleft()
+                    n += 1
+                if not log:
+                    del self._attempts[username]
+        return n
+
+    def flush(self) -> bool:
+        return True
+
+    def shutdown(self):
+        pass
+
+
+BACKENDS = {"sqlite": SQLiteStorage, "memory": MemoryStorage}
+
+_store: Storage | None = None
+
+
+def get_storage() -> Storage:
+    """The process-wide store selected by FRACTALAUTH_STORAGE (created on first use)."""
+    global _store
+    if _store is None:
+        try:
+            _store = BACKENDS[STORAGE_BACKEND]()
+        except KeyError:
+            raise RuntimeError(f"unknown FRACTALAUTH_STORAGE={STORAGE_BACKEND!r}; "
+                               f"choose from {', '.join(BACKENDS)}") from None
+    return _store
+
+
+def set_storage(store: Storage):
+    """Swap the process-wide store (benchmarks, embedding)."""
+    global _store
+    _store = store
@@ -0,0 +1,167 @@
+"""
+telemetry.py — Streamed behavioral telemetry for a login attempt.
+
+The fractal page streams small events while the user navigates instead of
+posting whole sample arrays at the end. Each event is one JSON object;
+several may be sent at once separated by newlines (a WebSocket frame or a
+chunk of an NDJSON POST body):
+
+    {"k": "move",   "v": 0.31}     mouse speed sample (px/ms)
+    {"k": "pause",  "v": 800}      inactivity gap (ms)
+    {"k": "click",  "v": 950}      click; v = ms since the previous click (optional)
+    {"k": "zoom"}
+    {"k": "marker", "v": 6100}     marker placed; v = ms since the page opened
+    {"k": "reset"}                 markers cleared — start over
+
+Per attempt the server keeps only running counts and sums plus a
+fixed-size quantile sketch per series (sketch.py), so memory is O(1)
+whatever the session length. Sessions are keyed by the step token's
+session id and live in process memory (use sticky sessions with several
+workers); they expire with the token.
+"""
+
+import json
+import math
+import os
+import time
+
+from cache import LRUCache
+from sketch import QuantileSketch
+
+MAX_SESSIONS = int(os.environ.get("FRACTALAUTH_TELEMETRY_SESSIONS", "10000"))
+SESSION_TTL  = float(os.environ.get("FRACTALAUTH_TOKEN_TTL", "600"))
+MAX_LINE     = 4096   # bytes; longer lines are dropped rather than buffered
+
+
+class RunningMean:
+    __slots__ = ("n", "total")
+
+    def __init__(self):
+        self.n, self.total = 0, 0.0
+
+    def add(self, x: float):
+        self.n += 1
+        self.total += x
+
+    def mean(self, default: float) -> float:
+        return self.total / self.n if self.n else default
+
+
+class Session:
+    """Running aggregates for one login attempt."""
+
+    __slots__ = ("speed", "pause", "interval", "sketches", "clicks", "zooms", "markers",
+                 "fractal_time_ms", "started", "events", "ready")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.events  = 0
+        self.ready   = None          # (events, behavioral result) precomputed at marker 3
+        self._clear()
+
+    def _clear(self):
+        self.speed, self.pause, self.interval = RunningMean(), RunningMean(), RunningMean()
+        self.sketches = {"mouse_speeds": QuantileSketch(), "pause_durations": QuantileSketch(),
+                         "action_intervals": QuantileSketch()}
+        self.clicks = self.zooms = self.markers = 0
+        self.fractal_time_ms = None
+
+    def apply(self, ev: dict) -> bool:
+        """Fold one event in; False if it isn't understood (or carries NaN / ±inf)."""
+        kind, v = ev.get("k"), ev.get("v")
+        if isinstance(v, (int, float)):
+            # json.loads accepts NaN, Infinity, 1e400 and ints past the float range
+            try:
+                v = float(v)
+            except OverflowError:
+                return False
+            if not math.isfinite(v):
+                return False
+        if kind == "move" and isinstance(v, float):
+            self.speed.add(v)
+            self.sketches["mouse_speeds"].add(v)
+        elif kind == "pause" and isinstance(v, float):
+            self.pause.add(v)
+            self.sketches["pause_durations"].add(v)
+        elif kind == "click":
+            self.clicks += 1
+            if isinstance(v, float):
+                self.interval.add(v)
+                self.sketches["action_intervals"].add(v)
+        elif kind == "zoom":
+            self.zooms += 1
+        elif kind == "marker":
+            self.markers += 1
+            if isinstance(v, float):
+                self.fractal_time_ms = v
+        elif kind == "reset":
+            self._clear()
+            self.started = time.monotonic()
+        else:
+            return False
+        self.events += 1
+        return True
+
+    def summary(self) -> tuple[float, float, float, int]:
+        """(avg mouse speed, avg pause ms, fractal time ms, click count) as behavioral_risk uses."""
+        elapsed = self.fractal_time_ms
+        if elapsed is None:
+            elapsed = (time.monotonic() - self.started) * 1000
+        return self.speed.mean(0), self.pause.mean(1000), elapsed, self.clicks
+
+    def observed(self) -> dict:
+        """This session's values per profile metric (None where nothing was sampled)."""
+        speed, pause, elapsed, clicks = self.summary()
+        return {"avg_mouse_speed": speed if self.speed.n else None,
+                "avg_pause_ms":    pause if self.pause.n else None,
+                "fractal_time_ms": elapsed, "click_count": clicks, "zoom_count": self.zooms}
+
+    def stats(self) -> dict:
+        return {"events": self.events, "moves": self.speed.n, "pauses": self.pause.n,
+                "clicks": self.clicks, "zooms": self.zooms, "markers": self.markers}
+
+
+_sessions = LRUCache(MAX_SESSIONS, SESSION_TTL)
+
+
+def session(sid: str, create: bool = False) -> Session | None:
+    s = _sessions.get(sid)
+    if s is None and create:
+        s = Session()
+        _sessions.put(sid, s)
+    return s
+
+
+def discard(sid: str):
+    _sessions.invalidate(sid)
+
+
+def feed(s: Session, chunk: str) -> int:
+    """Apply every newline-separated event in `chunk`; returns how many were accepted."""
+    accepted = 0
+    for line in chunk.splitlines():
+        if not line.strip() or len(line) > MAX_LINE:
+            continue
+        try:
+            ev = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(ev, dict) and s.apply(ev):
+            accepted += 1
+    return accepted
+
+
+async def feed_stream(s: Session, chunks) -> int:
+    """Apply an async byte stream of NDJSON, holding at most one partial line."""
+    accepted, buf = 0, b""
+    async for chunk in chunks:
+        buf += chunk
+        if b"\n" not in buf:
+            if len(buf) > MAX_LINE:
+                buf = b""
+            continue
+        complete, _, buf = buf.rpartition(b"\n")
+        accepted += feed(s, complete.decode("utf-8", "replace"))
+    if buf:
+        accepted += feed(s, buf.decode("utf-8", "replace"))
+    return accepted
@@ -0,0 +1,162 @@
+"""
+tokens.py — Signed, expiring login step tokens.
+
+Each login step that passes hands the client a token recording how far it
+got; the next step accepts only that token instead of a bare username:
+
+    level 1  password verified          → carries the fractal type
+    level 2  fractal markers verified
+    level 3  risk assessed               → carries the chosen puzzle difficulty,
+                                           the observed behaviour (metrics and
+                                           series sketches) and device fingerprint,
+                                           learned once the puzzle passes
+
+Every token of one login attempt also carries the same random session id,
+which keys server-side per-attempt state such as streamed telemetry.
+
+Format: base64url(compact JSON claims) "." base64url(HMAC-SHA256). Tokens
+are stateless, so checking one costs a hash and no database read.
+
+The puzzle step is the exception: a login attempt gets FRACTALAUTH_PUZZLE_ATTEMPTS
+guesses and one success. Each worker remembers, for TOKEN_TTL, how many
+guesses a session id has used and whether it already completed, so a
+captured level-3 token cannot be replayed to log in (and be learned from)
+again. Like the rate limiter this is per worker process.
+
+Set FRACTALAUTH_TOKEN_SECRET when running more than one worker — without it
+every process signs with its own random key and rejects the others' tokens.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import NamedTuple
+
+from cache import LRUCache
+
+log = logging.getLogger(__name__)
+
+TOKEN_TTL = float(os.environ.get("FRACTALAUTH_TOKEN_TTL", "600"))
+PUZZLE_ATTEMPTS = max(1, int(os.environ.get("FRACTALAUTH_PUZZLE_ATTEMPTS", "3")))
+SESSION_CACHE_SIZE = int(os.environ.get("FRACTALAUTH_SESSION_CACHE_SIZE", "100000"))
+
+_secret = os.environ.get("FRACTALAUTH_TOKEN_SECRET", "").encode()
+if not _secret:
+    log.warning("FRACTALAUTH_TOKEN_SECRET not set; using a per-process random key")
+    _secret = os.urandom(32)
+
+LEVEL_PASSWORD = 1
+LEVEL_FRACTAL  = 2
+LEVEL_RISK     = 3
+
+
+class TokenError(ValueError):
+    """Missing, tampered, expired or not-far-enough token."""
+
+
+class StepToken(NamedTuple):
+    username: str
+    level: int
+    fractal_type: str
+    difficulty: str | None
+    expires: float
+    session: str
+    behavior: tuple | None = None     # per profiles.METRICS, None = not sampled
+    sketches: dict | None = None      # {series: compact QuantileSketch}
+    device: str | None = None         # hex devices.fingerprint of the assessed User-Agent
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(body: str) -> str:
+    return _b64(hmac.new(_secret, body.encode(), hashlib.sha256).digest())
+
+
+def issue(username: str, level: int, fractal_type: str, difficulty: str | None = None,
+          ttl: float | None = None, session: str | None = None,
+          behavior: tuple | None = None, sketches: dict | None = None,
+          device: str | None = None) -> str:
+    """Sign a fresh token; a new session id is drawn unless `session` is given."""
+    claims = {"u": username, "l": level, "f": fractal_type,
+              "exp": round(time.time() + (TOKEN_TTL if ttl is None else ttl)),
+              "s": session or secrets.token_urlsafe(9)}
+    if difficulty is not None:
+        claims["d"] = difficulty
+    if behavior is not None:
+        claims["b"] = list(behavior)
+    if sketches:
+        claims["q"] = sketches
+    if device:
+        claims["v"] = device
+    body = _b64(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{body}.{_sign(body)}"
+
+
+def advance(tok: StepToken, level: int, **changes) -> str:
+    """Re-issue `tok` at `level`, keeping its claims unless overridden."""
+    return issue(tok.username, level, changes.get("fractal_type", tok.fractal_type),
+                 changes.get("difficulty", tok.difficulty), session=tok.session,
+                 behavior=changes.get("behavior", tok.behavior),
+                 sketches=changes.get("sketches", tok.sketches),
+                 device=changes.get("device", tok.device))
+
+
+def verify(token: str, min_level: int) -> StepToken:
+    """Check signature, expiry and that the holder completed `min_level`."""
+    try:
+        body, sig = token.split(".")
+    except (AttributeError, ValueError):
+        raise TokenError("malformed token") from None
+    if not hmac.compare_digest(_sign(body), sig):
+        raise TokenError("bad token signature")
+    try:
+        claims = json.loads(_unb64(body))
+        tok = StepToken(claims["u"], int(claims["l"]), claims["f"], claims.get("d"),
+                        float(claims["exp"]), claims["s"],
+                        tuple(claims["b"]) if "b" in claims else None, claims.get("q"),
+                        claims.get("v"))
+    except (ValueError, KeyError, TypeError):
+        raise TokenError("malformed token") from None
+    if tok.expires < time.time():
+        raise TokenError("login session expired")
+    if tok.level < min_level:
+        raise TokenError("previous login step not completed")
+    return tok
+
+
+# ── Puzzle attempts per session ─────────────────────────────────────────────
+
+_SPENT = -1
+_sessions = LRUCache(SESSION_CACHE_SIZE, TOKEN_TTL)   # session id -> guesses used, or _SPENT
+_sessions_lock = threading.Lock()
+
+
+def attempt(session: str) -> bool:
+    """Count one puzzle guess for `session`; False once it completed or ran out of guesses."""
+    with _sessions_lock:
+        used = _sessions.get(session, 0)
+        if used == _SPENT or used >= PUZZLE_ATTEMPTS:
+            return False
+        _sessions.put(session, used + 1)
+        return True
+
+
+def spend(session: str) -> bool:
+    """Mark `session` as logged in; False if it already was (a concurrent replay)."""
+    with _sessions_lock:
+        if _sessions.get(session) == _SPENT:
+            return False
+        _sessions.put(session, _SPENT)
+        return True
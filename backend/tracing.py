@@ -0,0 +1,274 @@
+"""
+tracing.py — Opt-in request spans and an admin-toggled sampling profiler.
+
+Spans. With FRACTALAUTH_TRACE_FILE set, one in FRACTALAUTH_TRACE_EVERY HTTP
+requests gets a root span, and every `span(...)` / `@traced` function called
+while it is active (on the event loop or, via adb.run, on a DB thread) adds a
+child. When the request ends its spans are appended to the file as NDJSON,
+one line per span, by a background writer thread:
+
+    {"trace": "9f…", "span": 7, "parent": 3, "name": "db.get_fields",
+     "start": 1718000000.123, "ms": 0.41}
+
+Tracing off, `@traced` returns the function unchanged and `span()` returns a
+shared no-op, so the only cost left is the middleware's flag check.
+
+Profiler. `profiler.configure(every=N, mode=...)` (POST /dev/profiler) runs
+one in N requests under cProfile ("cpu"), tracemalloc ("memory") or both,
+and writes `<ms>-<route>-<pid>.prof` (pstats) / `.mem.txt` (top allocation
+growth) into FRACTALAUTH_PROFILE_DIR; the files of all but the latest 50
+captures are deleted. cProfile sees only the event loop thread — async
+routes and whatever else the loop runs meanwhile — and one request is
+profiled at a time. Settings are per worker process.
+"""
+
+import cProfile
+import functools
+import inspect
+import itertools
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextvars import ContextVar
+from time import perf_counter
+
+import metrics
+
+TRACE_FILE  = os.environ.get("FRACTALAUTH_TRACE_FILE", "")
+TRACE_EVERY = max(1, int(os.environ.get("FRACTALAUTH_TRACE_EVERY", "1")))
+PROFILE_DIR = os.environ.get("FRACTALAUTH_PROFILE_DIR",
+                             os.path.join(tempfile.gettempdir(), "fractalauth-profiles"))
+
+ENABLED = bool(TRACE_FILE)
+MODES   = ("cpu", "memory", "both")
+
+# (trace, current span id) of the request being traced, if any.
+_current: ContextVar = ContextVar("fractalauth_trace", default=None)
+_span_ids = itertools.count(1)
+
+
+class _Trace:
+    __slots__ = ("id", "spans")
+
+    def __init__(self):
+        self.id    = os.urandom(8).hex()
+        self.spans = []
+
+
+class _Span:
+    __slots__ = ("name", "attrs", "trace", "id", "parent", "start", "t0", "_token")
+
+    def __init__(self, name: str, attrs: dict, trace: _Trace, parent: int | None):
+        self.name, self.attrs, self.trace, self.parent = name, attrs, trace, parent
+        self.id = next(_span_ids)
+
+    def __enter__(self):
+        self._token = _current.set((self.trace, self.id))
+        self.start, self.t0 = time.time(), perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (perf_counter() - self.t0) * 1000
+        _current.reset(self._token)
+        rec = {"trace": self.trace.id, "span": self.id, "parent": self.parent, "name": self.name,
+               "start": round(self.start, 6), "ms": round(ms, 3)}
+        if exc_type is not None:
+            rec["error"] = exc_type.__name__
+        if self.attrs:
+            rec.update(self.attrs)
+        self.trace.spans.append(rec)     # list.append is atomic; DB threads add here too
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NOOP = _NoSpan()
+
+
+def span(name: str, **attrs):
+    """Child span of the active trace; a no-op outside one or with tracing off."""
+    if not ENABLED:
+        return _NOOP
+    cur = _current.get()
+    if cur is None:
+        return _NOOP
+    return _Span(name, attrs, cur[0], cur[1])
+
+
+def traced(name: str):
+    """Decorator: run the function (sync or async) inside `span(name)`."""
+    def deco(fn):
+        if not ENABLED:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+# ── Trace file writer ───────────────────────────────────────────────────────
+
+_queue   = queue.SimpleQueue()
+_writer  = None
+_started = threading.Lock()
+
+
+def _drain():
+    with open(TRACE_FILE, "a", encoding="utf-8") as f:
+        while True:
+            spans = _queue.get()
+            if spans is None:
+                return
+            f.write("".join(json.dumps(s, separators=(",", ":")) + "\n" for s in spans))
+            f.flush()
+
+
+def _submit(spans: list):
+    global _writer
+    if _writer is None:
+        with _started:
+            if _writer is None:
+                _writer = threading.Thread(target=_drain, name="fractalauth-trace", daemon=True)
+                _writer.start()
+    _queue.put(spans)
+
+
+def shutdown():
+    """Write out queued spans and stop the writer thread."""
+    global _writer
+    if _writer is not None:
+        _queue.put(None)
+        _writer.join(timeout=5)
+        _writer = None
+
+
+# ── Sampling profiler ───────────────────────────────────────────────────────
+
+class Profiler:
+    """Profiles one in `every` requests; every=0 (the default) turns it off."""
+
+    def __init__(self, keep: int = 50):
+        self.every    = 0
+        self.mode     = "cpu"
+        self.captured = deque(maxlen=keep)
+        self._seen    = 0
+        self._busy    = False
+
+    def configure(self, every: int, mode: str = "cpu") -> dict:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if every < 0:
+            raise ValueError("every must be >= 0")
+        self.every, self.mode, self._seen = every, mode, 0
+        return self.status()
+
+    def status(self) -> dict:
+        return {"every": self.every, "mode": self.mode, "dir": PROFILE_DIR,
+                "captured": list(self.captured)}
+
+    def _take(self) -> bool:
+        if not self.every or self._busy:
+            return False
+        self._seen += 1
+        return self._seen % self.every == 0
+
+    async def run(self, call, scope):
+        self._busy = True
+        cpu = cProfile.Profile() if self.mode in ("cpu", "both") else None
+        mem = self.mode in ("memory", "both") and not tracemalloc.is_tracing()
+        if mem:
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+        t0 = perf_counter()
+        try:
+            if cpu is not None:
+                cpu.enable()
+            try:
+                await call()
+            finally:
+                if cpu is not None:
+                    cpu.disable()
+        finally:
+            ms = (perf_counter() - t0) * 1000
+            after = tracemalloc.take_snapshot() if mem else None
+            if mem:
+                tracemalloc.stop()
+            self._busy = False
+            self._save(scope, ms, cpu, before if mem else None, after)
+
+    def _save(self, scope, ms, cpu, before, after):
+        route = metrics.route_template(scope)
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stem = os.path.join(PROFILE_DIR, f"{int(time.time() * 1000)}-"
+                                         f"{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')}-{os.getpid()}")
+        files = []
+        if cpu is not None:
+            cpu.dump_stats(stem + ".prof")
+            files.append(stem + ".prof")
+        if after is not None:
+            top = after.compare_to(before, "lineno")[:30]
+            with open(stem + ".mem.txt", "w", encoding="utf-8") as f:
+                f.write(f"{route}  {ms:.1f} ms\n" + "".join(f"{s}\n" for s in top))
+            files.append(stem + ".mem.txt")
+        if len(self.captured) == self.captured.maxlen:
+            for path in self.captured[0]["files"]:     # about to be evicted; keep the dir bounded too
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self.captured.append({"route": route, "ms": round(ms, 3), "files": files})
+
+
+profiler = Profiler()
+
+
+class TracingMiddleware:
+    """ASGI middleware opening the root span / sampled profile for HTTP requests."""
+
+    def __init__(self, app):
+        self.app = app
+        self._seen = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (ENABLED or profiler.every):
+            return await self.app(scope, receive, send)
+        call = functools.partial(self.app, scope, receive, send)
+        if ENABLED:
+            self._seen += 1
+            if self._seen % TRACE_EVERY == 0:
+                call = functools.partial(self._traced, call, scope)
+        if profiler._take():
+            return await profiler.run(call, scope)
+        return await call()
+
+    async def _traced(self, call, scope):
+        trace = _Trace()
+        root = _Span("http", {"method": scope["method"]}, trace, None)
+        try:
+            with root:
+                await call()
+        finally:
+            root.trace.spans[-1]["route"] = metrics.route_template(scope)
+            _submit(trace.spans)
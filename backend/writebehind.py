@@ -0,0 +1,202 @@
+"""
+writebehind.py — Group-commit buffer for the login hot-path writes.
+
+increment_failed / reset_failed and login-attempt appends only record their
+change in memory; a single writer thread drains the buffer every few
+milliseconds and persists everything in one transaction per database.
+
+Counter ops for the same user are folded:
+
+    (reset, delta)   reset=True  → failed_attempts = delta
+                     reset=False → failed_attempts += delta
+
+Appended rows are opaque tuples whose first element is the username.
+
+`pending()` / `pending_rows()` expose not-yet-committed changes so readers
+can overlay them on what they just read (read-your-writes). A batch is
+committed before it leaves the overlay, so a reader brackets its read with
+`read_seq()` (waits out a flush in progress) and `unchanged(seq)` (no flush
+started or finished since) and retries otherwise — else it could count a
+just-committed batch twice.
+"""
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def fold(first, second):
+    """Compose two (reset, delta) ops, `first` applied before `second`."""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if second[0]:
+        return second
+    return (first[0], first[1] + second[1])
+
+
+def apply_op(value: int, op) -> int:
+    if op is None:
+        return value
+    return op[1] if op[0] else value + op[1]
+
+
+class WriteBehind:
+    """Bounded write-behind buffer with a single flushing thread.
+
+    `apply_batch(ops, rows)` receives {username: (reset, delta)} and a list of
+    appended rows and must persist them atomically. When more than
+    `max_pending` users/rows are buffered, producers block until the writer
+    catches up.
+    """
+
+    def __init__(self, apply_batch, interval: float = 0.005, max_pending: int = 10000):
+        self._apply      = apply_batch
+        self.interval    = interval
+        self.max_pending = max(1, max_pending)
+        self._pending    = {}
+        self._rows       = []
+        self._inflight   = {}
+        self._inflight_rows = []
+        self._busy       = False
+        self._cond       = threading.Condition()
+        self._thread     = None
+        self._closed     = False
+        self.seq         = 0
+        self.batches = self.ops = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="fractalauth-writebehind",
+                                            daemon=True)
+            self._thread.start()
+
+    def _admit(self, full):
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        while full():
+            self._cond.notify_all()
+            self._cond.wait()
+
+    def submit(self, username: str, op):
+        with self._cond:
+            self._admit(lambda: username not in self._pending
+                        and len(self._pending) >= self.max_pending)
+            self._pending[username] = fold(self._pending.get(username), op)
+            self.ops += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def increment(self, username: str, n: int = 1):
+        self.submit(username, (False, n))
+
+    def reset(self, username: str):
+        self.submit(username, (True, 0))
+
+    def append(self, row: tuple):
+        with self._cond:
+            self._admit(lambda: len(self._rows) >= self.max_pending)
+            self._rows.append(row)
+            self.ops += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def discard(self, username: str):
+        with self._cond:
+            self._pending.pop(username, None)
+            self._rows = [r for r in self._rows if r[0] != username]
+
+    def pending(self, username: str):
+        """Uncommitted (reset, delta) for `username`, or None."""
+        with self._cond:
+            return fold(self._inflight.get(username), self._pending.get(username))
+
+    def pending_rows(self, username: str) -> list:
+        """Uncommitted appended rows for `username`, oldest first."""
+        with self._cond:
+            return [r for r in (*self._inflight_rows, *self._rows) if r[0] == username]
+
+    def read_seq(self) -> int:
+        """Wait until no flush is in progress and return `seq` for `unchanged`."""
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            return self.seq
+
+    def unchanged(self, seq: int) -> bool:
+        """True if no flush has started or committed since `read_seq()` returned `seq`."""
+        with self._cond:
+            return not self._busy and self.seq == seq
+
+    def _flush_once(self):
+        """Commit one batch: True on success, False on failure, None if idle."""
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            if not self._pending and not self._rows:
+                return None
+            self._busy = True
+            self._inflight, self._pending = self._pending, {}
+            self._inflight_rows, self._rows = self._rows, []
+            ops, rows = self._inflight, self._inflight_rows
+            self._cond.notify_all()
+        try:
+            self._apply(ops, rows)
+        except Exception:
+            log.exception("write-behind flush of %d ops / %d rows failed; will retry",
+                          len(ops), len(rows))
+            with self._cond:
+                for u, op in ops.items():
+                    self._pending[u] = fold(op, self._pending.get(u))
+                self._rows[:0] = rows
+                self._inflight, self._inflight_rows = {}, []
+                self._busy = False
+                self._cond.notify_all()
+            return False
+        with self._cond:
+            self._inflight, self._inflight_rows = {}, []
+            self._busy = False
+            self.seq += 1
+            self.batches += 1
+            self._cond.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._rows and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending and not self._rows:
+                    return
+            time.sleep(self.interval)
+            if self._flush_once() is False:
+                time.sleep(self.interval * 10)
+
+    def flush(self) -> bool:
+        """Synchronously commit everything buffered so far; False if a batch failed."""
+        while True:
+            with self._cond:
+                while self._busy:
+                    self._cond.wait()
+                if not self._pending and not self._rows:
+                    return True
+            if self._flush_once() is False:
+                return False
+
+    def close(self):
+        """Flush and stop the writer thread (shutdown hook)."""
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._pending), "pending_rows": len(self._rows),
+                    "ops": self.ops, "batches": self.batches}
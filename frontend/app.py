@@ -61,6 +61,7 @@ for k, v in {
     "username": "",     "fractal_type": "mandelbrot",
     "fractal_markers": [], "behavior_data": {},
     "risk_result": {},  "auth_complete": False,
+    "login_token": "",
 }.items():
     if k not in st.session_state:
         st.session_state[k] = v
@@ -89,6 +89,7 @@ def _login():
             if r.status_code == 200:
                 st.session_state.username      = username
                 st.session_state.fractal_type  = r.json()["fractal_type"]
+                st.session_state.login_token   = r.json()["token"]
                 st.session_state.behavior_data = {"session_start": time.time()}
                 st.session_state.step          = 2
                 st.rerun()
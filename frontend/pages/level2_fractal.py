@@ -70,7 +70,7 @@ def render_level2():
     existing_json = json.dumps(confirmed)
 
     components.html(
-        _build_fractal_html(fractal_type, mode, existing_json),
+        _build_fractal_html(fractal_type, mode, existing_json, _telemetry_url(mode)),
         height=540,
         scrolling=False,
     )
@@ -224,7 +224,7 @@ def _submit_level2(markers):
     else:
         # Login: send real behavior alongside marker verification
         r = requests.post(f"{API_URL}/login/level2", json={
-            "username": username,
+            "token":    st.session_state.get("login_token", ""),
             "markers":  markers,
             "behavior": {
                 "username":         username,
@@ -237,13 +237,23 @@ def _submit_level2(markers):
             },
         }, timeout=8)
         if r.status_code == 200:
+            st.session_state.login_token = r.json()["token"]
             st.session_state.step = 3
             st.rerun()
         else:
             st.error(r.json().get("detail", "Fractal key mismatch"))
 
 
-def _build_fractal_html(fractal_type: str, mode: str, existing_markers_json: str) -> str:
+def _telemetry_url(mode: str):
+    """WebSocket the iframe streams login behaviour to (None while registering)."""
+    token = st.session_state.get("login_token", "")
+    if mode != "login" or not token:
+        return None
+    return f"{API_URL.replace('http', 'ws', 1)}/login/telemetry?token={token}"
+
+
+def _build_fractal_html(fractal_type: str, mode: str, existing_markers_json: str,
+                        telemetry_url: str | None = None) -> str:
     fxmin = -2.5 if fractal_type == "mandelbrot" else -1.8
     fxmax =  1.0 if fractal_type == "mandelbrot" else  1.8
     fymin = -1.25 if fractal_type == "mandelbrot" else -1.2
@@ -317,6 +327,23 @@ const preloaded = {existing_markers_json};
 if (Array.isArray(preloaded) && preloaded.length > 0)
   S.markers = preloaded.map(m => ({{fx: m.fx, fy: m.fy}}));
 
+// ── Telemetry stream (login only): small event batches every 250ms ───────────
+const TELEMETRY_URL = {json.dumps(telemetry_url)};
+let T = {{ws: null, queue: []}};
+function tEmit(k, v) {{
+  if (!TELEMETRY_URL || T.queue.length >= 5000) return;
+  T.queue.push(v === undefined ? {{k}} : {{k, v}});
+}}
+function tFlush() {{
+  if (!T.ws || T.ws.readyState !== 1 || !T.queue.length) return;
+  T.ws.send(T.queue.map(e => JSON.stringify(e)).join('\\n'));
+  T.queue = [];
+}}
+if (TELEMETRY_URL) {{
+  try {{ T.ws = new WebSocket(TELEMETRY_URL); T.ws.onopen = tFlush; }} catch(err) {{}}
+  setInterval(tFlush, 250);
+}}
+
 // ── Behavioral state ─────────────────────────────────────────────────────────
 let B = {{
   speeds:          [],   // rolling px/ms samples from mousemove
@@ -337,6 +364,7 @@ setInterval(() => {{
   const gap = Date.now() - B.lastActivityAt;
   if (gap > 300 && gap < 20000) {{
     B.pauseDurations.push(gap);
+    tEmit('pause', gap);
   }}
 }}, 500);
 
@@ -418,6 +446,7 @@ function zoom(f) {{
   const hw=(S.xMax-S.xMin)*f/2, hh=(S.yMax-S.yMin)*f/2;
   S.xMin=cx-hw; S.xMax=cx+hw; S.yMin=cy-hh; S.yMax=cy+hh;
   B.zooms++;
+  tEmit('zoom');
   B.lastActivityAt=Date.now();
   render();
 }}
@@ -432,6 +461,7 @@ function clearMarkers() {{
   // Reset behavioral counters so fresh data is collected for new attempt
   B.speeds=[]; B.pauseDurations=[]; B.actionIntervals=[]; B.clickTimes=[];
   B.clicks=0; B.zooms=0; B.lastClickTime=null; B.t0=Date.now();
+  tEmit('reset');
   updateUI(); render();
 }}
 
@@ -450,7 +480,9 @@ canvas.addEventListener('mousemove', e => {{
     const dx=e.clientX-B.lastMovePos.x, dy=e.clientY-B.lastMovePos.y;
     const dt=now-B.lastMoveTime;
     if (dt>0 && dt<200) {{   // discard huge gaps (tab switches)
-      B.speeds.push(parseFloat((Math.sqrt(dx*dx+dy*dy)/dt).toFixed(4)));
+      const speed = parseFloat((Math.sqrt(dx*dx+dy*dy)/dt).toFixed(4));
+      B.speeds.push(speed);
+      tEmit('move', speed);
       if (B.speeds.length > 200) B.speeds.shift(); // cap rolling window
     }}
   }}
@@ -467,6 +499,7 @@ canvas.addEventListener('click', e => {{
   if (B.lastClickTime !== null) {{
     B.actionIntervals.push(now - B.lastClickTime);
   }}
+  tEmit('click', B.lastClickTime !== null ? now - B.lastClickTime : undefined);
   B.lastClickTime  = now;
   B.lastActivityAt = now;
   B.clicks++;
@@ -483,10 +516,11 @@ canvas.addEventListener('click', e => {{
   const fx=S.xMin+(px/canvas.width)*(S.xMax-S.xMin);
   const fy=S.yMin+(py/canvas.height)*(S.yMax-S.yMin);
   S.markers.push({{fx,fy}});
+  tEmit('marker', now - B.t0);
   updateUI();
   render();
 
-  if (S.markers.length===3) sendToStreamlit();
+  if (S.markers.length===3) {{ tFlush(); sendToStreamlit(); }}
 }});
 
 // ── UI helpers ────────────────────────────────────────────────────────────────
@@ -503,15 +537,19 @@ function setStatus(msg,cls) {{
 
 // ── Push data to Streamlit via parent window URL param ────────────────────────
 function sendToStreamlit() {{
+  // While streaming, the server already holds the aggregates: send only a
+  // one-sample summary (fallback + live preview), never the sample arrays.
+  const mean = arr => arr.length ? [arr.reduce((a,b)=>a+b,0)/arr.length] : [];
+  const streamed = TELEMETRY_URL !== null;
   const payload = {{
     markers: S.markers,
     behavior: {{
-      mouse_speeds:     B.speeds.slice(-80),      // last 80 speed samples
-      pause_durations:  B.pauseDurations,         // real inactivity gaps
+      mouse_speeds:     streamed ? mean(B.speeds) : B.speeds.slice(-80),   // last 80 speed samples
+      pause_durations:  streamed ? mean(B.pauseDurations) : B.pauseDurations,
       click_count:      B.clicks,
       zoom_count:       B.zooms,
       fractal_time_ms:  Date.now() - B.t0,        // total ms on this fractal
-      action_intervals: B.actionIntervals,        // inter-click timing
+      action_intervals: streamed ? [] : B.actionIntervals,   // inter-click timing
     }}
   }};
   try {{
@@ -135,7 +135,7 @@ def _run_risk_assessment():
         r = requests.post(
             f"{API_URL}/login/risk-assessment",
             json={
-                "username": username,
+                "token":    st.session_state.get("login_token", ""),
                 "behavior": {
                     "username":         username,
                     "mouse_speeds":     beh.get("mouse_speeds",    [0.3, 0.25, 0.28]),
@@ -153,6 +153,7 @@ def _run_risk_assessment():
         )
         if r.status_code == 200:
             st.session_state.risk_result = r.json()
+            st.session_state.login_token = r.json()["token"]
         else:
             st.error(r.json().get("detail", "Risk assessment failed"))
             st.session_state.risk_result = {"error": True}
@@ -162,11 +163,10 @@ def _run_risk_assessment():
 
 
 def _verify(answer: str):
-    username = st.session_state.username
     try:
         r = requests.post(
             f"{API_URL}/login/verify-puzzle",
-            json={"username": username, "answer": answer},
+            json={"token": st.session_state.get("login_token", ""), "answer": answer},
             timeout=8,
         )
         if r.status_code == 200: